@@ -0,0 +1,187 @@
+import os
+
+from qgis.PyQt.QtCore import QVariant
+
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsFeature,
+    QgsField,
+    QgsFields,
+    QgsProject,
+    QgsVectorFileWriter,
+    QgsWkbTypes,
+)
+
+from kart.kartapi import geometryFromHexWkb, KartException
+
+GPKG = "GPKG"
+FLATGEOBUF = "FlatGeobuf"
+
+DRIVERS = {".gpkg": GPKG, ".fgb": FLATGEOBUF}
+
+CHANGE_TYPE_FIELD = "kart_change"
+# Holds the "<changetype>::<fid>" ids that the bundled diff styles use
+CHANGE_ID_FIELD = "id"
+
+CHANGE_TYPE_NAMES = {
+    "I": "insert",
+    "U-": "update_old",
+    "U+": "update_new",
+    "D": "delete",
+}
+
+FIELD_TYPES = {
+    "integer": QVariant.LongLong,
+    "float": QVariant.Double,
+    "boolean": QVariant.Bool,
+}
+
+
+def driverForFile(filename):
+    """
+    Returns the OGR driver to use for a diff export file, based on its extension
+    """
+    ext = os.path.splitext(filename)[-1].lower()
+    try:
+        return DRIVERS[ext]
+    except KeyError:
+        raise KartException(
+            f"Unsupported diff export format '{ext}'. "
+            "Use a GeoPackage (.gpkg) or FlatGeobuf (.fgb) file"
+        )
+
+
+class DatasetDiffWriter:
+    """
+    Writes the changed features of a single dataset into a vector file
+    """
+
+    def __init__(self, dataset, schema, filename, driver, overwriteFile):
+        self.dataset = dataset
+        self.count = 0
+        self.geomColumn = None
+        self.pkColumn = None
+        crs = QgsCoordinateReferenceSystem()
+        geomType = QgsWkbTypes.NoGeometry
+        for column in schema:
+            if column.get("primaryKeyIndex") == 0:
+                self.pkColumn = column["name"]
+            if column["dataType"] == "geometry" and self.geomColumn is None:
+                self.geomColumn = column["name"]
+                geomTypeName = column.get("geometryType", "").replace(" ", "")
+                geomType = QgsWkbTypes.parseType(geomTypeName)
+                crs = QgsCoordinateReferenceSystem(column.get("geometryCRS", ""))
+
+        self.columns = [c["name"] for c in schema if c["name"] != self.geomColumn]
+        changeIdField = CHANGE_ID_FIELD
+        if changeIdField in self.columns:
+            changeIdField = f"kart_{CHANGE_ID_FIELD}"
+        self.fields = QgsFields()
+        self.fields.append(QgsField(changeIdField, QVariant.String))
+        self.fields.append(QgsField(CHANGE_TYPE_FIELD, QVariant.String))
+        for column in schema:
+            if column["name"] == self.geomColumn:
+                continue
+            fieldType = FIELD_TYPES.get(column["dataType"], QVariant.String)
+            self.fields.append(QgsField(column["name"], fieldType))
+
+        if driver == GPKG:
+            self.source = f"{filename}|layername={layerNameForDataset(dataset)}"
+            layerFilename = filename
+        else:
+            # FlatGeobuf files hold a single layer, so use one file per dataset
+            base, ext = os.path.splitext(filename)
+            layerFilename = f"{base}_{layerNameForDataset(dataset)}{ext}"
+            self.source = layerFilename
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = driver
+        options.fileEncoding = "utf-8"
+        options.layerName = layerNameForDataset(dataset)
+        options.layerOptions = ["SPATIAL_INDEX=YES"]
+        if overwriteFile or driver != GPKG:
+            options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteFile
+        else:
+            options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+        self.writer = QgsVectorFileWriter.create(
+            layerFilename,
+            self.fields,
+            geomType,
+            crs,
+            QgsProject.instance().transformContext(),
+            options,
+        )
+        if self.writer.hasError():
+            raise KartException(
+                f"Could not create diff layer for dataset '{dataset}': "
+                f"{self.writer.errorMessage()}"
+            )
+
+    def addFeature(self, changetype, values):
+        feature = QgsFeature(self.fields)
+        pk = values.get(self.pkColumn)
+        attributes = [f"{changetype}::{pk}", CHANGE_TYPE_NAMES[changetype]]
+        attributes.extend(values.get(column) for column in self.columns)
+        feature.setAttributes(attributes)
+        if self.geomColumn is not None:
+            feature.setGeometry(geometryFromHexWkb(values.get(self.geomColumn)))
+        self.writer.addFeature(feature)
+        self.count += 1
+
+    def close(self):
+        # Deleting the writer flushes features and builds the spatial index
+        del self.writer
+
+
+def layerNameForDataset(dataset):
+    return dataset.replace("/", "_")
+
+
+def exportDiff(repo, filename, refa=None, refb=None, dataset=None, feedback=None):
+    """
+    Streams the changes between two refs (or in the working copy) into a
+    GeoPackage or FlatGeobuf file, with a layer for each changed dataset.
+
+    Features are written as they are received from Kart, so the diff is never
+    held in memory as a whole. Each feature carries its change type.
+
+    Returns a dict with the source of the created layer for each dataset.
+    """
+    driver = driverForFile(filename)
+    schemaRef = refa or "HEAD"
+    writer = None
+    skipped = set()
+    sources = {}
+    changes = repo.diffFeatures(refa, refb, dataset)
+    try:
+        for name, changetype, values in changes:
+            if name in skipped:
+                continue
+            if writer is None or writer.dataset != name:
+                if writer is not None:
+                    writer.close()
+                    sources[writer.dataset] = writer.source
+                    writer = None
+                schema = repo.datasetSchema(name, schemaRef)
+                hasGeometry = any(c["dataType"] == "geometry" for c in schema)
+                if driver == FLATGEOBUF and not hasGeometry:
+                    skipped.add(name)
+                    if feedback is not None:
+                        feedback.pushInfo(
+                            f"Skipping dataset '{name}', FlatGeobuf files "
+                            "cannot store tables without geometries"
+                        )
+                    continue
+                writer = DatasetDiffWriter(
+                    name, schema, filename, driver, overwriteFile=not sources
+                )
+                if feedback is not None:
+                    feedback.pushInfo(f"Exporting changes for dataset '{name}'")
+            writer.addFeature(changetype, values)
+            if feedback is not None and feedback.isCanceled():
+                break
+    finally:
+        changes.close()
+        if writer is not None:
+            writer.close()
+            sources[writer.dataset] = writer.source
+    return sources
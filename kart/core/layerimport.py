@@ -0,0 +1,272 @@
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from osgeo import gdal
+
+from qgis.core import (
+    QgsFeedback,
+    QgsProject,
+    QgsTask,
+    QgsVectorFileWriter,
+    QgsVectorLayer,
+)
+
+from kart.kartapi import Repository, KartException, kartInstallation
+
+# Number of features written to the intermediate file at a time
+CHUNK_SIZE = 10000
+
+# Share of the progress bar used by the conversion step, when one is needed
+CONVERSION_PROGRESS = 80
+
+
+def needsConversion(filepath):
+    """
+    Returns True if the file is not in a format that Kart can import directly
+    """
+    ext = os.path.splitext(filepath)[-1].lower()
+    return ext not in Repository.supportedImportExtensions()
+
+
+def _addFeatures(writer, features):
+    if not writer.addFeatures(features):
+        raise KartException(
+            "Could not convert the selected layer to a gpkg file: "
+            f"{writer.errorMessage()}"
+        )
+
+
+def convertToGpkg(filepath, dst, feedback=None, progressShare=100):
+    """
+    Converts an OGR readable file into a GeoPackage, writing features in
+    chunks so progress can be reported and the conversion can be canceled.
+
+    Returns the path to the created GeoPackage, or None if canceled.
+    """
+    layer = QgsVectorLayer(filepath, "", "ogr")
+    if not layer.isValid():
+        raise KartException("The selected file is not a valid vector layer")
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    filename = os.path.join(dst, f"{name}.gpkg")
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "GPKG"
+    options.fileEncoding = "utf-8"
+    options.layerName = name
+    writer = QgsVectorFileWriter.create(
+        filename,
+        layer.fields(),
+        layer.wkbType(),
+        layer.crs(),
+        QgsProject.instance().transformContext(),
+        options,
+    )
+    if writer.hasError():
+        raise KartException(
+            "Could not convert the selected layer to a gpkg file: "
+            f"{writer.errorMessage()}"
+        )
+    total = layer.featureCount()
+    chunk = []
+    count = 0
+    try:
+        for feature in layer.getFeatures():
+            chunk.append(feature)
+            if len(chunk) == CHUNK_SIZE:
+                _addFeatures(writer, chunk)
+                count += len(chunk)
+                chunk = []
+                if feedback is not None:
+                    if feedback.isCanceled():
+                        return None
+                    if total > 0:
+                        feedback.setProgress(progressShare * count / total)
+        _addFeatures(writer, chunk)
+    finally:
+        del writer
+    return filename
+
+
+def importFile(repo, filepath, dataset=None, feedback=None):
+    """
+    Imports a file into a repository.
+
+    Files in formats supported by Kart are passed to Kart directly. Any other
+    OGR readable file is converted to an intermediate GeoPackage first, which
+    is removed once the import is finished, even if it fails.
+
+    Returns False if the import was canceled.
+    """
+    if not needsConversion(filepath):
+        repo.importIntoRepo(filepath, dataset)
+        return True
+    with tempfile.TemporaryDirectory() as tmpfolder:
+        converted = convertToGpkg(filepath, tmpfolder, feedback, CONVERSION_PROGRESS)
+        if converted is None:
+            return False
+        if feedback is not None:
+            feedback.setProgress(CONVERSION_PROGRESS)
+        repo.importIntoRepo(converted, dataset)
+    if feedback is not None:
+        feedback.setProgress(100)
+    return True
+
+
+def _splitSource(source):
+    """
+    Splits an OGR layer source into its file path and layer name, if any
+    """
+    path, _, options = source.partition("|")
+    layername = None
+    for option in options.split("|"):
+        key, _, value = option.partition("=")
+        if key == "layername":
+            layername = value
+    return path, layername
+
+
+def _datasetName(path, layername, used):
+    name = layername or os.path.splitext(os.path.basename(path))[0]
+    name = re.sub(r"\W", "_", name)
+    candidate = name
+    i = 2
+    while candidate in used:
+        candidate = f"{name}_{i}"
+        i += 1
+    used.add(candidate)
+    return candidate
+
+
+def _translate(dst, path, layername, name, update):
+    options = gdal.VectorTranslateOptions(
+        format="GPKG",
+        accessMode="update" if update else None,
+        layerName=name,
+        layers=[layername] if layername else None,
+    )
+    ret = gdal.VectorTranslate(dst, path, options=options)
+    if ret is None:
+        raise KartException(f"Could not convert '{path}': {gdal.GetLastErrorMsg()}")
+    # Dereferencing the dataset closes it and flushes it to disk
+    ret = None
+
+
+def _defaultLayerName(path):
+    """
+    Returns the name of the layer that OGR opens for a path without a
+    layer name (the first one), or None if the file cannot be read
+    """
+    dataset = gdal.OpenEx(path, gdal.OF_VECTOR)
+    if dataset is None or not dataset.GetLayerCount():
+        return None
+    return dataset.GetLayer(0).GetName()
+
+
+def importLayers(repo, sources, message=None, parallel=False, feedback=None):
+    """
+    Imports several layers into a repository with a single Kart import, so
+    a single commit is created.
+
+    Sources are OGR layer sources (a path, optionally followed by
+    '|layername=...'). If they are all tables of a single file that Kart can
+    import, that file is imported directly. Otherwise, all layers are
+    gathered into a staging GeoPackage first.
+
+    If parallel is True and Kart can amend commits when importing, sources
+    are instead converted concurrently into separate files, which are then
+    imported one after the other into a single commit.
+
+    Returns False if the import was canceled.
+    """
+    splitSources = [_splitSource(source) for source in sources]
+    paths = {path for path, _ in splitSources}
+    if len(paths) == 1:
+        path = paths.pop()
+        if not needsConversion(path):
+            tables = [
+                layername or _defaultLayerName(path) for _, layername in splitSources
+            ]
+            if all(tables):
+                repo.importIntoRepo(path, tables=tables, message=message)
+                return True
+
+    used = set()
+    names = [_datasetName(path, layername, used) for path, layername in splitSources]
+    parallel = parallel and kartInstallation().supportsImportAmend
+    with tempfile.TemporaryDirectory() as tmpfolder:
+        done = 0
+
+        def _progress():
+            if feedback is not None:
+                feedback.setProgress(CONVERSION_PROGRESS * done / len(splitSources))
+                return not feedback.isCanceled()
+            return True
+
+        if parallel:
+            converted = [os.path.join(tmpfolder, f"{name}.gpkg") for name in names]
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                futures = [
+                    executor.submit(_translate, dst, path, layername, name, False)
+                    for dst, (path, layername), name in zip(
+                        converted, splitSources, names
+                    )
+                ]
+                for future in futures:
+                    future.result()
+                    done += 1
+                    if not _progress():
+                        # Executor.shutdown(cancel_futures=True) requires
+                        # Python 3.9
+                        for f in futures:
+                            f.cancel()
+                        return False
+            # Amending needs an explicit message, or Kart asks for one
+            message = message or f"Import {', '.join(names)}"
+            for i, (dst, name) in enumerate(zip(converted, names)):
+                repo.importIntoRepo(dst, tables=[name], message=message, amend=i > 0)
+        else:
+            staging = os.path.join(tmpfolder, "import.gpkg")
+            for i, ((path, layername), name) in enumerate(zip(splitSources, names)):
+                _translate(staging, path, layername, name, update=i > 0)
+                done += 1
+                if not _progress():
+                    return False
+            repo.importIntoRepo(staging, allTables=True, message=message)
+    if feedback is not None:
+        feedback.setProgress(100)
+    return True
+
+
+class ImportTask(QgsTask):
+    """
+    Task to import a file into a repository in a background thread
+    """
+
+    def __init__(self, repo, filepath, dataset=None, onFinished=None):
+        super().__init__(
+            f"Import {os.path.basename(filepath)} into Kart repository",
+            QgsTask.CanCancel,
+        )
+        self.repo = repo
+        self.filepath = filepath
+        self.dataset = dataset
+        self.onFinished = onFinished
+        self.exception = None
+        self.feedback = QgsFeedback()
+        self.feedback.progressChanged.connect(self.setProgress)
+
+    def cancel(self):
+        self.feedback.cancel()
+        super().cancel()
+
+    def run(self):
+        try:
+            return importFile(self.repo, self.filepath, self.dataset, self.feedback)
+        except Exception as e:
+            self.exception = e
+            return False
+
+    def finished(self, result):
+        if self.onFinished is not None:
+            self.onFinished(result, self.exception)
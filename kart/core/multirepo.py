@@ -0,0 +1,198 @@
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from qgis.PyQt.QtCore import pyqtSignal
+
+from qgis.core import QgsTask
+
+from kart import instrumentation, logging
+from kart.kartapi import ChangeBatch, KartException, coalescedChanges
+
+# Maximum number of repositories that are processed at the same time
+MAX_WORKERS = 4
+
+REFRESH = "refresh"
+PULL = "pull"
+STATUS = "status"
+
+
+class RepoResult:
+    """
+    Outcome of running an operation on a single repository
+    """
+
+    def __init__(self, repo, status=None, message="", error=None, pulled=False):
+        self.repo = repo
+        self.status = status
+        self.message = message
+        self.error = error
+        # True if new changes may have been brought into the working copy
+        self.pulled = pulled
+
+
+def statusText(status):
+    """
+    Returns a short description of the status returned by Repository.status
+    """
+    parts = [f"On branch {status.get('branch') or status.get('abbrevCommit')}"]
+    upstream = status.get("upstream")
+    if upstream:
+        ahead = upstream.get("ahead", 0)
+        behind = upstream.get("behind", 0)
+        if ahead or behind:
+            parts.append(
+                f"{ahead} commits ahead and {behind} behind {upstream['branch']}"
+            )
+        else:
+            parts.append(f"up to date with {upstream['branch']}")
+    changes = (status.get("workingCopy") or {}).get("changes") or {}
+    count = sum(
+        sum(counts.values())
+        for datasetChanges in changes.values()
+        for counts in datasetChanges.values()
+    )
+    parts.append(f"{count} uncommitted changes" if count else "no uncommitted changes")
+    return ", ".join(parts)
+
+
+def refreshRepo(repo):
+    repo.fetch()
+    status = repo.status()
+    return RepoResult(repo, status, f"Fetched. {statusText(status)}")
+
+
+def pullRepo(repo):
+    status = repo.status()
+    if not status.get("upstream"):
+        return RepoResult(repo, status, "Skipped, the current branch has no upstream")
+    # The "before pull" bus signal is sent by pull() itself, so skipped repos
+    # are not announced
+    if repo.pull(refreshLayers=False):
+        message = "Pulled"
+    else:
+        message = "Pulled with conflicts. Resolve them and commit to complete it"
+    status = repo.status()
+    return RepoResult(repo, status, f"{message}. {statusText(status)}", pulled=True)
+
+
+def statusRepo(repo):
+    status = repo.status()
+    return RepoResult(repo, status, statusText(status))
+
+
+OPERATIONS = {
+    REFRESH: ("Refresh repositories", refreshRepo),
+    PULL: ("Pull repositories", pullRepo),
+    STATUS: ("Repositories status", statusRepo),
+}
+
+
+def _runOnRepo(func, repo):
+    with instrumentation.action(func.__name__):
+        try:
+            return func(repo)
+        except KartException as e:
+            return RepoResult(repo, error=str(e))
+        except Exception as e:
+            # Any other error only fails this repo, not the whole operation
+            logging.error("Error running %s on %s", func.__name__, repo.path)
+            return RepoResult(repo, error=f"{type(e).__name__}: {e}")
+
+
+def runOnRepos(repos, func, onResult=None, isCanceled=None, maxWorkers=MAX_WORKERS):
+    """
+    Runs a function that takes a repository and returns a RepoResult on all
+    the given repositories, with up to maxWorkers of them at the same time.
+
+    Errors are captured in the result of the corresponding repo. The
+    onResult callback is called with each result as soon as it is available.
+
+    Returns the list of results, in the same order as the repositories
+    """
+    results = {}
+    if not repos:
+        return []
+    with ThreadPoolExecutor(max_workers=min(maxWorkers, len(repos))) as executor:
+        futures = [executor.submit(_runOnRepo, func, repo) for repo in repos]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.repo.path] = result
+            if onResult is not None:
+                onResult(result)
+            if isCanceled is not None and isCanceled():
+                # Executor.shutdown(cancel_futures=True) requires Python 3.9
+                for f in futures:
+                    f.cancel()
+                break
+    return [results[repo.path] for repo in repos if repo.path in results]
+
+
+def resultsReport(title, results):
+    """
+    Returns an HTML report of the results of an operation on several repos
+    """
+    failed = [r for r in results if r.error is not None]
+    lines = [
+        f"<p><b>{title}: {len(results) - len(failed)} succeeded, "
+        f"{len(failed)} failed</b></p>",
+        "<ul>",
+    ]
+    for result in results:
+        if result.error is not None:
+            error = "<br>".join(
+                line for line in result.error.splitlines() if line.strip()
+            )
+            lines.append(
+                f'<li>{result.repo.path}: <span style="color:red">{error}</span></li>'
+            )
+        else:
+            lines.append(f"<li>{result.repo.path}: {result.message}</li>")
+    lines.append("</ul>")
+    return "\n".join(lines)
+
+
+class MultiRepoTask(QgsTask):
+    """
+    Task to run one of the OPERATIONS on several repositories in a
+    background thread. repoFinished is emitted with the RepoResult of each
+    repository as soon as it is finished.
+
+    Bus signals for the changes made to the repositories are sent from the
+    main thread: a "before" one for each repo, when its working copy is
+    about to change, and a single "after" one when the task is finished
+    """
+
+    repoFinished = pyqtSignal(object)
+
+    def __init__(self, operation, repos, onFinished=None):
+        self.title, self.func = OPERATIONS[operation]
+        super().__init__(self.title, QgsTask.CanCancel)
+        self.repos = list(repos)
+        self.onFinished = onFinished
+        self.results = []
+        self.done = 0
+        self.batch = ChangeBatch(deferred=True)
+        self.changes = None
+
+    def _repoFinished(self, result):
+        self.done += 1
+        self.setProgress(100 * self.done / len(self.repos))
+        self.repoFinished.emit(result)
+
+    def run(self):
+        @functools.wraps(self.func)
+        def func(repo):
+            # Changes made in each worker thread are added to the same batch
+            with coalescedChanges(self.batch):
+                return self.func(repo)
+
+        self.results = runOnRepos(self.repos, func, self._repoFinished, self.isCanceled)
+        # Computed here, since it may need to run Kart
+        self.changes = self.batch.summary()
+        return not self.isCanceled()
+
+    def finished(self, result):
+        if self.batch.announced:
+            self.batch.send(self.changes)
+        if self.onFinished is not None:
+            self.onFinished(self.results)
@@ -0,0 +1,170 @@
+"""
+Computes the vertices added, removed, moved and left unchanged between two
+versions of a geometry.
+
+Vertices are compared on their coordinates, rounded to PRECISION decimals.
+A vertex that exists in both versions is unchanged. The remaining vertices
+are grouped by the unchanged vertex that precedes them, and those at the same
+position in a group in both versions are considered moved. Any other old
+vertex was removed, and any other new one was added.
+
+Coordinates are handled as NumPy arrays if NumPy is available, and with plain
+Python otherwise.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ADDED = "A"
+REMOVED = "R"
+MOVED = "M"
+UNCHANGED = "U"
+
+PRECISION = 5
+
+
+def _flatten(coords, points):
+    if coords and isinstance(coords[0], (int, float)):
+        points.append(coords[:2])
+    else:
+        for item in coords:
+            _flatten(item, points)
+
+
+def geojsonCoordinates(geometry):
+    """
+    Returns the list of [x, y] vertices of a GeoJSON geometry, in order
+    """
+    points = []
+    if not geometry:
+        return points
+    if geometry["type"] == "GeometryCollection":
+        for part in geometry["geometries"]:
+            points.extend(geojsonCoordinates(part))
+    else:
+        _flatten(geometry["coordinates"], points)
+    return points
+
+
+def _groupPositions(matched):
+    """
+    For a sequence of booleans telling which vertices are unchanged, returns
+    a (group, position) pair for each vertex, where group is the number of
+    unchanged vertices up to it and position its distance to the last one
+    """
+    positions = []
+    group = 0
+    last = -1
+    for i, isMatched in enumerate(matched):
+        if isMatched:
+            group += 1
+            last = i
+        positions.append((group, i - last))
+    return positions
+
+
+def _pythonVertexDiff(old, new):
+    def key(point):
+        return (round(point[0], PRECISION), round(point[1], PRECISION))
+
+    oldKeys = [key(p) for p in old]
+    newKeys = [key(p) for p in new]
+    oldSet = set(oldKeys)
+    newSet = set(newKeys)
+    oldMatched = [k in newSet for k in oldKeys]
+    newMatched = [k in oldSet for k in newKeys]
+    oldPositions = _groupPositions(oldMatched)
+    newPositions = _groupPositions(newMatched)
+    oldUnmatched = {pos for pos, m in zip(oldPositions, oldMatched) if not m}
+    newUnmatched = {pos for pos, m in zip(newPositions, newMatched) if not m}
+
+    changes = []
+    for point, matched, pos in zip(old, oldMatched, oldPositions):
+        if matched:
+            changes.append((point[0], point[1], UNCHANGED))
+        elif pos not in newUnmatched:
+            changes.append((point[0], point[1], REMOVED))
+    for point, matched, pos in zip(new, newMatched, newPositions):
+        if matched:
+            continue
+        changetype = MOVED if pos in oldUnmatched else ADDED
+        changes.append((point[0], point[1], changetype))
+    return changes
+
+
+def _numpyGroupPositions(matched, base):
+    indices = numpy.arange(len(matched))
+    group = numpy.cumsum(matched)
+    last = numpy.maximum.accumulate(numpy.where(matched, indices, -1))
+    # A single integer per (group, position) pair makes them comparable
+    # with numpy.isin
+    return group * base + (indices - last)
+
+
+def _numpyVertexDiff(old, new):
+    old = numpy.asarray(old, dtype=float).reshape(-1, 2)
+    new = numpy.asarray(new, dtype=float).reshape(-1, 2)
+    rounded = numpy.round(old, PRECISION)
+    oldKeys = rounded[:, 0] + 1j * rounded[:, 1]
+    rounded = numpy.round(new, PRECISION)
+    newKeys = rounded[:, 0] + 1j * rounded[:, 1]
+    oldMatched = numpy.isin(oldKeys, newKeys)
+    newMatched = numpy.isin(newKeys, oldKeys)
+
+    base = max(len(old), len(new)) + 1
+    oldPositions = _numpyGroupPositions(oldMatched, base)[~oldMatched]
+    newPositions = _numpyGroupPositions(newMatched, base)[~newMatched]
+    moved = numpy.isin(newPositions, oldPositions)
+    removed = ~numpy.isin(oldPositions, newPositions)
+
+    unchangedPoints = old[oldMatched]
+    removedPoints = old[~oldMatched][removed]
+    addedPoints = new[~newMatched][~moved]
+    movedPoints = new[~newMatched][moved]
+    changes = []
+    for points, changetype in (
+        (unchangedPoints, UNCHANGED),
+        (removedPoints, REMOVED),
+        (movedPoints, MOVED),
+        (addedPoints, ADDED),
+    ):
+        changes.extend((x, y, changetype) for x, y in points.tolist())
+    return changes
+
+
+def vertexDiff(oldGeometry, newGeometry):
+    """
+    Compares the vertices of two versions of a GeoJSON geometry, any of which
+    can be None.
+
+    Returns a list of (x, y, changetype) tuples, with changetype being one of
+    ADDED, REMOVED, MOVED or UNCHANGED. Moved vertices are returned at their
+    new location
+    """
+    old = geojsonCoordinates(oldGeometry)
+    new = geojsonCoordinates(newGeometry)
+    if numpy is not None:
+        return _numpyVertexDiff(old, new)
+    return _pythonVertexDiff(old, new)
+
+
+def datasetVertexDiff(pairs, cache=None):
+    """
+    Compares the vertices of all the given (key, oldGeometry, newGeometry)
+    tuples and returns the concatenated list of changes.
+
+    If a cache dict is passed, the changes for each pair are stored in it
+    under the pair key, and reused when it is already there
+    """
+    changes = []
+    for key, old, new in pairs:
+        if cache is not None and key in cache:
+            pairChanges = cache[key]
+        else:
+            pairChanges = vertexDiff(old, new)
+            if cache is not None:
+                cache[key] = pairChanges
+        changes.extend(pairChanges)
+    return changes
@@ -8,18 +8,41 @@ from qgis.core import (
     Qgis,
     QgsApplication,
     QgsAuthMethodConfig,
+    QgsTask,
 )
 
 from qgis.gui import QgsAuthSettingsWidget, QgsMessageBar
 
-from kart.kartapi import Repository
-from kart.utils import waitcursor
+from kart.kartapi import Repository, KartException
+from kart.utils import confirm
 
 WIDGET, BASE = uic.loadUiType(
     os.path.join(os.path.dirname(__file__), "dbconnectiondialog.ui")
 )
 
 
+class ListTablesTask(QgsTask):
+    """
+    Task to list the tables in a database in a background thread
+    """
+
+    def __init__(self, url, onFinished):
+        super().__init__("List database tables", QgsTask.CanCancel)
+        self.url = url
+        self.onFinished = onFinished
+        self.tables = None
+
+    def run(self):
+        try:
+            self.tables = Repository.tablesToImport(self.url)
+        except KartException:
+            return False
+        return not self.isCanceled()
+
+    def finished(self, result):
+        self.onFinished(self)
+
+
 class DbConnectionDialog(BASE, WIDGET):
     def __init__(self, parent=None):
         parent = parent or iface.mainWindow()
@@ -36,11 +59,19 @@ class DbConnectionDialog(BASE, WIDGET):
 
         self.btnLoadTables.clicked.connect(self.loadTables)
         self.buttonBox.accepted.connect(self.okClicked)
+        self.txtFilter.textChanged.connect(self.filterTables)
+        self.finished.connect(self.cancelLoading)
 
         formats = Repository.supportedDbTypes()
         for name, protocol in formats.items():
             self.comboDbType.addItem(name, protocol)
 
+        self.url = None
+        self.tables = []
+        # True if the user chose to import all the tables of the database
+        self.allTables = False
+        self.loadTask = None
+        self.acceptWhenLoaded = False
         self.resetTables()
 
         self.comboDbType.currentIndexChanged.connect(self.resetTables)
@@ -50,49 +81,117 @@ class DbConnectionDialog(BASE, WIDGET):
         self.txtDatabase.textChanged.connect(self.resetTables)
 
     def resetTables(self):
-        self.comboTable.clear()
-        self.comboTable.addItem("All tables", None)
+        self.cancelLoading()
+        self.listTables.clear()
+        self.loadedUrl = None
+
+    def cancelLoading(self):
+        if self.loadTask is not None:
+            self.loadTask.cancel()
+        self._setLoadTask(None)
+
+    def _setLoadTask(self, task):
+        self.loadTask = task
+        self.progressTables.setVisible(task is not None)
+        self.btnLoadTables.setEnabled(task is None)
+        if task is None:
+            self.acceptWhenLoaded = False
 
     def loadTables(self):
+        """
+        Lists the tables in the database in the background, unless they were
+        listed recently
+        """
         self.resetTables()
         url = self._getUrl()
-        try:
-            tables = self._getTables(url)
-        except Exception:
+        tables = Repository.cachedTablesToImport(url)
+        if tables is not None:
+            self._setTables(url, tables)
+            return
+        task = ListTablesTask(url, self._tablesLoaded)
+        self._setLoadTask(task)
+        QgsApplication.taskManager().addTask(task)
+
+    def _tablesLoaded(self, task):
+        # Results of a listing canceled or replaced by a newer one are ignored
+        if task is not self.loadTask:
+            return
+        acceptWhenLoaded = self.acceptWhenLoaded
+        self._setLoadTask(None)
+        if task.tables is None:
             self.bar.pushMessage(
                 "Cannot connect to the provided database table(s)",
                 Qgis.Warning,
                 duration=5,
             )
             return
-        for table in tables:
-            table = table.replace(".", "/")
-            self.comboTable.addItem(table, table)
-        self.bar.pushMessage(
-            "Tables correctly loaded into tables list", Qgis.Success, duration=5
-        )
+        self._setTables(task.url, task.tables)
+        if acceptWhenLoaded:
+            self._accept()
+        else:
+            self.bar.pushMessage(
+                "Tables correctly loaded into tables list", Qgis.Success, duration=5
+            )
 
-    def okClicked(self):
-        url = self._getUrl()
+    def _setTables(self, url, tables):
+        self.listTables.setUpdatesEnabled(False)
         try:
-            self._getTables(url)
-        except Exception:
+            self.listTables.addItems(tables)
+        finally:
+            self.listTables.setUpdatesEnabled(True)
+        self.loadedUrl = url
+        self.filterTables()
+
+    def filterTables(self):
+        text = self.txtFilter.text().strip().lower()
+        self.listTables.setUpdatesEnabled(False)
+        try:
+            for i in range(self.listTables.count()):
+                item = self.listTables.item(i)
+                item.setHidden(text not in item.text().lower())
+        finally:
+            self.listTables.setUpdatesEnabled(True)
+
+    def selectedTables(self):
+        """
+        Returns the names of the selected tables, including those hidden by
+        the filter
+        """
+        return [item.text() for item in self.listTables.selectedItems()]
+
+    def okClicked(self):
+        # The connection is checked by listing its tables before accepting
+        if self.loadTask is None and self.loadedUrl != self._getUrl():
+            self.loadTables()
+        if self.loadTask is not None:
+            self.acceptWhenLoaded = True
+        elif self.loadedUrl is not None:
+            self._accept()
+
+    def _accept(self):
+        if not self.listTables.count():
             self.bar.pushMessage(
-                "Cannot connect to the provided database table(s)",
+                "There are no tables to import in the database",
                 Qgis.Warning,
                 duration=5,
             )
             return
-        table = self.comboTable.currentData()
-        if table is not None:
-            url = f"{url}/{table}"
-        self.url = url
+        tables = self.selectedTables()
+        # Importing all tables is never done implicitly, since databases can
+        # have thousands of them
+        if not tables and not confirm(
+            f"No tables are selected. Do you want to import all the "
+            f"{self.listTables.count():,} tables in the database?"
+        ):
+            self.bar.pushMessage(
+                "Select the tables to import", Qgis.Warning, duration=5
+            )
+            return
+        self.url = self.loadedUrl
+        self.tables = tables
+        self.allTables = not tables
         self.accept()
 
-    @waitcursor
-    def _getTables(self, url):
-        return Repository.tablesToImport(url)
-
     def _getUrl(self):
         if self.authWidget.configurationTabIsSelected():
             authid = self.authWidget.configId()
@@ -2,7 +2,6 @@
 
 import os
 import json
-import difflib
 
 from qgis.PyQt import uic
 from qgis.PyQt.QtCore import Qt, pyqtSignal
@@ -15,10 +14,12 @@ from qgis.PyQt.QtWidgets import (
     QDialog,
     QTreeWidgetItemIterator,
     QSizePolicy,
+    QPushButton,
 )
 
 from qgis.core import (
     edit,
+    QgsApplication,
     QgsProject,
     QgsFeature,
     QgsRasterLayer,
@@ -28,6 +29,7 @@ from qgis.core import (
     Qgis,
     QgsGeometry,
     QgsPointXY,
+    QgsTask,
     QgsWkbTypes,
 )
 
@@ -37,7 +39,9 @@ from qgis.gui import QgsMapCanvas, QgsMessageBar, QgsMapToolPan
 from .mapswipetool import MapSwipeTool
 
 from kart.gui import icons
-from kart.utils import setting, DIFFSTYLES
+from kart.core.vertexdiff import datasetVertexDiff
+from kart.kartapi import DIFF_PREVIEW_SIZE, kartInstallation
+from kart.utils import setting, confirm, DIFFSTYLES
 
 ADDED, MODIFIED, REMOVED, UNCHANGED = 0, 1, 2, 3
 
@@ -59,13 +63,76 @@ pointsStyle = os.path.join(
     pluginPath, "resources", "diff_styles", "geomdiff_points.qml"
 )
 
+# Number of changed features above which the user is asked before loading
+# a whole diff
+DIFF_SIZE_WARNING = 100000
+
 WIDGET, BASE = uic.loadUiType(
     os.path.join(os.path.dirname(__file__), "diffviewerwidget.ui")
 )
 
+# Keeps running diff loading tasks alive after their dialog is closed
+_loadTasks = set()
+
+
+def loadDiff(repo, refa=None, refb=None, dataset=None, extent=None, totals=None):
+    """
+    Returns the changes to show in the diff viewer, as a (diff, totals) tuple.
+
+    If the diff has more than DIFF_PREVIEW_SIZE changed features, only a
+    preview with the first ones of each dataset is returned, along with the
+    total number of changed features per dataset. Otherwise, the whole diff is
+    returned and totals is None. Diffs filtered by extent are always loaded
+    whole, since the filter is applied to the whole diff, and so are diffs
+    when Kart cannot count changes or stream them as JSON lines.
+    """
+    installation = kartInstallation()
+    canPreview = installation.supportsFeatureCount
+    canPreview = canPreview and installation.supportsDiffOutputFormat("json-lines")
+    if extent is None and canPreview:
+        if totals is None:
+            totals = repo.diffStats(refa, refb, dataset)
+        if sum(totals.values()) > DIFF_PREVIEW_SIZE:
+            return repo.diffPreview(refa, refb, dataset, totals=totals)
+    return repo.diff(refa, refb, dataset, extent=extent), None
+
+
+class LoadDiffTask(QgsTask):
+    """
+    Task to load a whole diff in a background thread. onFinished is called
+    with the diff and the exception raised loading it, if any
+    """
+
+    def __init__(self, loadAll, onFinished):
+        super().__init__("Load Kart diff", QgsTask.CanCancel)
+        self.loadAll = loadAll
+        self.onFinished = onFinished
+        self.diff = None
+        self.exception = None
+
+    def run(self):
+        try:
+            self.diff = self.loadAll()
+        except Exception as e:
+            self.exception = e
+            return False
+        return not self.isCanceled()
+
+    def finished(self, result):
+        _loadTasks.discard(self)
+        if (result or self.exception is not None) and self.onFinished is not None:
+            self.onFinished(self.diff, self.exception)
+
 
 class DiffViewerDialog(QDialog):
-    def __init__(self, parent, diff, repo, showRecoverNewButton=True):
+    def __init__(
+        self, parent, diff, repo, showRecoverNewButton=True, totals=None, loadAll=None
+    ):
+        """
+        If the diff is only a preview (see loadDiff), totals has the total
+        number of changed features per dataset, and loadAll is a function
+        returning the whole diff, which the user can load in the background.
+        """
         super(QDialog, self).__init__(parent)
         self.setWindowFlags(Qt.Window)
         layout = QVBoxLayout()
@@ -80,10 +147,58 @@ class DiffViewerDialog(QDialog):
         self.resize(1024, 768)
         self.setWindowTitle("Diff viewer")
 
+        self.totals = totals
+        self.loadAll = loadAll
+        self.loadTask = None
+        if totals is not None and loadAll is not None:
+            self._showPreviewMessage()
+
+    def _showPreviewMessage(self):
+        total = sum(self.totals.values())
+        widget = self.bar.createMessage(
+            "Diff",
+            f"Showing a preview with the first {DIFF_PREVIEW_SIZE:,} changed "
+            f"features of each dataset, out of {total:,} changed features",
+        )
+        self.btnLoadAll = QPushButton("Load all")
+        self.btnLoadAll.clicked.connect(self.loadAllChanges)
+        widget.layout().addWidget(self.btnLoadAll)
+        self.previewMessage = widget
+        self.bar.pushWidget(widget, Qgis.Info)
+
+    def loadAllChanges(self):
+        total = sum(self.totals.values())
+        if total > DIFF_SIZE_WARNING and not confirm(
+            f"There are {total:,} changed features in this diff, and showing them "
+            "can take a long time.\nDo you want to continue?"
+        ):
+            return
+        self.btnLoadAll.setEnabled(False)
+        self.btnLoadAll.setText("Loading...")
+        self.loadTask = LoadDiffTask(self.loadAll, self._allChangesLoaded)
+        _loadTasks.add(self.loadTask)
+        QgsApplication.taskManager().addTask(self.loadTask)
+
+    def _allChangesLoaded(self, diff, exception):
+        self.loadTask = None
+        if exception is not None:
+            # The preview is kept, so loading can be tried again
+            self.btnLoadAll.setEnabled(True)
+            self.btnLoadAll.setText("Load all")
+            self.bar.pushMessage(
+                "Diff", f"Could not load all changes: {exception}", Qgis.Warning
+            )
+            return
+        self.bar.popWidget(self.previewMessage)
+        self.history.setDiff(diff)
+
     def workingLayerChanged(self):
         self.bar.pushMessage("Diff", "Working copy has been updated", Qgis.Success, 5)
 
     def closeEvent(self, evt):
+        if self.loadTask is not None:
+            self.loadTask.onFinished = None
+            self.loadTask.cancel()
         self.history.removeMapLayers()
         evt.accept()
 
@@ -102,6 +217,7 @@ class DiffViewerWidget(WIDGET, BASE):
         self.showRecoverNewButton = showRecoverNewButton
         self.layerDiffLayers = {}
         self.vertexDiffLayer = None
+        self.vertexDiffCache = {}
         self.currentFeatureItem = None
         self.currentDatasetItem = None
         self.workingCopyLayers = {}
@@ -140,6 +256,14 @@ class DiffViewerWidget(WIDGET, BASE):
 
         self.selectFirstChangedFeature()
 
+    def setDiff(self, diff):
+        self.removeMapLayers()
+        self.diff = diff
+        self.layerDiffLayers = {}
+        self.vertexDiffCache = {}
+        self.fillTree()
+        self.selectFirstChangedFeature()
+
     def selectFirstChangedFeature(self):
         iterator = QTreeWidgetItemIterator(self.featuresTree)
         while iterator.value():
@@ -189,7 +313,7 @@ class DiffViewerWidget(WIDGET, BASE):
             self.btnRecoverNewVersion.setVisible(False)
             self.btnRecoverOldVersion.setVisible(False)
             if self._hasGeometry(current):
-                self.comboDiffType.view().setRowHidden(VERTEX_DIFF, True)
+                self.comboDiffType.view().setRowHidden(VERTEX_DIFF, False)
                 self._createLayers()
                 self.fillCanvas()
             else:
@@ -434,6 +558,8 @@ class DiffViewerWidget(WIDGET, BASE):
             self.newLayer.renderer().setSymbol(symbol)
             symbol = symbolType.createSimple({"color": "255,255,255,0"})
             self.oldLayer.renderer().setSymbol(symbol)
+            if self.vertexDiffLayer is None:
+                self._createVertexDiffLayer()
             layers.insert(0, self.vertexDiffLayer)
             self.newLayer.setOpacity(100)
             self.oldLayer.setOpacity(100)
@@ -508,7 +634,6 @@ class DiffViewerWidget(WIDGET, BASE):
         self.oldLayer.updateFields()
         self.newLayer.dataProvider().addAttributes(layer.fields().toList())
         self.newLayer.updateFields()
-        geoms = []
         for layer, feat in [(self.newLayer, new), (self.oldLayer, old)]:
             if bool(feat):
                 geom = self._geomFromGeojson(feat)
@@ -519,12 +644,7 @@ class DiffViewerWidget(WIDGET, BASE):
                 feature[idField] = self.currentFeatureItem.fid
                 if geom is not None:
                     feature.setGeometry(geom)
-                    geoms.append(geom)
                 layer.dataProvider().addFeatures([feature])
-            else:
-                geoms.append(None)
-        if refGeom is not None:
-            self._createVertexDiffLayer(geoms)
 
         currentFieldNames = set(layer.fields().names())
         oldFieldNames = set(old.get("properties", {}).keys())
@@ -538,45 +658,32 @@ class DiffViewerWidget(WIDGET, BASE):
         )
         self.sliderTransparency.setEnabled(bool(old))
 
-    def _createVertexDiffLayer(self, geoms):
-        textGeometries = []
-        for geom in geoms:
-            if geom is not None:
-                text = geom.asWkt(precision=5)
-                valid = " -1234567890.,"
-                text = "".join([c for c in text if c in valid])
-                textGeometries.append(text.split(","))
-            else:
-                textGeometries.append("")
-        lines = difflib.Differ().compare(textGeometries[0], textGeometries[1])
-        data = []
-        for line in lines:
-            if line.startswith("+"):
-                data.append([None, line[2:]])
-            if line.startswith("-"):
-                data.append([line[2:], None])
-            if line.startswith(" "):
-                data.append([line[2:], line[2:]])
-        dataset = self.currentFeatureItem.dataset
-        crs = self.workingCopyLayerCrs[dataset]
+    def _vertexDiffPairs(self):
+        if self.currentFeatureItem is not None:
+            items = [self.currentFeatureItem]
+        else:
+            items = []
+            for i in range(self.currentDatasetItem.childCount()):
+                subItem = self.currentDatasetItem.child(i)
+                items.extend(subItem.child(j) for j in range(subItem.childCount()))
+        for item in items:
+            old = item.old.get("geometry") if item.old else None
+            new = item.new.get("geometry") if item.new else None
+            yield (item.dataset, item.fid), old, new
+
+    def _createVertexDiffLayer(self):
+        item = self.currentFeatureItem or self.currentDatasetItem
+        crs = self.workingCopyLayerCrs[item.dataset]
+        changes = datasetVertexDiff(self._vertexDiffPairs(), self.vertexDiffCache)
         options = QgsVectorLayer.LayerOptions()
         options.skipCrsValidation = True
         self.vertexDiffLayer = QgsVectorLayer(
             f"Point?crs={crs}&field=changetype:string", "vertexdiff", "memory", options
         )
         feats = []
-        for coords in data:
-            coord = coords[0] or coords[1]
+        for x, y, changetype in changes:
             feat = QgsFeature()
-            x, y = coord.strip().split(" ")[:2]
-            pt = QgsGeometry.fromPointXY(QgsPointXY(float(x), float(y)))
-            feat.setGeometry(pt)
-            if coords[0] is None:
-                changetype = "A"
-            elif coords[1] is None:
-                changetype = "R"
-            else:
-                changetype = "U"
+            feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
             feat.setAttributes([changetype])
             feats.append(feat)
 
@@ -1,7 +1,6 @@
 import os
 import re
 import math
-import tempfile
 from functools import partial
 
 from qgis.PyQt import uic
@@ -21,21 +20,25 @@ from qgis.PyQt.QtWidgets import (
 from qgis.utils import iface
 from qgis.core import (
     Qgis,
-    QgsVectorLayer,
-    QgsVectorFileWriter,
+    QgsApplication,
     QgsProject,
     QgsMimeDataUtils,
+    QgsMessageOutput,
 )
 
+from kart import logging
 from kart.core import RepoManager
+from kart.core.layerimport import ImportTask
+from kart.core.multirepo import MultiRepoTask, resultsReport, REFRESH, PULL, STATUS
 from kart.kartapi import (
     Repository,
     executeskart,
     KartException,
     checkKartInstalled,
+    showKartExceptionMessage,
 )
 from kart.gui import icons
-from kart.gui.diffviewer import DiffViewerDialog
+from kart.gui.diffviewer import DiffViewerDialog, loadDiff
 from kart.gui.historyviewer import HistoryDialog
 from kart.gui.conflictsdialog import ConflictsDialog
 from kart.gui.clonedialog import CloneDialog
@@ -52,14 +55,17 @@ from kart.utils import (
     setting,
     setSetting,
     LASTREPO,
-    waitcursor,
     progressBar,
+    currentMapExtent,
 )
 
 pluginPath = os.path.split(os.path.dirname(__file__))[0]
 
 WIDGET, BASE = uic.loadUiType(os.path.join(os.path.dirname(__file__), "dockwidget.ui"))
 
+# Keeps running import tasks alive until they are finished
+_importTasks = set()
+
 
 class KartDockWidget(BASE, WIDGET):
     def __init__(self):
@@ -102,10 +108,13 @@ class KartDockWidget(BASE, WIDGET):
         self.tree.mimeTypes = mimeTypes
         self.tree.dropMimeData = dropMimeData
 
+        self.reposItem = None
         self.fillTree()
 
     def fillTree(self):
-        self.tree.clear()
+        if self.reposItem is not None:
+            self.reposItem.refreshContent()
+            return
         self.reposItem = ReposItem()
         self.tree.addTopLevelItem(self.reposItem)
         self.reposItem.setExpanded(True)
@@ -145,6 +154,11 @@ class KartDockWidget(BASE, WIDGET):
 
 
 class RefreshableItem(QTreeWidgetItem):
+    """
+    Item whose populate method updates its existing children to match the
+    current state of the repos, only adding and removing those that changed
+    """
+
     def actions(self):
         actions = [
             ("Refresh", self.refreshContent, icons.refreshIcon),
@@ -154,7 +168,6 @@ class RefreshableItem(QTreeWidgetItem):
         return actions
 
     def refreshContent(self):
-        self.takeChildren()
         self.populate()
 
 
@@ -166,24 +179,80 @@ class ReposItem(RefreshableItem):
         self.setIcon(0, icons.repoIcon)
         self.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
 
+        self.multiRepoTask = None
+
         self.populate()
 
         RepoManager.instance().repo_added.connect(self.addRepoToUI)
 
     def populate(self):
-        for repo in RepoManager.instance().repos():
-            item = RepoItem(repo)
-            self.addChild(item)
+        repos = RepoManager.instance().repos()
+        paths = {repo.path for repo in repos}
+        existing = set()
+        for i in reversed(range(self.childCount())):
+            item = self.child(i)
+            if item.repo.path in paths:
+                existing.add(item.repo.path)
+                item.setTitle()
+            else:
+                self.takeChild(i)
+        for repo in repos:
+            if repo.path not in existing:
+                self.addChild(RepoItem(repo))
 
     def _actions(self):
         actions = [
             ("Add existing repository...", self.addRepo, icons.addRepoIcon),
             ("Create new repository...", self.createRepo, icons.createRepoIcon),
             ("Clone repository...", self.cloneRepo, icons.cloneRepoIcon),
+            ("divider", None, None),
+            ("Fetch all repositories", self.refreshAll, icons.refreshIcon),
+            ("Pull all repositories", self.pullAll, icons.pullIcon),
+            ("Show status of all repositories", self.statusAll, icons.logIcon),
         ]
 
         return actions
 
+    def refreshAll(self):
+        self._runOnAllRepos(REFRESH)
+
+    def pullAll(self):
+        self._runOnAllRepos(PULL)
+
+    def statusAll(self):
+        self._runOnAllRepos(STATUS)
+
+    def _runOnAllRepos(self, operation):
+        if self.multiRepoTask is not None:
+            iface.messageBar().pushMessage(
+                "Kart",
+                "An operation on all repositories is already running",
+                level=Qgis.Warning,
+            )
+            return
+        repos = [self.child(i).repo for i in range(self.childCount())]
+        if not repos or not checkKartInstalled():
+            return
+        self.multiRepoTask = MultiRepoTask(operation, repos, self._allReposFinished)
+        self.multiRepoTask.repoFinished.connect(self._repoFinished)
+        QgsApplication.taskManager().addTask(self.multiRepoTask)
+
+    def _repoFinished(self, result):
+        for i in range(self.childCount()):
+            item = self.child(i)
+            if item.repo.path == result.repo.path:
+                item.setResult(result)
+        if result.pulled:
+            result.repo.updateCanvas()
+
+    def _allReposFinished(self, results):
+        title = self.multiRepoTask.title
+        self.multiRepoTask = None
+        dlg = QgsMessageOutput.createMessageOutput()
+        dlg.setTitle(title)
+        dlg.setMessage(resultsReport(title, results), QgsMessageOutput.MessageHtml)
+        dlg.showMessage()
+
     def addRepo(self):
         folder = QFileDialog.getExistingDirectory(
             iface.mainWindow(), "Repository Folder", ""
@@ -280,29 +349,69 @@ class RepoItem(RefreshableItem):
         self.repo = repo
 
         self.populated = False
+        # Summary of the repo read when a context menu was last built for it
+        self._summary = None
 
         self.setTitle()
         self.setIcon(0, icons.repoIcon)
         self.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
 
     def refreshContent(self):
-        self.takeChildren()
-        self.populate()
+        self._summary = None
+        if self.populated:
+            self.datasetsItem.refreshContent()
         self.setTitle()
 
-    def setTitle(self):
+    def setTitle(self, branch=None):
+        title = f"{self.repo.title() or os.path.normpath(self.repo.path)}"
         if self.populated:
+            if branch is None and self._summary is not None:
+                branch = self._summary["branch"]
             try:
-                title = (
-                    f"{self.repo.title() or os.path.normpath(self.repo.path)} "
-                    f"[{self.repo.currentBranch()}]"
-                )
+                title = f"{title} [{branch or self.repo.currentBranch()}]"
             except KartException:
-                title = f"{self.repo.title() or os.path.normpath(self.repo.path)}"
-        else:
-            title = f"{self.repo.title() or os.path.normpath(self.repo.path)}"
+                pass
         self.setText(0, title)
 
+    def summary(self):
+        """
+        Returns the summary of the repo (see Repository.summary), as read when
+        the context menu of the repo or one of its datasets was built, so the
+        actions run from it do not have to read it again
+        """
+        if self._summary is None:
+            self._summary = self.repo.summary()
+        return self._summary
+
+    def menuSummary(self):
+        """
+        Reads the summary of the repo for a context menu with a single Kart
+        call, and updates the title with it. Returns None if it cannot be
+        read, since no error can be shown while the menu is being built
+        """
+        self._summary = None
+        try:
+            summary = self.summary()
+        except KartException as e:
+            logging.error("Could not read status of %s: %s", self.repo.path, e)
+            return None
+        self.setTitle()
+        return summary
+
+    def setResult(self, result):
+        """
+        Shows the result of an operation run on all repositories
+        """
+        if result.error is not None:
+            self.setToolTip(0, result.error)
+            return
+        self.setToolTip(0, result.message)
+        branch = result.status.get("branch")
+        if branch:
+            self.setTitle(branch)
+        if self.populated and result.pulled:
+            self.refreshContent()
+
     def onExpanded(self):
         if not self.populated:
             self.populate()
@@ -318,7 +427,9 @@ class RepoItem(RefreshableItem):
     def actions(self):
         actions = []
 
-        if self.repo.isMerging():
+        summary = self.menuSummary()
+        merging = self.repo.isMerging() if summary is None else summary["merging"]
+        if merging:
             actions.extend(
                 [
                     ("Resolve conflicts...", self.resolveConflicts, icons.resolveIcon),
@@ -331,6 +442,11 @@ class RepoItem(RefreshableItem):
                 [
                     ("Show log...", self.showLog, icons.logIcon),
                     ("Show working copy changes...", self.showChanges, icons.diffIcon),
+                    (
+                        "Show working copy changes in current map extent...",
+                        self.showChangesInExtent,
+                        icons.diffIcon,
+                    ),
                     (
                         "Discard working copy changes",
                         self.discardChanges,
@@ -393,47 +509,42 @@ class RepoItem(RefreshableItem):
         dlg = DbConnectionDialog()
         ret = dlg.exec()
         if ret == dlg.Accepted:
-            self._importIntoRepo(dlg.url)
+            self._importIntoRepo(dlg.url, dlg.tables, dlg.allTables)
 
+    @executeskart
     def importLayerFromFile(self):
         filepath, _ = QFileDialog.getOpenFileName(
             iface.mainWindow(), "Select vector layer to import", "", "*.*"
         )
         if filepath:
-            if os.path.splitext(filepath)[-1].lower() not in [".gpkg", ".shp"]:
-                self._exportToGpkgAndImportIntoRepo(filepath)
-            else:
-                self._importIntoRepo(filepath)
-
-    @waitcursor
-    def _exportToGpkgAndImportIntoRepo(self, filepath):
-        layer = QgsVectorLayer(filepath, "", "ogr")
-        if not layer.isValid():
-            iface.messageBar().pushMessage(
-                "Import",
-                "The selected file is not a valid vector layer",
-                level=Qgis.Warning,
-            )
-            return
-        tmpfolder = tempfile.TemporaryDirectory()
-        filename = os.path.splitext(os.path.basename(filepath))[0]
-        filenameToImport = os.path.join(tmpfolder.name, f"{filename}.gpkg")
-        ret = QgsVectorFileWriter.writeAsVectorFormat(
-            layer, filenameToImport, "utf-8", layer.crs()
-        )
-        if ret[0] != QgsVectorFileWriter.NoError:
+            task = ImportTask(self.repo, filepath)
+            task.onFinished = partial(self._importFromFileFinished, task)
+            _importTasks.add(task)
+            QgsApplication.taskManager().addTask(task)
             iface.messageBar().pushMessage(
                 "Import",
-                "Could not convert the selected layer to a gpkg file",
-                level=Qgis.Warning,
+                f"Importing {os.path.basename(filepath)} in the background",
+                level=Qgis.Info,
             )
-        else:
-            self._importIntoRepo(filenameToImport)
-            tmpfolder.cleanup()
+
+    def _importFromFileFinished(self, task, result, exception):
+        _importTasks.discard(task)
+        if exception is not None:
+            if isinstance(exception, KartException):
+                showKartExceptionMessage(exception)
+            else:
+                iface.messageBar().pushMessage(
+                    "Import", str(exception), level=Qgis.Warning
+                )
+        elif result:
+            self._importFinished()
 
     @executeskart
-    def _importIntoRepo(self, source):
-        self.repo.importIntoRepo(source)
+    def _importIntoRepo(self, source, tables=None, allTables=False):
+        self.repo.importIntoRepo(source, tables=tables, allTables=allTables)
+        self._importFinished()
+
+    def _importFinished(self):
         iface.messageBar().pushMessage(
             "Import", "Layer correctly imported", level=Qgis.Info
         )
@@ -443,7 +554,7 @@ class RepoItem(RefreshableItem):
 
     @executeskart
     def commitChanges(self):
-        if self.repo.isWorkingTreeClean():
+        if not self.summary()["changes"]:
             iface.messageBar().pushMessage(
                 "Commit", "Nothing to commit", level=Qgis.Warning
             )
@@ -463,6 +574,13 @@ class RepoItem(RefreshableItem):
 
     @executeskart
     def showChanges(self):
+        self._showChanges()
+
+    @executeskart
+    def showChangesInExtent(self):
+        self._showChanges(currentMapExtent())
+
+    def _showChanges(self, extent=None):
         hasSchemaChanges = self.repo.diffHasSchemaChanges()
         if hasSchemaChanges:
             iface.messageBar().pushMessage(
@@ -471,13 +589,24 @@ class RepoItem(RefreshableItem):
                 level=Qgis.Warning,
             )
             return
-        diff = self.repo.diff()
+        diff, totals = loadDiff(self.repo, extent=extent)
         hasChanges = any([bool(c) for c in diff.values()])
         if hasChanges:
             dialog = DiffViewerDialog(
-                iface.mainWindow(), diff, self.repo, showRecoverNewButton=False
+                iface.mainWindow(),
+                diff,
+                self.repo,
+                showRecoverNewButton=False,
+                totals=totals,
+                loadAll=partial(self.repo.diff, raiseErrors=True),
             )
             dialog.exec()
+        elif extent is not None:
+            iface.messageBar().pushMessage(
+                "Changes",
+                "There are no changes in the working copy in the current map extent",
+                level=Qgis.Warning,
+            )
         else:
             iface.messageBar().pushMessage(
                 "Changes",
@@ -490,7 +619,7 @@ class RepoItem(RefreshableItem):
         dialog = SwitchDialog(self.repo)
         if dialog.exec() == dialog.Accepted:
             self.repo.checkoutBranch(dialog.branch, dialog.force)
-            self.setTitle()
+            self.refreshContent()
 
     @executeskart
     def mergeBranch(self):
@@ -511,10 +640,15 @@ class RepoItem(RefreshableItem):
                 iface.messageBar().pushMessage(
                     "Merge", "Branch correctly merged", level=Qgis.Info
                 )
+            self.refreshContent()
 
     @executeskart
     def discardChanges(self):
-        if confirm("Are you sure you want to discard the working copy changes?"):
+        if not self.summary()["changes"]:
+            iface.messageBar().pushMessage(
+                "Discard changes", "There are no changes to discard", level=Qgis.Warning
+            )
+        elif confirm("Are you sure you want to discard the working copy changes?"):
             self.repo.restore("HEAD")
             iface.messageBar().pushMessage(
                 "Discard changes",
@@ -605,6 +739,7 @@ class RepoItem(RefreshableItem):
                 iface.messageBar().pushMessage(
                     "Pull", "Pull correctly performed", level=Qgis.Info
                 )
+            self.refreshContent()
 
     @executeskart
     def applyPatch(self):
@@ -637,12 +772,24 @@ class DatasetsItem(RefreshableItem):
     @executeskart
     def populate(self):
         vectorDatasets, tables = self.repo.datasets()
-        for dataset in vectorDatasets:
-            item = DatasetItem(dataset, self.repo, False)
-            self.addChild(item)
-        for table in tables:
-            item = DatasetItem(table, self.repo, True)
-            self.addChild(item)
+        datasets = [(name, False) for name in vectorDatasets]
+        datasets.extend((name, True) for name in tables)
+        wanted = set(datasets)
+        items = {}
+        for i in reversed(range(self.childCount())):
+            item = self.child(i)
+            key = (item.name, item.isTable)
+            if key in wanted and key not in items:
+                items[key] = item
+            else:
+                self.takeChild(i)
+        for index, (name, isTable) in enumerate(datasets):
+            item = items.get((name, isTable))
+            if item is None:
+                self.insertChild(index, DatasetItem(name, self.repo, isTable))
+            elif self.indexOfChild(item) != index:
+                self.takeChild(self.indexOfChild(item))
+                self.insertChild(index, item)
 
     def _actions(self):
         return []
@@ -658,9 +805,15 @@ class DatasetItem(QTreeWidgetItem):
         self.setText(0, name)
         self.setIcon(0, icons.tableIcon if isTable else icons.vectorDatasetIcon)
 
+    def repoItem(self):
+        # Datasets are children of the DatasetsItem of their RepoItem
+        return self.parent().parent()
+
     def actions(self):
         actions = [("Add to QGIS project", self.addToProject, icons.addtoQgisIcon)]
-        if not self.repo.isMerging():
+        summary = self.repoItem().menuSummary()
+        merging = self.repo.isMerging() if summary is None else summary["merging"]
+        if not merging:
             actions.extend(
                 [
                     ("divider", None, None),
@@ -670,6 +823,12 @@ class DatasetItem(QTreeWidgetItem):
                         self.showChanges,
                         icons.diffIcon,
                     ),
+                    (
+                        "Show working copy changes for this dataset in current "
+                        "map extent...",
+                        self.showChangesInExtent,
+                        icons.diffIcon,
+                    ),
                     (
                         "Discard working copy changes for this dataset",
                         self.discardChanges,
@@ -689,7 +848,7 @@ class DatasetItem(QTreeWidgetItem):
 
     @executeskart
     def commitChanges(self):
-        changes = self.repo.changes().get(self.name)
+        changes = self.repoItem().summary()["changes"].get(self.name)
         if changes is None:
             iface.messageBar().pushMessage(
                 "Commit", "Nothing to commit", level=Qgis.Warning
@@ -710,6 +869,13 @@ class DatasetItem(QTreeWidgetItem):
 
     @executeskart
     def showChanges(self):
+        self._showChanges()
+
+    @executeskart
+    def showChangesInExtent(self):
+        self._showChanges(currentMapExtent())
+
+    def _showChanges(self, extent=None):
         hasSchemaChanges = self.repo.diffHasSchemaChanges(dataset=self.name)
         if hasSchemaChanges:
             iface.messageBar().pushMessage(
@@ -718,12 +884,24 @@ class DatasetItem(QTreeWidgetItem):
                 level=Qgis.Warning,
             )
             return
-        diff = self.repo.diff(dataset=self.name)
+        diff, totals = loadDiff(self.repo, dataset=self.name, extent=extent)
         if diff.get(self.name):
             dialog = DiffViewerDialog(
-                iface.mainWindow(), diff, self.repo, showRecoverNewButton=False
+                iface.mainWindow(),
+                diff,
+                self.repo,
+                showRecoverNewButton=False,
+                totals=totals,
+                loadAll=lambda: self.repo.diff(dataset=self.name, raiseErrors=True),
             )
             dialog.exec()
+        elif extent is not None:
+            iface.messageBar().pushMessage(
+                "Changes",
+                "There are no changes in the working copy for this dataset "
+                "in the current map extent",
+                level=Qgis.Warning,
+            )
         else:
             iface.messageBar().pushMessage(
                 "Changes",
@@ -761,7 +939,7 @@ class DatasetItem(QTreeWidgetItem):
 
     @executeskart
     def removeFromRepo(self):
-        if not self.repo.isWorkingTreeClean():
+        if self.repoItem().summary()["changes"]:
             iface.messageBar().pushMessage(
                 "Remove dataset",
                 "There are pending changes in the working copy. "
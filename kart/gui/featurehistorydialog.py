@@ -1,8 +1,11 @@
 import os
 import json
+import queue
+import threading
+from collections import OrderedDict
 
 from qgis.PyQt import uic
-from qgis.PyQt.QtCore import Qt
+from qgis.PyQt.QtCore import Qt, QThread, pyqtSignal
 from qgis.PyQt.QtWidgets import (
     QHBoxLayout,
     QTableWidgetItem,
@@ -12,7 +15,6 @@ from qgis.PyQt.QtWidgets import (
 from qgis.PyQt.QtGui import QFont
 
 from qgis.core import (
-    edit,
     Qgis,
     QgsSymbol,
     QgsSingleSymbolRenderer,
@@ -29,6 +31,140 @@ WIDGET, BASE = uic.loadUiType(
     os.path.join(os.path.dirname(__file__), "featurehistorydialog.ui")
 )
 
+# Number of commits at each side of the current one to fetch in advance
+PREFETCH_DISTANCE = 2
+# Maximum number of feature versions kept in memory
+FEATURE_CACHE_SIZE = 32
+# Cached for commits with no feature versions to show, so they are not
+# fetched again
+NO_VERSIONS = ()
+
+
+class FeatureVersionsCache:
+    """
+    Small LRU cache of feature versions, keyed by commit id, shared by the
+    dialog and the thread fetching versions in advance.
+    Each entry is a (new, old) tuple of geojson features, or NO_VERSIONS.
+    """
+
+    def __init__(self, size=FEATURE_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        # Event set once the versions being fetched for a commit are cached
+        self._fetching = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, commitid):
+        with self._lock:
+            return commitid in self._entries or commitid in self._fetching
+
+    def get(self, commitid):
+        with self._lock:
+            return self._get(commitid)
+
+    def _get(self, commitid):
+        versions = self._entries.get(commitid)
+        if versions is not None:
+            self._entries.move_to_end(commitid)
+        return versions
+
+    def put(self, commitid, versions):
+        with self._lock:
+            self._put(commitid, versions)
+
+    def _put(self, commitid, versions):
+        self._entries[commitid] = versions
+        self._entries.move_to_end(commitid)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def fetch(self, commitid, func, wait=True):
+        """
+        Returns the versions for a commit, calling func to fetch them if they
+        are not cached. If another thread is already fetching them, waits for
+        it if wait is True, or returns None otherwise, so the same versions
+        are never fetched twice at the same time
+        """
+        with self._lock:
+            versions = self._get(commitid)
+            if versions is not None:
+                return versions
+            event = self._fetching.get(commitid)
+            fetching = event is None
+            if fetching:
+                event = self._fetching[commitid] = threading.Event()
+        if not fetching:
+            if not wait:
+                return None
+            event.wait()
+            versions = self.get(commitid)
+            return NO_VERSIONS if versions is None else versions
+        versions = NO_VERSIONS
+        try:
+            versions = func() or NO_VERSIONS
+        finally:
+            with self._lock:
+                self._put(commitid, versions)
+                del self._fetching[commitid]
+            event.set()
+        return versions
+
+
+def fetchFeatureVersions(repo, commit, dataset, fid):
+    """
+    Returns the (new, old) geojson versions of a feature as changed by
+    the given commit, or None if they cannot be computed
+    """
+    diff = repo.diff(commit["parents"][0], commit["commit"], dataset, fid)
+    features = diff.get(dataset)
+    if not features:
+        return None
+    return features[0], features[-1]
+
+
+class FeatureVersionsPrefetcher(QThread):
+    """
+    Fetches feature versions for commits in a background thread, so
+    browsing through the history does not wait for a Kart diff each time
+    """
+
+    versionsFetched = pyqtSignal(str)
+
+    def __init__(self, repo, dataset, fid, cache, parent=None):
+        QThread.__init__(self, parent)
+        self.repo = repo
+        self.dataset = dataset
+        self.fid = fid
+        self.cache = cache
+        self._queue = queue.Queue()
+
+    def enqueue(self, commit):
+        self._queue.put(commit)
+
+    def stop(self):
+        if self.isRunning():
+            self._queue.put(None)
+            self.wait()
+
+    def run(self):
+        while True:
+            commit = self._queue.get()
+            if commit is None:
+                return
+            try:
+                # Versions are stored in the cache, unless the dialog is
+                # already fetching them
+                self.cache.fetch(
+                    commit["commit"],
+                    lambda: fetchFeatureVersions(
+                        self.repo, commit, self.dataset, self.fid
+                    ),
+                    wait=False,
+                )
+            except Exception:
+                pass
+            self.versionsFetched.emit(commit["commit"])
+
 
 class FeatureHistoryDialog(BASE, WIDGET):
     def __init__(self, history, workingCopyLayer, dataset, fid, repo):
@@ -38,6 +174,7 @@ class FeatureHistoryDialog(BASE, WIDGET):
         self.repo = repo
         self.dataset = dataset
         self.layer = None
+        self.layerFeatureId = None
         self.workingCopyLayer = workingCopyLayer
         self.workingCopyLayerIdField = None
         self.workingCopyLayerCrs = None
@@ -61,12 +198,39 @@ class FeatureHistoryDialog(BASE, WIDGET):
         self.panTool = QgsMapToolPan(self.canvas)
         self.canvas.setMapTool(self.panTool)
 
+        self.cache = FeatureVersionsCache()
+        self.pendingPrefetch = set()
+        self.prefetcher = FeatureVersionsPrefetcher(
+            repo, dataset, fid, self.cache, self
+        )
+        self.prefetcher.versionsFetched.connect(self._versionsFetched)
+        self.prefetcher.start()
+        self.finished.connect(self.prefetcher.stop)
+
         for commit in history:
-            item = CommitListItem(commit, workingCopyLayer, dataset, fid, repo)
+            item = CommitListItem(
+                commit, workingCopyLayer, dataset, fid, repo, self.cache
+            )
             self.listCommits.addItem(item)
 
         self.listCommits.setCurrentRow(0)
 
+    def _versionsFetched(self, commitid):
+        self.pendingPrefetch.discard(commitid)
+
+    def _prefetchNeighbours(self, row):
+        for offset in range(1, PREFETCH_DISTANCE + 1):
+            for neighbour in (row + offset, row - offset):
+                if 0 <= neighbour < self.listCommits.count():
+                    commit = self.listCommits.item(neighbour).commit
+                    commitid = commit["commit"]
+                    if commitid in self.cache or commitid in self.pendingPrefetch:
+                        continue
+                    if not commit["parents"]:
+                        continue
+                    self.pendingPrefetch.add(commitid)
+                    self.prefetcher.enqueue(commit)
+
     def _currentCommitFeature(self):
         row = self.listCommits.currentRow()
         if row == self.listCommits.count() - 1:
@@ -88,11 +252,14 @@ class FeatureHistoryDialog(BASE, WIDGET):
         )
         self.commitDetails.setHtml(html)
 
-        self.removeLayer()
         feature = self._currentCommitFeature()
+        self.btnRecover.setEnabled(feature is not None)
         if feature is None:
+            # Nothing is left from the previous commit to show, or recover
+            self.removeLayer()
+            self.attributesTable.setRowCount(0)
+            self.canvas.refresh()
             return
-        geom = feature.geometry()
         attributes = feature.attributes()
         self.attributesTable.setRowCount(len(attributes))
         props = [f.name() for f in feature.fields()]
@@ -110,6 +277,31 @@ class FeatureHistoryDialog(BASE, WIDGET):
         self.attributesTable.horizontalHeader().setMinimumSectionSize(150)
         self.attributesTable.horizontalHeader().setStretchLastSection(True)
 
+        self._showFeature(feature)
+        self._prefetchNeighbours(self.listCommits.currentRow())
+
+    def _showFeature(self, feature):
+        """
+        Shows the feature in the canvas, reusing the existing layer and just
+        swapping its geometry and attributes if possible
+        """
+        geom = feature.geometry()
+        if self.layer is None or self.layer.wkbType() != geom.wkbType():
+            self.removeLayer()
+            self._createLayer(geom)
+            _, added = self.layer.dataProvider().addFeatures([feature])
+            self.layerFeatureId = added[0].id()
+        else:
+            provider = self.layer.dataProvider()
+            provider.changeGeometryValues({self.layerFeatureId: geom})
+            attributes = dict(enumerate(feature.attributes()))
+            provider.changeAttributeValues({self.layerFeatureId: attributes})
+        self.layer.updateExtents()
+        self.canvas.setExtent(geom.boundingBox())
+        self.layer.triggerRepaint()
+        self.canvas.refresh()
+
+    def _createLayer(self, geom):
         geomtype = QgsWkbTypes.displayString(geom.wkbType())
         if self.workingCopyLayerCrs is None:
             self.workingCopyLayerCrs = self.repo.workingCopyLayerCrs(self.dataset)
@@ -118,24 +310,16 @@ class FeatureHistoryDialog(BASE, WIDGET):
         )
         self.layer.dataProvider().addAttributes(self.workingCopyLayer.fields().toList())
         self.layer.updateFields()
-        with edit(self.layer):
-            self.layer.addFeature(feature)
-        self.layer.updateExtents()
-        self.layer.selectAll()
-        self.layer.setExtent(self.layer.boundingBoxOfSelected())
-        self.layer.invertSelection()
         symbol = QgsSymbol.defaultSymbol(self.layer.geometryType())
         symbol.setColor(Qt.green)
         symbol.setOpacity(0.5)
         self.layer.setRenderer(QgsSingleSymbolRenderer(symbol))
-        self.canvas.setRenderFlag(False)
         QgsProject.instance().addMapLayer(self.layer, False)
         self.canvas.setLayers([self.layer])
-        self.canvas.setExtent(self.layer.extent())
-        self.canvas.setRenderFlag(True)
-        self.canvas.refresh()
 
     def recoverVersion(self):
+        if self.layer is None:
+            return
         new = list(self.layer.getFeatures())[0]
         if self.workingCopyLayerIdField is None:
             self.workingCopyLayerIdField = self.repo.workingCopyLayerIdField(
@@ -160,7 +344,10 @@ class FeatureHistoryDialog(BASE, WIDGET):
 
     def removeLayer(self):
         if self.layer is not None:
+            self.canvas.setLayers([])
             QgsProject.instance().removeMapLayers([self.layer.id()])
+            self.layer = None
+            self.layerFeatureId = None
 
     def closeEvent(self, evt):
         self.removeLayer()
@@ -168,43 +355,40 @@ class FeatureHistoryDialog(BASE, WIDGET):
 
 
 class CommitListItem(QListWidgetItem):
-    def __init__(self, commit, layer, dataset, fid, repo):
+    def __init__(self, commit, layer, dataset, fid, repo, cache):
         QListWidgetItem.__init__(self)
         self.commit = commit
         self.layer = layer
         self.dataset = dataset
         self.repo = repo
         self.fid = fid
-        self._feature = None
-        self._oldFeature = None
+        self.cache = cache
         self.setText(f'{commit["message"].splitlines()[0]}')
 
     def feature(self):
-        self._createFeatures()
-        return self._feature
+        versions = self._versions()
+        return self._createFeature(versions[0]) if versions else None
 
     def oldFeature(self):
-        self._createFeatures()
-        return self._oldFeature
-
-    def _createFeatures(self):
-        if self._feature is None:
-            diff = self.repo.diff(
-                self.commit["parents"][0],
-                self.commit["commit"],
-                self.dataset,
-                self.fid,
-            )
-            geojson = diff[self.dataset][0]
-            self._feature = QgsJsonUtils.stringToFeatureList(json.dumps(geojson))[0]
-            props = geojson["properties"]
-            self._feature.setFields(self.layer.fields())
-            for prop in props:
-                self._feature[prop] = props[prop]
-            geojson = diff[self.dataset][-1]
-            self._oldFeature = QgsJsonUtils.stringToFeatureList(json.dumps(geojson))[0]
-            props = geojson["properties"]
-            self._oldFeature.setFields(self.layer.fields())
-            for prop in props:
-                self._oldFeature[prop] = props[prop]
-        return self._feature
+        versions = self._versions()
+        return self._createFeature(versions[1]) if versions else None
+
+    def _versions(self):
+        """
+        Returns the (new, old) versions of the feature in this commit, or
+        NO_VERSIONS. If they are being prefetched, waits for them
+        """
+        return self.cache.fetch(
+            self.commit["commit"],
+            lambda: fetchFeatureVersions(
+                self.repo, self.commit, self.dataset, self.fid
+            ),
+        )
+
+    def _createFeature(self, geojson):
+        feature = QgsJsonUtils.stringToFeatureList(json.dumps(geojson))[0]
+        props = geojson["properties"]
+        feature.setFields(self.layer.fields())
+        for prop in props:
+            feature[prop] = props[prop]
+        return feature
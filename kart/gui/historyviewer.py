@@ -1,10 +1,12 @@
-import json
 import os
+import queue
+import tempfile
 
 from kart.kartapi import executeskart
+from kart.core.diffexport import exportDiff
 from kart.gui import icons
-from kart.gui.diffviewer import DiffViewerDialog
-from kart.utils import setting, DIFFSTYLES
+from kart.gui.diffviewer import DiffViewerDialog, loadDiff
+from kart.utils import setting, currentMapExtent, DIFFSTYLES
 
 from qgis.core import Qgis, QgsProject, QgsVectorLayer, QgsWkbTypes
 from qgis.utils import iface
@@ -16,6 +18,8 @@ from qgis.PyQt.QtCore import (
     QPoint,
     QRectF,
     QDateTime,
+    QThread,
+    pyqtSignal,
 )
 from qgis.PyQt.QtGui import (
     QPixmap,
@@ -48,6 +52,12 @@ COL_SPACING = 20
 PEN_WIDTH = 2
 MARGIN = 50
 
+STATS_COLUMN = 6
+# Number of changed features per dataset, keyed by
+# (repo path, dataset filter, refa, refb).
+# Commits never change, so entries are valid for the whole session
+_diffStatsCache = {}
+
 COLORS = [
     QColor(Qt.red),
     QColor(Qt.green),
@@ -61,6 +71,69 @@ COLORS = [
 ]
 
 
+# Folder with the files of the diff layers added to the project. The layers
+# use them until QGIS is closed, so it is only deleted then
+_diffLayersFolder = None
+
+
+def _diffLayerFile(name):
+    """
+    Returns a path for a new diff layer file with the given name, in a
+    folder of its own within _diffLayersFolder
+    """
+    global _diffLayersFolder
+    if _diffLayersFolder is None:
+        _diffLayersFolder = tempfile.TemporaryDirectory()
+    return os.path.join(tempfile.mkdtemp(dir=_diffLayersFolder.name), name)
+
+
+def diffStatsText(stats):
+    return f"{sum(stats.values()):,}"
+
+
+def diffStatsTooltip(stats):
+    return "\n".join(f"{name}: {count:,}" for name, count in stats.items())
+
+
+class DiffStatsFetcher(QThread):
+    """
+    Computes the number of changed features of commits in a background
+    thread, so they can be shown in the history without blocking it
+    """
+
+    statsFetched = pyqtSignal(str, object)
+    statsFailed = pyqtSignal(str, str)
+
+    def __init__(self, repo, dataset, parent=None):
+        QThread.__init__(self, parent)
+        self.repo = repo
+        self.dataset = dataset
+        self._queue = queue.Queue()
+
+    def enqueue(self, commitid, parentid):
+        self._queue.put((commitid, parentid))
+
+    def stop(self):
+        if self.isRunning():
+            self._queue.put(None)
+            self.wait()
+
+    def run(self):
+        while True:
+            refs = self._queue.get()
+            if refs is None:
+                return
+            commitid, parentid = refs
+            try:
+                stats = self.repo.diffStats(commitid, parentid, self.dataset)
+            except Exception as e:
+                self.statsFailed.emit(commitid, str(e))
+                continue
+            key = (self.repo.path, self.dataset, commitid, parentid)
+            _diffStatsCache[key] = stats
+            self.statsFetched.emit(commitid, stats)
+
+
 class HistoryTree(QTreeWidget):
     def __init__(self, repo, dataset, parent):
         super(HistoryTree, self).__init__()
@@ -70,18 +143,90 @@ class HistoryTree(QTreeWidget):
         self.filterText = ""
         self.startDate = QDateTime.fromSecsSinceEpoch(0).date()
         self.endDate = QDateTime.currentDateTime().date()
+        self.items = {}
+        self.pendingStats = set()
+        self.statsFetcher = DiffStatsFetcher(repo, dataset, self)
+        self.statsFetcher.statsFetched.connect(self._statsFetched)
+        self.statsFetcher.statsFailed.connect(self._statsFailed)
+        self.statsErrorShown = False
         self.initGui()
 
     def initGui(self):
         self.setContextMenuPolicy(Qt.CustomContextMenu)
         # self.header().setStretchLastSection(True)
         self.setHeaderLabels(
-            ["Graph", "Refs", "Description", "Author", "Date", "CommitID"]
+            ["Graph", "Refs", "Description", "Author", "Date", "CommitID", "Changes"]
         )
         self.customContextMenuRequested.connect(self._showPopupMenu)
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.verticalScrollBar().valueChanged.connect(self.fetchVisibleStats)
         self.populate()
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.fetchVisibleStats()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.fetchVisibleStats()
+
+    def stopFetchingStats(self):
+        self.statsFetcher.stop()
+
+    def _visibleItems(self):
+        rect = self.viewport().rect()
+        item = self.itemAt(rect.topLeft())
+        while item is not None and self.visualItemRect(item).top() <= rect.bottom():
+            yield item
+            item = self.itemBelow(item)
+
+    def fetchVisibleStats(self):
+        """
+        Requests the number of changed features for the commits currently
+        visible in the tree, if not already known
+        """
+        if not self.isVisible():
+            return
+        for item in self._visibleItems():
+            if not isinstance(item, CommitTreeItem) or item.stats is not None:
+                continue
+            if item.statsError is not None:
+                continue
+            commitid = item.commit["commit"]
+            parents = item.commit["parents"]
+            if not parents or commitid in self.pendingStats:
+                continue
+            self.pendingStats.add(commitid)
+            self.statsFetcher.enqueue(commitid, parents[0])
+        if self.pendingStats and not self.statsFetcher.isRunning():
+            self.statsFetcher.start()
+
+    def _statsFetched(self, commitid, stats):
+        self.pendingStats.discard(commitid)
+        item = self.items.get(commitid)
+        if item is not None and stats is not None:
+            item.setStats(stats)
+
+    def _statsFailed(self, commitid, error):
+        self.pendingStats.discard(commitid)
+        item = self.items.get(commitid)
+        if item is not None:
+            item.setStatsError(error)
+        # Shown once, since the same error is likely to happen for every commit
+        if not self.statsErrorShown:
+            self.statsErrorShown = True
+            self.message(
+                f"Could not count the changed features of commit {commitid[:7]}: "
+                f"{error}",
+                Qgis.Warning,
+            )
+
+    def diffStats(self, refa, refb):
+        key = (self.repo.path, self.dataset, refa, refb)
+        if key not in _diffStatsCache:
+            _diffStatsCache[key] = self.repo.diffStats(refa, refb, self.dataset)
+        return _diffStatsCache[key]
+
     def _showPopupMenu(self, point):
         def _f(f, *args):
             def wrapper():
@@ -106,6 +251,17 @@ class HistoryTree(QTreeWidget):
                     ),
                     icons.diffIcon,
                 )
+                actions[
+                    "Show changes introduced by this commit in current map extent..."
+                ] = (
+                    _f(
+                        self.showChangesBetweenCommits,
+                        item.commit["commit"],
+                        parents[0],
+                        True,
+                    ),
+                    icons.diffIcon,
+                )
                 actions["Save changes as patch..."] = (
                     _f(
                         self.savePatch,
@@ -117,6 +273,10 @@ class HistoryTree(QTreeWidget):
                     _f(self.saveAsLayer, item.commit["commit"], parents[0]),
                     icons.addtoQgisIcon,
                 )
+                actions["Export changes to file..."] = (
+                    _f(self.exportChanges, item.commit["commit"], parents[0]),
+                    icons.exportIcon,
+                )
             elif len(parents) > 1:
                 for parent in parents:
                     actions[
@@ -240,12 +400,10 @@ class HistoryTree(QTreeWidget):
                 Qgis.Warning,
             )
             return
-        diff = self.repo.diff(refa, parent)
-        dialog = DiffViewerDialog(self, diff, self.repo)
-        dialog.exec()
+        self._showDiffViewer(refa, parent)
 
     @executeskart
-    def showChangesBetweenCommits(self, refa, refb):
+    def showChangesBetweenCommits(self, refa, refb, inCurrentExtent=False):
         hasSchemaChanges = self.repo.diffHasSchemaChanges(refa, refb)
         if hasSchemaChanges:
             self.message(
@@ -254,8 +412,23 @@ class HistoryTree(QTreeWidget):
                 Qgis.Warning,
             )
             return
-        diff = self.repo.diff(refa, refb)
-        dialog = DiffViewerDialog(self, diff, self.repo)
+        extent = currentMapExtent() if inCurrentExtent else None
+        self._showDiffViewer(refa, refb, extent)
+
+    def _showDiffViewer(self, refa, refb, extent=None):
+        # Cached stats can only be reused if they are not limited to a dataset
+        totals = self.diffStats(refa, refb) if self.dataset is None else None
+        diff, totals = loadDiff(self.repo, refa, refb, extent=extent, totals=totals)
+        if extent is not None and not any(diff.values()):
+            self.message("There are no changes in the current map extent", Qgis.Warning)
+            return
+        dialog = DiffViewerDialog(
+            self,
+            diff,
+            self.repo,
+            totals=totals,
+            loadAll=lambda: self.repo.diff(refa, refb, raiseErrors=True),
+        )
         dialog.exec()
 
     @executeskart
@@ -270,7 +443,21 @@ class HistoryTree(QTreeWidget):
 
     @executeskart
     def saveAsLayer(self, refa, refb):
-        hasSchemaChanges = self.repo.diffHasSchemaChanges(refb, refa)
+        self._exportChanges(refa, refb, _diffLayerFile(f"diff_{refa[:7]}.gpkg"))
+
+    @executeskart
+    def exportChanges(self, refa, refb):
+        filename, _ = QFileDialog.getSaveFileName(
+            iface.mainWindow(),
+            "Export changes",
+            f"diff_{refa[:7]}.gpkg",
+            "GeoPackage (*.gpkg);;FlatGeobuf (*.fgb)",
+        )
+        if filename:
+            self._exportChanges(refa, refb, filename)
+
+    def _exportChanges(self, refa, refb, filename):
+        hasSchemaChanges = self.repo.diffHasSchemaChanges(refa, refb)
         if hasSchemaChanges:
             self.message(
                 "There are schema changes between the selected commits "
@@ -278,12 +465,12 @@ class HistoryTree(QTreeWidget):
                 Qgis.Warning,
             )
             return
-        diff = self.repo.diff(refb, refa)
-        for dataset in diff:
-            geojson = {"type": "FeatureCollection", "features": diff[dataset]}
-            layer = QgsVectorLayer(
-                json.dumps(geojson), f"{dataset}_diff_{refa[:7]}", "ogr"
-            )
+        sources = exportDiff(self.repo, filename, refa, refb)
+        if not sources:
+            self.message("There are no changes to export", Qgis.Warning)
+            return
+        for dataset, source in sources.items():
+            layer = QgsVectorLayer(source, f"{dataset}_diff_{refa[:7]}", "ogr")
             styleName = setting(DIFFSTYLES) or "standard"
             typeString = QgsWkbTypes.geometryDisplayString(layer.geometryType()).lower()
             styleFolder = os.path.join(
@@ -333,6 +520,7 @@ class HistoryTree(QTreeWidget):
 
         self.log = {c["commit"]: c for c in commits}
         self.clear()
+        self.items = {}
 
         maxcol = 0
         for c in commits:
@@ -348,6 +536,13 @@ class HistoryTree(QTreeWidget):
         grafted = False
         for i, commit in enumerate(commits):
             item = CommitTreeItem(commit, self)
+            parent = commit["parents"][0] if commit["parents"] else None
+            stats = _diffStatsCache.get(
+                (self.repo.path, self.dataset, commit["commit"], parent)
+            )
+            if stats is not None:
+                item.setStats(stats)
+            self.items[commit["commit"]] = item
             self.addTopLevelItem(item)
             img = self.graphImage(commit, width)
             w = GraphWidget(img)
@@ -358,7 +553,7 @@ class HistoryTree(QTreeWidget):
         if grafted:
             item = ShallowCloneWarningItem(self)
             self.addTopLevelItem(item)
-        for i in range(1, 6):
+        for i in range(1, STATS_COLUMN):
             self.resizeColumnToContents(i)
         self.setColumnWidth(0, width + MARGIN)
         self.header().setSectionResizeMode(0, QHeaderView.Fixed)
@@ -442,6 +637,7 @@ class HistoryTree(QTreeWidget):
                 withinDates = date >= self.startDate and date <= self.endDate
                 hide = hide or not withinDates
                 item.setHidden(hide)
+        self.fetchVisibleStats()
 
 
 class GraphWidget(QWidget):
@@ -461,6 +657,8 @@ class CommitTreeItem(QTreeWidgetItem):
     def __init__(self, commit, parent):
         QTreeWidgetItem.__init__(self, parent)
         self.commit = commit
+        self.stats = None
+        self.statsError = None
         if commit["refs"]:
             labelslist = []
             for label in commit["refs"]:
@@ -495,6 +693,16 @@ class CommitTreeItem(QTreeWidgetItem):
         self.setText(4, commit["authorTime"])
         self.setText(5, commit["abbrevCommit"])
 
+    def setStats(self, stats):
+        self.stats = stats
+        self.setText(STATS_COLUMN, diffStatsText(stats))
+        self.setToolTip(STATS_COLUMN, diffStatsTooltip(stats))
+
+    def setStatsError(self, error):
+        self.statsError = error
+        self.setText(STATS_COLUMN, "?")
+        self.setToolTip(STATS_COLUMN, error)
+
 
 WIDGET, BASE = uic.loadUiType(
     os.path.join(os.path.dirname(__file__), "historyviewer.ui")
@@ -530,6 +738,7 @@ class HistoryDialog(WIDGET, BASE):
         layout.addWidget(self.history)
         self.frameHistory.setLayout(layout)
         self.history.currentItemChanged.connect(self.commitSelected)
+        self.finished.connect(self.history.stopFetchingStats)
         self.txtFilter.textChanged.connect(self._filterCommmits)
         self.dateEditStart.valueChanged.connect(self._filterCommmits)
         self.dateEditEnd.valueChanged.connect(self._filterCommmits)
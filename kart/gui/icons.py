@@ -24,6 +24,7 @@ crossIcon = icon("cross.png")
 datasetIcon = icon("dataset.png")
 deleteIcon = icon("delete.png")
 diffIcon = icon("changes.png")
+exportIcon = icon("openinqgis.png")
 discardIcon = icon("reset.png")
 featureIcon = icon("layer.png")
 importIcon = icon("import.png")
@@ -84,7 +84,7 @@ class DownloadAndInstallThread(QThread):
 
     def _download(self, url, filename):
         fullurl = f"{url}/{filename}"
-        logging.info(f"Downloading Kart from: {fullurl}")
+        logging.info("Downloading Kart from: %s", fullurl)
         dirname = tempfile.mkdtemp()
         downloadpath = os.path.join(dirname, filename)
         chunk_size = 1024
@@ -23,8 +23,12 @@ class MapSwipeTool(QgsMapTool):
     def _connect(self, isConnect=True):
         if isConnect:
             self.canvas().mapCanvasRefreshed.connect(self.swipe.setMap)
+            self.layer.repaintRequested.connect(self.swipe.invalidate)
+            self.layer.styleChanged.connect(self.swipe.invalidate)
         else:
             self.canvas().mapCanvasRefreshed.disconnect(self.swipe.setMap)
+            self.layer.repaintRequested.disconnect(self.swipe.invalidate)
+            self.layer.styleChanged.disconnect(self.swipe.invalidate)
 
     def activate(self):
         super().activate()
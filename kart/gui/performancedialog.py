@@ -0,0 +1,128 @@
+import os
+
+from qgis.utils import iface
+
+from qgis.PyQt import uic
+from qgis.PyQt.QtWidgets import (
+    QDialog,
+    QFileDialog,
+    QHeaderView,
+    QTableWidgetItem,
+)
+
+from kart import instrumentation, scheduler
+from kart.plugin_bus import subscriber_latencies, clear_latencies
+
+WIDGET, BASE = uic.loadUiType(
+    os.path.join(os.path.dirname(__file__), "performancedialog.ui")
+)
+
+COMMAND_COLUMNS = [
+    "Action",
+    "Command",
+    "Repository",
+    "Queue wait (ms)",
+    "Wall (ms)",
+    "Spawn (ms)",
+    "JSON parse (ms)",
+    "stdout (bytes)",
+    "stderr (bytes)",
+    "Exit code",
+]
+
+ACTION_COLUMNS = ["Action", "Kart commands", "Total time (ms)"]
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.0f}"
+
+
+class PerformanceDialog(BASE, WIDGET):
+    def __init__(self):
+        super(QDialog, self).__init__(iface.mainWindow())
+        self.setupUi(self)
+
+        for table, columns in (
+            (self.tableCommands, COMMAND_COLUMNS),
+            (self.tableActions, ACTION_COLUMNS),
+        ):
+            table.setColumnCount(len(columns))
+            table.setHorizontalHeaderLabels(columns)
+            table.verticalHeader().hide()
+            table.setEditTriggers(table.NoEditTriggers)
+            table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+
+        self.btnRefresh.clicked.connect(self.fillContent)
+        self.btnClear.clicked.connect(self.clear)
+        self.btnExport.clicked.connect(self.export)
+        self.buttonBox.rejected.connect(self.reject)
+
+        self.fillContent()
+
+    def fillContent(self):
+        records = instrumentation.slowest()
+        self.tableCommands.setRowCount(len(records))
+        for row, record in enumerate(records):
+            values = [
+                record.action or "",
+                record.command,
+                record.repo or "",
+                _ms(record.waitTime),
+                _ms(record.wallTime),
+                _ms(record.spawnTime),
+                _ms(record.parseTime),
+                str(record.stdoutBytes),
+                str(record.stderrBytes),
+                str(record.exitCode),
+            ]
+            for col, value in enumerate(values):
+                self.tableCommands.setItem(row, col, QTableWidgetItem(value))
+
+        totals = instrumentation.actionTotals()
+        self.tableActions.setRowCount(len(totals))
+        for row, (action, count, seconds) in enumerate(totals):
+            values = [action, str(count), _ms(seconds)]
+            for col, value in enumerate(values):
+                self.tableActions.setItem(row, col, QTableWidgetItem(value))
+
+        buckets = []
+        for bound, count in instrumentation.histogram():
+            label = f"≤{bound} ms" if bound is not None else "slower"
+            buckets.append(f"{label}: {count}")
+        self.labelHistogram.setText("Command wall times — " + ", ".join(buckets))
+
+        stats = scheduler.stats()
+        self.labelScheduler.setText(
+            f"Scheduler — running: {stats['runningReads']} read-only "
+            f"(limit {stats['maxReads']}), {stats['runningWrites']} modifying; "
+            f"waiting: {stats['waiting']}; "
+            f"queued so far: {stats['queued']} of {stats['commands']} commands, "
+            f"average wait {_ms(stats['averageWait'])} ms, "
+            f"longest wait {_ms(stats['maxWait'])} ms"
+        )
+
+        subscribers = []
+        for name, stats in sorted(
+            subscriber_latencies().items(), key=lambda item: -item[1]["max"]
+        ):
+            subscribers.append(
+                f"{name}: {stats['count']} responses, "
+                f"average {_ms(stats['total'] / stats['count'])} ms, "
+                f"slowest {_ms(stats['max'])} ms, {stats['late']} late"
+            )
+        self.labelBus.setText(
+            "Plugin bus subscribers — " + ("; ".join(subscribers) or "no responses")
+        )
+
+    def clear(self):
+        instrumentation.clear()
+        scheduler.resetStats()
+        clear_latencies()
+        self.fillContent()
+
+    def export(self):
+        filename, _ = QFileDialog.getSaveFileName(
+            self, "Export", "", "JSON lines files (*.jsonl)"
+        )
+        if filename:
+            instrumentation.exportJsonl(filename)
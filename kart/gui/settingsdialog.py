@@ -6,7 +6,20 @@ from qgis.gui import QgsMessageBar
 from qgis.PyQt import uic
 from qgis.PyQt.QtWidgets import QDialog, QSizePolicy, QFileDialog
 
-from kart.utils import setting, setSetting, KARTPATH, HELPERMODE, AUTOCOMMIT, DIFFSTYLES
+# kartapi imports this module through the installation warning dialog, so
+# it can only be imported as a module here
+from kart import logging, scheduler, helper, kartapi
+from kart.utils import (
+    setting,
+    setSetting,
+    KARTPATH,
+    HELPERMODE,
+    AUTOCOMMIT,
+    DIFFSTYLES,
+    LOGLEVEL,
+    MAXCONCURRENTREADS,
+    ASYNCBUS,
+)
 
 WIDGET, BASE = uic.loadUiType(
     os.path.join(os.path.dirname(__file__), "settingsdialog.ui")
@@ -30,6 +43,7 @@ class SettingsDialog(BASE, WIDGET):
         self.buttonBox.rejected.connect(self.reject)
 
         self.comboDiffStyles.addItems(DIFF_STYLES)
+        self.comboLogLevel.addItems(logging.LEVELS)
 
         self.setValues()
 
@@ -37,7 +51,10 @@ class SettingsDialog(BASE, WIDGET):
         self.comboDiffStyles.setCurrentText(setting(DIFFSTYLES))
         self.chkHelperMode.setChecked(setting(HELPERMODE))
         self.chkAutoCommit.setChecked(setting(AUTOCOMMIT))
+        self.chkAsyncBus.setChecked(setting(ASYNCBUS))
         self.txtKartPath.setText(setting(KARTPATH))
+        self.comboLogLevel.setCurrentText(logging.level())
+        self.spinMaxReads.setValue(scheduler.maxReads())
 
     def browse(self, textbox):
         folder = QFileDialog.getExistingDirectory(
@@ -47,8 +64,16 @@ class SettingsDialog(BASE, WIDGET):
             textbox.setText(folder)
 
     def okClicked(self):
-        setSetting(KARTPATH, self.txtKartPath.text())
+        if self.txtKartPath.text() != setting(KARTPATH):
+            setSetting(KARTPATH, self.txtKartPath.text())
+            kartapi.resetKartInstallation()
         setSetting(HELPERMODE, self.chkHelperMode.isChecked())
+        helper.checkInBackground()
         setSetting(AUTOCOMMIT, self.chkAutoCommit.isChecked())
+        setSetting(ASYNCBUS, self.chkAsyncBus.isChecked())
         setSetting(DIFFSTYLES, self.comboDiffStyles.currentText())
+        setSetting(LOGLEVEL, self.comboLogLevel.currentText())
+        logging.setLevel(self.comboLogLevel.currentText())
+        setSetting(MAXCONCURRENTREADS, self.spinMaxReads.value())
+        scheduler.setMaxReads(self.spinMaxReads.value())
         self.accept()
@@ -2,7 +2,7 @@
 # (C) 2015 by Hirofumi Hayashi and Luiz Motta
 # email: hayashi@apptec.co.jp and motta.luiz@gmail.com
 
-from qgis.PyQt.QtCore import QRect, QLine, Qt, QSize
+from qgis.PyQt.QtCore import QRect, QLine, Qt, QSize, QTimer
 from qgis.PyQt.QtGui import QColor, QImage, QPainter
 
 from qgis.core import QgsMapRendererCustomPainterJob, QgsMapSettings
@@ -19,13 +19,35 @@ class SwipeMap(QgsMapCanvasItem):
         self.layers = []
         self.canvas = canvas
         self.image = None
+        # Extent, size and layers the cached image was rendered for
+        self.renderedKey = None
+        # Renders the layers again once the signals invalidating the image
+        # in the current event loop iteration have been handled
+        self.renderTimer = QTimer()
+        self.renderTimer.setSingleShot(True)
+        self.renderTimer.setInterval(0)
+        self.renderTimer.timeout.connect(self._render)
 
     def clear(self):
         del self.layers[:]
         self.length = -1
+        self.invalidate()
 
     def setLayer(self, layer):
         self.layers = [layer]
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Discards the rendered image and renders the layers again (e.g. after
+        the layer or its style changed)
+        """
+        self.renderedKey = None
+        self.renderTimer.start()
+
+    def _render(self):
+        self.setMap()
+        self.update()
 
     def setIsVertical(self, isVertical):
         self.isVertical = isVertical
@@ -33,7 +55,8 @@ class SwipeMap(QgsMapCanvasItem):
     def setLength(self, x, y):
         y = self.image.height() - y
         self.length = x if self.isVertical else y
-        self.setMap()
+        # Only the visible part of the rendered image changes, so there is
+        # no need to render the layers again
         self.update()
 
     def paint(self, painter, *args):  # NEED *args for WINDOWS!
@@ -49,14 +72,34 @@ class SwipeMap(QgsMapCanvasItem):
             w = self.image.width() - 2
             line = QLine(0, h - 1, w - 1, h - 1)
 
-        image = self.image.copy(0, 0, int(w), int(h))
-        painter.drawImage(QRect(0, 0, int(w), int(h)), image)
+        rect = QRect(0, 0, int(w), int(h))
+        painter.drawImage(rect, self.image, rect)
         painter.drawLine(line)
 
+    def _renderKey(self):
+        mapSettings = self.canvas.mapSettings()
+        return (
+            self.canvas.extent().toString(),
+            self.canvas.size().width(),
+            self.canvas.size().height(),
+            mapSettings.rotation(),
+            mapSettings.destinationCrs().authid(),
+            tuple(layer.id() for layer in self.layers),
+        )
+
     def setMap(self):
+        """
+        Renders the swipe layers into an image, unless it was already
+        rendered for the current extent, scale and layers
+        """
         if len(self.layers) == 0:
             return
 
+        key = self._renderKey()
+        if self.image is not None and key == self.renderedKey:
+            return
+        self.renderedKey = key
+
         self.setRect(self.canvas.extent())
         self.image = QImage(
             QSize(self.canvas.size().width() - 2, self.canvas.size().height() - 2),
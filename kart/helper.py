@@ -0,0 +1,188 @@
+"""
+Keeps the Kart helper process warm when helper mode is enabled.
+
+In helper mode, Kart commands are served by a long-lived helper process,
+which is started by the first command that needs it. The plugin starts it
+in the background as soon as it is loaded, so the first command run by the
+user does not pay for it, and checks it periodically with a cheap command.
+
+If a check fails, it is retried, which starts a new helper. After
+MAX_FAILURES failures in a row, commands are run in direct mode until a
+later check succeeds.
+"""
+
+import os
+import subprocess
+import threading
+import time
+
+from qgis.PyQt.QtCore import QTimer
+
+from kart import logging
+from kart.utils import setting, HELPERMODE
+
+# Seconds between health checks
+CHECK_INTERVAL = 60
+# Seconds to wait for a health check command to finish
+CHECK_TIMEOUT = 30
+# Failed checks in a row before falling back to direct mode
+MAX_FAILURES = 3
+
+_lock = threading.Lock()
+_checking = False
+_fallback = False
+# True once the helper has answered a check, until a check fails
+_warm = False
+_stats = {
+    "coldLatency": None,
+    "warmChecks": 0,
+    "warmTotal": 0.0,
+    "warmMax": 0.0,
+    "checks": 0,
+    "failures": 0,
+    "lastError": None,
+}
+
+_timer = None
+
+
+def useHelper():
+    """
+    Returns True if Kart commands should be run through the helper
+    """
+    return setting(HELPERMODE) and not _fallback
+
+
+def _runCheck():
+    # Imported here, since kartapi uses this module to set up the environment
+    from kart.kartapi import kartExecutable, _kartEnvironment
+
+    env = dict(_kartEnvironment())
+    env["KART_USE_HELPER"] = "1"
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run(
+            [kartExecutable(), "--version"],
+            shell=os.name == "nt",
+            env=env,
+            stdout=subprocess.PIPE,
+            stdin=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=CHECK_TIMEOUT,
+        )
+        ok = proc.returncode == 0 and proc.stdout.startswith("Kart v")
+        error = None if ok else (proc.stderr.strip() or proc.stdout.strip())
+    except (OSError, subprocess.SubprocessError) as e:
+        ok = False
+        error = str(e)
+    return ok, time.perf_counter() - start, error
+
+
+def _recordCheck(ok, elapsed, error):
+    global _warm, _fallback
+    with _lock:
+        _stats["checks"] += 1
+        if ok:
+            if _warm:
+                _stats["warmChecks"] += 1
+                _stats["warmTotal"] += elapsed
+                _stats["warmMax"] = max(_stats["warmMax"], elapsed)
+            else:
+                _stats["coldLatency"] = elapsed
+            _warm = True
+            if _fallback:
+                logging.info("Kart helper is working again, leaving direct mode")
+            _fallback = False
+        else:
+            _warm = False
+            _stats["failures"] += 1
+            _stats["lastError"] = error
+
+
+def check():
+    """
+    Checks that the helper answers, starting it if needed and retrying up
+    to MAX_FAILURES times. Falls back to direct mode if it does not.
+
+    Returns True if the helper is working
+    """
+    global _fallback
+    for _ in range(MAX_FAILURES):
+        ok, elapsed, error = _runCheck()
+        _recordCheck(ok, elapsed, error)
+        if ok:
+            return True
+        logging.error("Kart helper check failed: %s", error)
+    with _lock:
+        if not _fallback:
+            logging.error("Kart helper is not working, falling back to direct mode")
+        _fallback = True
+    return False
+
+
+def _checkThread():
+    global _checking
+    try:
+        check()
+    finally:
+        with _lock:
+            _checking = False
+
+
+def checkInBackground():
+    """
+    Runs check() in a background thread, unless helper mode is disabled or
+    a check is already running
+    """
+    global _checking
+    if not setting(HELPERMODE):
+        return
+    with _lock:
+        if _checking:
+            return
+        _checking = True
+    threading.Thread(target=_checkThread, name="kart_helper", daemon=True).start()
+
+
+def start():
+    """
+    Starts the helper in the background and schedules the periodic checks
+    """
+    global _timer
+    if _timer is None:
+        _timer = QTimer()
+        _timer.setInterval(CHECK_INTERVAL * 1000)
+        _timer.timeout.connect(checkInBackground)
+        _timer.start()
+    checkInBackground()
+
+
+def stop():
+    global _timer
+    if _timer is not None:
+        _timer.stop()
+        _timer = None
+
+
+def stats():
+    """
+    Returns a dict with the mode in use, the latency of the first command
+    served by the helper since it was started (cold) and of those served
+    once it was running (warm), in seconds, and the number of checks run
+    and failed
+    """
+    with _lock:
+        ret = dict(_stats)
+        fallback = _fallback
+    if not setting(HELPERMODE):
+        ret["mode"] = "direct"
+    elif fallback:
+        ret["mode"] = "direct (helper not working)"
+    else:
+        ret["mode"] = "helper"
+    if ret["warmChecks"]:
+        ret["warmAverage"] = ret["warmTotal"] / ret["warmChecks"]
+    else:
+        ret["warmAverage"] = ret["warmMax"] = None
+    return ret
@@ -0,0 +1,173 @@
+"""
+Records timing and size data for every Kart command run by the plugin, so
+the user actions that cost the most subprocess time can be found.
+
+Records are kept in a rolling in-memory buffer, and can be exported to a
+JSON lines file.
+"""
+
+import json
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+# Number of records kept in memory
+MAX_RECORDS = 1000
+
+# Upper bounds (in milliseconds) of the wall time histogram buckets
+HISTOGRAM_BUCKETS = [10, 50, 100, 500, 1000, 5000, 10000]
+
+_records = deque(maxlen=MAX_RECORDS)
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class CommandRecord:
+    """
+    Timing and size data for a single Kart command
+    """
+
+    def __init__(self, commands, path, waitTime=0.0):
+        self.command = " ".join(commands[1:])
+        self.repo = path
+        self.action = currentAction()
+        self.timestamp = time.time()
+        # Time spent queued in the scheduler before the command could start
+        self.waitTime = waitTime
+        self.wallTime = 0.0
+        self.spawnTime = 0.0
+        self.parseTime = 0.0
+        self.stdoutBytes = 0
+        self.stderrBytes = 0
+        self.exitCode = None
+        self._start = time.perf_counter()
+
+    def spawned(self):
+        self.spawnTime = time.perf_counter() - self._start
+
+    def finished(self, exitCode, stdoutBytes, stderrBytes):
+        self.wallTime = time.perf_counter() - self._start
+        self.exitCode = exitCode
+        self.stdoutBytes = stdoutBytes
+        self.stderrBytes = stderrBytes
+        _local.lastRecord = self
+        with _lock:
+            _records.append(self)
+
+    def asDict(self):
+        return {
+            "timestamp": self.timestamp,
+            "action": self.action,
+            "command": self.command,
+            "repo": self.repo,
+            "waitTime": self.waitTime,
+            "wallTime": self.wallTime,
+            "spawnTime": self.spawnTime,
+            "parseTime": self.parseTime,
+            "stdoutBytes": self.stdoutBytes,
+            "stderrBytes": self.stderrBytes,
+            "exitCode": self.exitCode,
+        }
+
+
+def currentAction():
+    """
+    Returns the name of the user action being run in this thread, if any
+    """
+    actions = getattr(_local, "actions", None)
+    return actions[-1] if actions else None
+
+
+@contextmanager
+def action(name):
+    """
+    Attributes the Kart commands run in this thread within the context to
+    the given user action. Nested actions are attributed to the outermost one
+    """
+    if not hasattr(_local, "actions"):
+        _local.actions = []
+    _local.actions.append(currentAction() or name)
+    try:
+        yield
+    finally:
+        _local.actions.pop()
+
+
+@contextmanager
+def parsing():
+    """
+    Adds the time spent within the context to the parse time of the last
+    command run in this thread
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record = getattr(_local, "lastRecord", None)
+        if record is not None:
+            record.parseTime += time.perf_counter() - start
+
+
+def records():
+    with _lock:
+        return list(_records)
+
+
+def clear():
+    with _lock:
+        _records.clear()
+
+
+def slowest(count=50):
+    """
+    Returns the slowest recorded commands, including their parse time
+    """
+    return sorted(records(), key=lambda r: r.wallTime + r.parseTime, reverse=True)[
+        :count
+    ]
+
+
+def histogram():
+    """
+    Returns a list of (upperBound, count) tuples with the distribution of the
+    wall times of recorded commands, in milliseconds. The last bucket has no
+    upper bound (None)
+    """
+    counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+    for record in records():
+        ms = record.wallTime * 1000
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if ms <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    return list(zip(HISTOGRAM_BUCKETS + [None], counts))
+
+
+def actionTotals():
+    """
+    Returns a list of (action, count, seconds) tuples with the total time spent
+    running Kart for each user action, most expensive first
+    """
+    totals = {}
+    for record in records():
+        name = record.action or "(other)"
+        count, seconds = totals.get(name, (0, 0.0))
+        totals[name] = (count + 1, seconds + record.wallTime + record.parseTime)
+    return sorted(
+        ((name, c, s) for name, (c, s) in totals.items()),
+        key=lambda t: t[2],
+        reverse=True,
+    )
+
+
+def exportJsonl(filename):
+    """
+    Writes the recorded commands to a JSON lines file, one record per line
+    """
+    with open(filename, "w") as f:
+        for record in records():
+            f.write(json.dumps(record.asDict()) + "\n")
@@ -1,24 +1,41 @@
 import json
 import locale
+import mmap
 import os
 import re
+import struct
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+import uuid
 
 from typing import Optional, List, Callable
+from contextlib import contextmanager
 from functools import wraps
 
 from urllib.parse import urlparse
 
-from qgis.PyQt.QtCore import Qt
+from qgis.PyQt.QtCore import (
+    Qt,
+    QCoreApplication,
+    QObject,
+    QThread,
+    pyqtSignal,
+    pyqtSlot,
+)
 from qgis.PyQt.QtGui import QColor
 from qgis.PyQt.QtWidgets import (
     QApplication,
 )
 
 from qgis.core import (
+    QgsApplication,
+    QgsCoordinateTransform,
+    QgsCsException,
     QgsDataSourceUri,
+    QgsGeometry,
     QgsMessageOutput,
     QgsProject,
     QgsCoordinateReferenceSystem,
@@ -32,13 +49,33 @@ from qgis.utils import iface
 from kart.gui.userconfigdialog import UserConfigDialog
 from kart.gui.installationwarningdialog import InstallationWarningDialog
 
-from kart.utils import setting, setSetting, KARTPATH, HELPERMODE
-from kart import logging
+from kart.utils import setting, setSetting, KARTPATH, ASYNCBUS
+from kart import logging, instrumentation, scheduler, helper
+from kart.plugin_bus import get_bus, call_async, has_listeners
+
+# orjson parses JSON much faster than the json module, and can parse directly
+# from a memory mapped file. It is used if available
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 MINIMUM_SUPPORTED_VERSION = "0.14.0"
 CURRENT_VERSION = "0.15.3"
 
+# Maximum number of changed features per dataset in a diff preview
+DIFF_PREVIEW_SIZE = 1000
+
+# Content of the HEAD file of a repo when a branch is checked out
+BRANCH_REF_PREFIX = "ref: refs/heads/"
+
+# Seconds during which the tables listed in a database are reused
+TABLES_CACHE_TTL = 300
+
+# (time, tables) for each database connection string listed
+_tablesCache = {}
+
 
 class KartException(Exception):
     pass
@@ -48,79 +85,292 @@ class KartNotSupportedOperationException(Exception):
     pass
 
 
+def showKartExceptionMessage(ex):
+    """
+    Shows the error message of a failed Kart command to the user
+    """
+    dlg = QgsMessageOutput.createMessageOutput()
+    dlg.setTitle("Kart")
+    lines = str(ex).splitlines()
+    msglines = []
+    for line in lines:
+        # skip lines that refer to missing loads of shared libraries
+        if line.startswith("ERROR 1: Can't load") or ".dylib" in line:
+            continue
+        if "The specified procedure could not be found" in line:
+            continue
+        if line.strip():
+            msglines.append(line)
+    errors = "<br>".join(msglines)
+    if "You have uncommitted changes" in errors:
+        msg = """<p><b>This operation requires a clean working tree.<br>
+            Commit or discard your working tree changes and then retry.</b></p>
+            """
+    else:
+        msg = f"""
+            <p><b>Kart failed with the following message:</b></p>
+            <p style="color:red">{errors}</p>
+            """
+    dlg.setMessage(msg, QgsMessageOutput.MessageHtml)
+    dlg.showMessage()
+
+
 def executeskart(f):
     @wraps(f)
     def inner(*args):
         try:
-            if checkKartInstalled():
-                return f(*args)
+            with instrumentation.action(f.__qualname__):
+                installation = _installation
+                if (
+                    installation is not None and installation.isSupported
+                ) or checkKartInstalled():
+                    return f(*args)
         except KartException as ex:
-            dlg = QgsMessageOutput.createMessageOutput()
-            dlg.setTitle("Kart")
-            lines = str(ex).splitlines()
-            msglines = []
-            for line in lines:
-                # skip lines that refer to missing loads of shared libraries
-                if line.startswith("ERROR 1: Can't load") or ".dylib" in line:
-                    continue
-                if "The specified procedure could not be found" in line:
-                    continue
-                if line.strip():
-                    msglines.append(line)
-            errors = "<br>".join(msglines)
-            if "You have uncommitted changes" in errors:
-                msg = """<p><b>This operation requires a clean working tree.<br>
-                    Commit or discard your working tree changes and then retry.</b></p>
-                    """
-            else:
-                msg = f"""
-                    <p><b>Kart failed with the following message:</b></p>
-                    <p style="color:red">{errors}</p>
-                    """
-            dlg.setMessage(msg, QgsMessageOutput.MessageHtml)
-            dlg.showMessage()
+            showKartExceptionMessage(ex)
 
     return inner
 
-def send_bus_signal(caller, action: str, txn_uuid: Optional[str] = None, sender: str = "kart") -> str:
+
+def send_bus_signal(
+    caller,
+    action: str,
+    method: str,
+    txn_uuid: Optional[str] = None,
+    sender: str = "kart",
+    changes: Optional[dict] = None,
+) -> str:
     """
     Sends a signal to the inter-plugin bus.
 
     Payload format:
-        {"uuid": <txn_uuid>, "sender": <sender>, "method": <calling method name>, "action": <action>}
-    """
-    import uuid
+        {"uuid": <txn_uuid>, "sender": <sender>, "method": <method>, "action": <action>}
 
+    "after" signals also have a "changes" entry, with the summary of the
+    changes made, as described in ChangeBatch.summary
+    """
     if txn_uuid is None:
         txn_uuid = str(uuid.uuid4())
 
-    method = sys._getframe(1).f_code.co_name
-    bus = None
+    payload = {
+        "uuid": txn_uuid,
+        "sender": sender,
+        "method": method,
+        "action": action,
+    }
+    if changes is not None:
+        payload["changes"] = changes
+    logging.debug("Plugin bus request: %s", payload)
     try:
-        from kart.plugin_bus import get_bus
         bus = get_bus()
-    except Exception as e:
-        print(f"[kart] {method}: plugin bus unavailable ({e})")
-
-    if bus is not None:
-        payload = {
-            "uuid": txn_uuid,
-            "sender": sender,
-            "method": method,
-            "action": action,
-        }
-        print(f"[kart] {method} -> payload={payload}")
-        try:
+        if setting(ASYNCBUS):
+            # "after" notifications do not wait for any response
+            responses = call_async(bus, payload, wait=action != "after")
+        else:
             responses = bus.call(payload, caller)
-            print(f"[kart] {method} <- responses={responses}")
-            if not responses:
-                print(f"[kart] {method}: no server responded; continuing")
-        except Exception as e:
-            print(f"[kart] {method}: bus call failed ({e})")
+        if responses is not None:
+            logging.debug("Plugin bus responses to %s: %s", method, responses)
+    except Exception as e:
+        logging.error("Plugin bus call for %s failed: %s", method, e)
 
     return txn_uuid
 
 
+# Seconds a thread waits for a bus signal it sends through the main thread
+MAIN_THREAD_SIGNAL_WAIT = 5
+
+
+class _MainThreadCaller(QObject):
+    """
+    Runs functions in the thread it lives in, the main one
+    """
+
+    call = pyqtSignal(object, object)
+
+    def __init__(self):
+        super().__init__()
+        self.call.connect(self._run, Qt.QueuedConnection)
+
+    @pyqtSlot(object, object)
+    def _run(self, func, done):
+        try:
+            func()
+        finally:
+            done.set()
+
+
+_mainThreadCaller = None
+_mainThreadCallerLock = threading.Lock()
+
+
+def _callInMainThread(func, timeout=MAIN_THREAD_SIGNAL_WAIT):
+    """
+    Calls a function in the main thread, waiting up to timeout seconds for it
+    to return if called from another thread. The wait is bounded, so a busy
+    main thread (for instance, one waiting for this thread to finish) cannot
+    block the caller
+    """
+    global _mainThreadCaller
+    app = QCoreApplication.instance()
+    if app is None or QThread.currentThread() == app.thread():
+        func()
+        return
+    with _mainThreadCallerLock:
+        if _mainThreadCaller is None:
+            _mainThreadCaller = _MainThreadCaller()
+            _mainThreadCaller.moveToThread(app.thread())
+    done = threading.Event()
+    _mainThreadCaller.call.emit(func, done)
+    done.wait(timeout)
+
+
+class ChangeBatch:
+    """
+    Operations on repositories whose changes are announced in the bus with a
+    single "before" signal for each repository, and a single "after" signal
+    with a summary of all of them.
+
+    If deferred is True, signals are sent from the main thread, for
+    operations run in others. "before" signals are still sent when each
+    operation begins, and the owner of the batch has to send the "after" one
+    with send()
+    """
+
+    def __init__(self, deferred=False):
+        self.uuid = str(uuid.uuid4())
+        self.deferred = deferred
+        self.methods = []
+        self.repos = {}
+        # Method of the "before" signal sent for each repo path
+        self.announced = {}
+        self._lock = threading.Lock()
+
+    def before(self, repo, method):
+        """
+        Sends the "before" signal for a repo, unless it was already sent
+        """
+        with self._lock:
+            if repo.path in self.announced:
+                return
+            self.announced[repo.path] = method
+
+        def _send():
+            send_bus_signal(repo, action="before", method=method, txn_uuid=self.uuid)
+
+        if self.deferred:
+            _callInMainThread(_send)
+        else:
+            _send()
+
+    def begin(self, repo, method, discards=False, ref="HEAD", dataset=None):
+        """
+        Registers an operation that is about to change the working copy of a
+        repo. If it discards working copy changes, restoring the working copy
+        to the given ref, they are counted first
+        """
+        with self._lock:
+            self.methods.append(method)
+            if repo.path not in self.repos:
+                self.repos[repo.path] = {
+                    "repo": repo,
+                    "oldHead": repo.headCommit(),
+                    "counts": {},
+                }
+            entry = self.repos[repo.path]
+        self.before(repo, method)
+        if not discards or not has_listeners(get_bus()):
+            return
+        # Working copy changes are lost once the operation is run, so they
+        # have to be counted now
+        try:
+            counts = repo.diffStats(None if ref == "HEAD" else ref, dataset=dataset)
+        except KartException as e:
+            logging.error("Could not count working copy changes: %s", e)
+            return
+        with self._lock:
+            _addCounts(entry["counts"], counts)
+
+    def summary(self):
+        """
+        Returns a dict with the methods run and a list with the changes made
+        to each repo. Each of them is a dict with the repo path, its HEAD
+        commit before and after the changes, and the number of changed
+        features for each affected dataset
+        """
+        listening = has_listeners(get_bus())
+        repos = []
+        for path, entry in self.repos.items():
+            repo = entry["repo"]
+            oldHead = entry["oldHead"]
+            newHead = repo.headCommit()
+            counts = dict(entry["counts"])
+            if listening and oldHead and newHead and oldHead != newHead:
+                try:
+                    _addCounts(counts, repo.commitDiffStats(oldHead, newHead))
+                except KartException as e:
+                    logging.error("Could not count committed changes: %s", e)
+            repos.append(
+                {
+                    "repo": path,
+                    "oldHead": oldHead,
+                    "newHead": newHead,
+                    "datasets": sorted(counts),
+                    "featureCounts": counts,
+                }
+            )
+        return {"methods": list(self.methods), "repos": repos}
+
+    def send(self, changes=None):
+        """
+        Sends the "after" signal, with the given summary of the changes, or
+        the one returned by summary() if it is None
+        """
+        methods = set(self.methods) or set(self.announced.values())
+        method = methods.pop() if len(methods) == 1 else "batch"
+        send_bus_signal(
+            None,
+            action="after",
+            method=method,
+            txn_uuid=self.uuid,
+            changes=self.summary() if changes is None else changes,
+        )
+
+
+def _addCounts(counts, other):
+    for name, count in other.items():
+        counts[name] = counts.get(name, 0) + count
+
+
+# Batch of changes of the coalescedChanges() context open in each thread
+_changeBatches = threading.local()
+
+
+@contextmanager
+def coalescedChanges(batch=None):
+    """
+    Coalesces the bus signals of all the operations run within the context,
+    in the current thread, so a single "after" signal is sent at the end of
+    it. Contexts opened within another one are part of the outer one.
+
+    If a batch is given, operations are added to it and it is up to the
+    caller to send it, which allows coalescing operations run in several
+    threads.
+
+    Yields the current ChangeBatch
+    """
+    current = getattr(_changeBatches, "batch", None)
+    if current is not None:
+        yield current
+        return
+    owned = batch is None
+    _changeBatches.batch = batch = batch or ChangeBatch()
+    try:
+        yield batch
+    finally:
+        _changeBatches.batch = None
+        if owned and batch.methods:
+            batch.send()
+
+
 def kartExecutable() -> str:
     """
     Returns the path to the kart executable
@@ -139,11 +389,221 @@ def kartExecutable() -> str:
     return path
 
 
-def checkKartInstalled(showMessage=True, useCache=True):
-    version = installedVersion(useCache)
-    supported_version_tuple = tuple(
-        int(p) for p in MINIMUM_SUPPORTED_VERSION.split(".")[:3]
+class KartInstallation:
+    """
+    The Kart executable found for a Kart folder setting, with its version and
+    capabilities, which are only read from Kart once
+    """
+
+    def __init__(self, path, executable, versionDetails):
+        # Value of the Kart folder setting it was found for
+        self.path = path
+        self.executable = executable
+        self.versionDetails = versionDetails or ""
+        self.version = None
+        self.versionTuple = None
+        # Version of the libraries Kart is built with (GDAL, PDAL...)
+        self.components = {}
+        if self.versionDetails.startswith("Kart v"):
+            self.version = "".join(
+                c for c in self.versionDetails.split(" ")[1] if c.isdigit() or c == "."
+            )
+            self.versionTuple = _versionTuple(self.version)
+            for line in self.versionDetails.splitlines()[1:]:
+                for name, version in re.findall(r"([A-Za-z][\w ]*?) v([\d.]+)", line):
+                    self.components[name.strip()] = version
+        self._capabilities = None
+
+    @classmethod
+    def find(cls):
+        path = setting(KARTPATH)
+        executable = kartExecutable()
+        try:
+            versionDetails = executeKart(["--version"], os.path.dirname(__file__))
+        except Exception:
+            versionDetails = None
+        return cls(path, executable, versionDetails)
+
+    @property
+    def isInstalled(self):
+        return self.version is not None
+
+    @property
+    def isSupported(self):
+        return self.isInstalled and self.versionTuple >= _versionTuple(
+            MINIMUM_SUPPORTED_VERSION
+        )
+
+    @property
+    def supportsPointClouds(self):
+        return "PDAL" in self.components
+
+    def capabilities(self):
+        """
+        Returns a dict with the capabilities of this Kart version:
+
+        - commands: list of the names of the available commands
+        - diffOutputFormats: list of the output formats of 'kart diff'
+        - featureCount: True if 'kart diff' can only count changed features
+        - importFormats: the output of 'kart import --list-formats'
+        - importAmend: True if 'kart import' can amend the previous commit
+
+        They are read from Kart the first time they are needed for a given
+        executable and version, and cached on disk. An empty dict is returned
+        if they cannot be read
+        """
+        if self._capabilities is not None:
+            return self._capabilities
+        if not self.isInstalled:
+            return {}
+        key = f"{self.executable}|{self.version}"
+        capabilities = _readCapabilitiesCache().get(key)
+        # Entries written by older versions of the plugin may lack some keys
+        if capabilities is None or not all(k in capabilities for k in CAPABILITIES):
+            try:
+                capabilities = self._probeCapabilities()
+            except KartException as e:
+                logging.error("Could not read Kart capabilities: %s", e)
+                return {}
+            _writeCapabilitiesCache(key, capabilities)
+        self._capabilities = capabilities
+        return capabilities
+
+    @staticmethod
+    def _probeCapabilities():
+        folder = os.path.dirname(__file__)
+        helpText = executeKart(["--help"], folder)
+        # Commands are listed after the "Commands:" heading (or several
+        # "... commands:" ones), indented by two spaces and followed by their
+        # description, whose wrapped lines are indented further
+        helpText = helpText[helpText.find("ommands:") :]
+        commands = re.findall(r"^  ([a-z][\w-]*)(?:\s|$)", helpText, re.MULTILINE)
+        diffHelp = executeKart(["diff", "--help"], folder)
+        match = re.search(r"--output-format\s+\[([^\]]+)\]", diffHelp)
+        diffFormats = match.group(1).split("|") if match else []
+        importHelp = executeKart(["import", "--help"], folder)
+        return {
+            "commands": sorted(set(commands)),
+            "diffOutputFormats": [f.strip() for f in diffFormats],
+            "featureCount": "--only-feature-count" in diffHelp,
+            "importFormats": executeKart(["import", "--list-formats"]),
+            "importAmend": "--amend" in importHelp,
+        }
+
+    def supportsCommand(self, name):
+        """
+        Returns False if the given command is known not to be available.
+        If the capabilities could not be read, it is assumed to be
+        """
+        commands = self.capabilities().get("commands")
+        return not commands or name in commands
+
+    def supportsDiffOutputFormat(self, name):
+        formats = self.capabilities().get("diffOutputFormats")
+        return not formats or name in formats
+
+    @property
+    def supportsFeatureCount(self):
+        return self.capabilities().get("featureCount", True)
+
+    @property
+    def supportsImportAmend(self):
+        # Unlike the others, not assumed if unknown, since it is optional
+        return self.capabilities().get("importAmend", False)
+
+    def importFormats(self):
+        """
+        Returns the output of 'kart import --list-formats'
+        """
+        formats = self.capabilities().get("importFormats")
+        if formats is None:
+            formats = executeKart(["import", "--list-formats"])
+        return formats
+
+
+# Keys of the dicts returned by KartInstallation.capabilities()
+CAPABILITIES = (
+    "commands",
+    "diffOutputFormats",
+    "featureCount",
+    "importFormats",
+    "importAmend",
+)
+
+_capabilitiesLock = threading.Lock()
+
+
+def _capabilitiesCacheFile():
+    return os.path.join(
+        QgsApplication.qgisSettingsDirPath(), "kart", "capabilities.json"
     )
+
+
+def _readCapabilitiesCache():
+    """
+    Returns the capabilities cached on disk, as a dict with the capabilities
+    of each Kart executable and version
+    """
+    with _capabilitiesLock:
+        try:
+            with open(_capabilitiesCacheFile(), encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _writeCapabilitiesCache(key, capabilities):
+    cache = _readCapabilitiesCache()
+    cache[key] = capabilities
+    filename = _capabilitiesCacheFile()
+    with _capabilitiesLock:
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            # Written to a temporary file first, so other QGIS instances
+            # never read a partially written cache
+            tmpFilename = f"{filename}.{os.getpid()}.tmp"
+            with open(tmpFilename, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+            os.replace(tmpFilename, filename)
+        except OSError as e:
+            logging.error("Could not write Kart capabilities cache: %s", e)
+
+
+def _versionTuple(version):
+    return tuple(int(p) for p in version.split(".")[:3] if p)
+
+
+_installation = None
+_installationLock = threading.Lock()
+
+
+def kartInstallation(refresh=False) -> KartInstallation:
+    """
+    Returns the Kart installation in use. It is only looked up the first
+    time, or after the settings change and resetKartInstallation is called
+    """
+    global _installation
+    installation = _installation
+    if installation is not None and not refresh:
+        return installation
+    with _installationLock:
+        if _installation is None or refresh:
+            _installation = KartInstallation.find()
+        return _installation
+
+
+def resetKartInstallation():
+    global _installation
+    with _installationLock:
+        _installation = None
+
+
+def checkKartInstalled(showMessage=True, useCache=True):
+    installation = kartInstallation(refresh=not useCache)
+    if useCache and installation.path != setting(KARTPATH):
+        installation = kartInstallation(refresh=True)
+    version = installation.version
     msg = ""
     if version is None:
         msg = (
@@ -153,18 +613,15 @@ def checkKartInstalled(showMessage=True, useCache=True):
             "You can also download releases from <a href='https://kartproject.org'>"
             "https://kartproject.org</a>.</p>"
         )
-    else:
-        version_tuple = tuple(int(p) for p in version.split(".")[:3])
-        versionOk = version_tuple >= supported_version_tuple
-        if not versionOk:
-            msg = (
-                f"<p><b>The installed Kart version ({version}) is not"
-                " supported by the plugin. Only versions "
-                f"{MINIMUM_SUPPORTED_VERSION} and later are supported.<b><p>"
-                "<p>Click Install to download and install the latest Kart release. "
-                "You can also download releases from <a href='https://kartproject.org'>"
-                "https://kartproject.org</a>.</p>"
-            )
+    elif not installation.isSupported:
+        msg = (
+            f"<p><b>The installed Kart version ({version}) is not"
+            " supported by the plugin. Only versions "
+            f"{MINIMUM_SUPPORTED_VERSION} and later are supported.<b><p>"
+            "<p>Click Install to download and install the latest Kart release. "
+            "You can also download releases from <a href='https://kartproject.org'>"
+            "https://kartproject.org</a>.</p>"
+        )
     if msg:
         if showMessage:
             dlg = InstallationWarningDialog(msg, CURRENT_VERSION)
@@ -172,6 +629,7 @@ def checkKartInstalled(showMessage=True, useCache=True):
             installed = checkKartInstalled(showMessage=False, useCache=False)
             if installed:
                 setSetting(KARTPATH, "")
+                resetKartInstallation()
                 iface.messageBar().pushMessage(
                     "Install",
                     "Kart has been correctly installed",
@@ -189,34 +647,11 @@ def checkKartInstalled(showMessage=True, useCache=True):
         return True
 
 
-# Cached values, to avoid calling kart unless path is changed in settings
-
-kartVersion = None
-kartPath = None
-
-
 def installedVersion(useCache=True):
-    global kartVersion
-    global kartPath
-    path = setting(KARTPATH)
-    if useCache and path is not None and path == kartPath:
-        return kartVersion
-    else:
-        try:
-            version = executeKart(["--version"], os.path.dirname(__file__))
-            if not version.startswith("Kart v"):
-                raise Exception()
-            else:
-                versionnum = "".join(
-                    [c for c in version.split(" ")[1] if c.isdigit() or c == "."]
-                )
-                kartVersion = versionnum
-                kartPath = path
-                return versionnum
-        except Exception:
-            kartVersion = None
-            kartPath = None
-            return None
+    installation = kartInstallation(refresh=not useCache)
+    if installation.path != setting(KARTPATH):
+        installation = kartInstallation(refresh=True)
+    return installation.version
 
 
 def kartVersionDetails():
@@ -234,11 +669,10 @@ def kartVersionDetails():
         return errtxt
 
 
-def executeKart(commands, path=None, jsonoutput=False, feedback=None):
-    commands.insert(0, kartExecutable())
-    if jsonoutput:
-        commands.append("-ojson")
-
+def _kartEnvironment():
+    """
+    Returns the environment to use for running Kart commands
+    """
     # The env PYTHONHOME/GDAL_DRIVER_PATH from QGIS can interfere with Kart.
     if not hasattr(executeKart, "env"):
         executeKart.env = os.environ.copy()
@@ -247,57 +681,307 @@ def executeKart(commands, path=None, jsonoutput=False, feedback=None):
         if "GDAL_DRIVER_PATH" in executeKart.env:
             executeKart.env.pop("GDAL_DRIVER_PATH")
 
-    # always set the use helper env var as it is long lived and the setting may have changed
-    executeKart.env["KART_USE_HELPER"] = "1" if setting(HELPERMODE) else ""
+    # always set the use helper env var as it is long lived and the setting may have
+    # changed, or the helper may have stopped working
+    executeKart.env["KART_USE_HELPER"] = "1" if helper.useHelper() else ""
 
     # TODO - merge into Kart proper already
     logging.debug("Enabling VPC/VRTs generation...")
     executeKart.env["KART_POINT_CLOUD_VPCS"] = "1"
     executeKart.env["KART_RASTER_VRTS"] = "1"
 
+    return executeKart.env
+
+
+def _byteCount(text, encoding):
+    return len(text.encode(encoding, errors="replace"))
+
+
+def loadJson(text):
+    """
+    Parses a JSON string, using orjson if available
+    """
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def loadJsonFile(f, encoding="utf-8"):
+    """
+    Parses the JSON content of a file object opened in binary mode.
+
+    If orjson is available, the file is memory mapped and parsed without
+    reading it into memory first. Otherwise the json module is used.
+    """
+    f.seek(0)
+    if orjson is not None and os.fstat(f.fileno()).st_size:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                try:
+                    return orjson.loads(view)
+                except orjson.JSONDecodeError:
+                    # Not UTF-8 encoded, use the slower path below
+                    pass
+    data = f.read()
     try:
-        encoding = locale.getdefaultlocale()[1] or "utf-8"
+        return json.loads(data)
+    except UnicodeDecodeError:
+        return json.loads(data.decode(encoding))
+
+
+@contextmanager
+def _waitCursor():
+    # The wait cursor can only be changed from the GUI thread. Commands run
+    # from background threads (e.g. prefetching) must leave it untouched
+    app = QApplication.instance()
+    isGuiThread = app is not None and QThread.currentThread() == app.thread()
+    if isGuiThread:
         QApplication.setOverrideCursor(Qt.WaitCursor)
-        logging.debug(f"Command: {' '.join(commands)}")
-        # TODO - all of this should be replaced by useage of QgsTask which
-        #  will execute on a background thread. There are a number of
-        #  ways in which this can deadlock
-        with subprocess.Popen(
-            commands,
-            shell=os.name == "nt",
-            env=executeKart.env,
-            stdout=subprocess.PIPE,
-            stdin=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            encoding=encoding,
-            cwd=path,
-        ) as proc:
-            if feedback is not None:
-                output = []
-                err = []
-                for line in proc.stderr:
-                    feedback(line)
-                    err.append(line)
-                for line in proc.stdout:
-                    output.append(line)
-                stdout = "".join(output)
-                stderr = "".join(err)
-                proc.communicate()  # need to get the returncode
-            else:
-                stdout, stderr = proc.communicate()
-            logging.debug(f"Command output: {stdout}")
+    try:
+        yield
+    finally:
+        if isGuiThread:
+            QApplication.restoreOverrideCursor()
+
+
+def executeKart(commands, path=None, jsonoutput=False, feedback=None):
+    if jsonoutput and feedback is None:
+        commands.append("-ojson")
+        return executeKartJson(commands, path)
+
+    commands.insert(0, kartExecutable())
+    if jsonoutput:
+        commands.append("-ojson")
+
+    env = _kartEnvironment()
+
+    try:
+        encoding = locale.getdefaultlocale()[1] or "utf-8"
+        with _waitCursor(), scheduler.command(commands[1], path) as waitTime:
+            logging.debug("Command: %s", " ".join(commands))
+            record = instrumentation.CommandRecord(commands, path, waitTime)
+            # TODO - all of this should be replaced by useage of QgsTask which
+            #  will execute on a background thread. There are a number of
+            #  ways in which this can deadlock
+            with subprocess.Popen(
+                commands,
+                shell=os.name == "nt",
+                env=env,
+                stdout=subprocess.PIPE,
+                stdin=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+                encoding=encoding,
+                cwd=path,
+            ) as proc:
+                record.spawned()
+                if feedback is not None:
+                    output = []
+                    err = []
+                    for line in proc.stderr:
+                        feedback(line)
+                        err.append(line)
+                    for line in proc.stdout:
+                        output.append(line)
+                    stdout = "".join(output)
+                    stderr = "".join(err)
+                    proc.communicate()  # need to get the returncode
+                else:
+                    stdout, stderr = proc.communicate()
+                record.finished(
+                    proc.returncode,
+                    _byteCount(stdout, encoding),
+                    _byteCount(stderr, encoding),
+                )
+                logging.debug("Command output: %s", stdout)
+                if proc.returncode:
+                    raise KartException(stderr)
+                if jsonoutput:
+                    with instrumentation.parsing():
+                        return loadJson(stdout)
+                else:
+                    return stdout
+    except Exception as e:
+        logging.error(str(e))
+        raise KartException(str(e))
+
+
+def executeKartJson(commands, path=None):
+    """
+    Runs a Kart command that writes JSON to its standard output, and returns
+    the parsed output.
+
+    The output is written straight to a temporary file and parsed from there
+    (memory mapped, if orjson is available), instead of being read through a
+    pipe into a string, so large outputs are not copied several times.
+    """
+    commands.insert(0, kartExecutable())
+    env = _kartEnvironment()
+    encoding = locale.getdefaultlocale()[1] or "utf-8"
+    try:
+        with _waitCursor(), scheduler.command(
+            commands[1], path
+        ) as waitTime, tempfile.TemporaryFile() as outfile:
+            logging.debug("Command: %s", " ".join(commands))
+            record = instrumentation.CommandRecord(commands, path, waitTime)
+            with subprocess.Popen(
+                commands,
+                shell=os.name == "nt",
+                env=env,
+                stdout=outfile,
+                stdin=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+                encoding=encoding,
+                cwd=path,
+            ) as proc:
+                record.spawned()
+                _, stderr = proc.communicate()
+            record.finished(
+                proc.returncode,
+                os.fstat(outfile.fileno()).st_size,
+                _byteCount(stderr, encoding),
+            )
+            if logging.isEnabled(logging.DEBUG):
+                outfile.seek(0)
+                head = outfile.read(logging.MAX_LENGTH)
+                logging.debug(
+                    "Command output: %s", head.decode(encoding, errors="replace")
+                )
             if proc.returncode:
                 raise KartException(stderr)
-            if jsonoutput:
-                return json.loads(stdout)
-            else:
-                return stdout
+            with instrumentation.parsing():
+                return loadJsonFile(outfile, encoding)
     except Exception as e:
         logging.error(str(e))
         raise KartException(str(e))
-    finally:
-        QApplication.restoreOverrideCursor()
+
+
+def executeKartLines(commands, path=None):
+    """
+    Runs a Kart command and yields its output line by line as it is produced,
+    so large outputs are never held in memory as a whole.
+
+    If the caller stops iterating before the output is exhausted, the Kart
+    process is killed.
+    """
+    commands.insert(0, kartExecutable())
+    env = _kartEnvironment()
+    encoding = locale.getdefaultlocale()[1] or "utf-8"
+    # stderr goes to a file, so a chatty command cannot block while we are
+    # only consuming stdout
+    with scheduler.command(commands[1], path) as waitTime, tempfile.TemporaryFile(
+        "w+", encoding=encoding
+    ) as errfile:
+        logging.debug("Command: %s", " ".join(commands))
+        record = instrumentation.CommandRecord(commands, path, waitTime)
+        try:
+            proc = subprocess.Popen(
+                commands,
+                shell=os.name == "nt",
+                env=env,
+                stdout=subprocess.PIPE,
+                stdin=subprocess.DEVNULL,
+                stderr=errfile,
+                universal_newlines=True,
+                encoding=encoding,
+                cwd=path,
+            )
+        except Exception as e:
+            logging.error(str(e))
+            raise KartException(str(e))
+        record.spawned()
+        stdoutBytes = 0
+        try:
+            for line in proc.stdout:
+                stdoutBytes += _byteCount(line, encoding)
+                yield line
+            proc.wait()
+            if proc.returncode:
+                errfile.seek(0)
+                stderr = errfile.read()
+                logging.error(stderr)
+                raise KartException(stderr)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            record.finished(
+                proc.returncode, stdoutBytes, os.fstat(errfile.fileno()).st_size
+            )
+
+
+def _wkbFromHex(value):
+    """
+    Returns the WKB bytes for a hex encoded geometry as found in Kart JSON
+    output. GeoPackage geometry headers are stripped if present.
+    """
+    data = bytes.fromhex(value)
+    if data[:2] == b"GP":
+        flags = data[3]
+        envelopeSize = (0, 32, 48, 48, 64)[(flags >> 1) & 0x07]
+        data = data[8 + envelopeSize :]
+    return data
+
+
+def geometryFromHexWkb(value):
+    """
+    Returns a QgsGeometry from a hex encoded geometry as found in Kart JSON output
+    """
+    geom = QgsGeometry()
+    if value:
+        geom.fromWkb(_wkbFromHex(value))
+    return geom
+
+
+def hexWkbBoundingBox(value):
+    """
+    Returns the bounding box of a hex encoded geometry as found in Kart JSON
+    output, or None for empty geometries. The envelope in the GeoPackage
+    header is used if present, so the geometry does not need to be parsed.
+    """
+    if not value:
+        return None
+    if value[:4] == "4750":  # "GP"
+        header = bytes.fromhex(value[:80])
+        flags = header[3]
+        if (flags >> 1) & 0x07:
+            byteorder = "<" if flags & 0x01 else ">"
+            minx, maxx, miny, maxy = struct.unpack(byteorder + "4d", header[8:40])
+            return QgsRectangle(minx, miny, maxx, maxy)
+    geom = geometryFromHexWkb(value)
+    return None if geom.isEmpty() else geom.boundingBox()
+
+
+def _extendBoundingBox(coords, bbox):
+    if coords and isinstance(coords[0], (int, float)):
+        x, y = coords[0], coords[1]
+        if bbox:
+            bbox[0] = min(bbox[0], x)
+            bbox[1] = min(bbox[1], y)
+            bbox[2] = max(bbox[2], x)
+            bbox[3] = max(bbox[3], y)
+        else:
+            bbox.extend([x, y, x, y])
+    else:
+        for c in coords:
+            _extendBoundingBox(c, bbox)
+
+
+def geojsonBoundingBox(geometry):
+    """
+    Returns the bounding box of a GeoJSON geometry, or None for empty geometries
+    """
+    if not geometry:
+        return None
+    bbox = []
+    if geometry["type"] == "GeometryCollection":
+        for geom in geometry["geometries"]:
+            _extendBoundingBox(geom["coordinates"], bbox)
+    else:
+        _extendBoundingBox(geometry["coordinates"], bbox)
+    return QgsRectangle(*bbox) if bbox else None
 
 
 class Repository:
@@ -309,6 +993,12 @@ class Repository:
     def executeKart(self, commands, jsonoutput=False):
         return executeKart(commands, self.path, jsonoutput)
 
+    def executeKartJson(self, commands):
+        return executeKartJson(commands, self.path)
+
+    def executeKartLines(self, commands):
+        return executeKartLines(commands, self.path)
+
     @staticmethod
     def supportedDbTypes():
         formats = {
@@ -316,7 +1006,7 @@ class Repository:
             "SQL Server": "mssql://",
             "MySQL": "mysql://",
         }
-        ret = executeKart(["import", "--list-formats"])
+        ret = kartInstallation().importFormats()
         supportedFormats = {}
         for name, protocol in formats.items():
             if protocol in ret:
@@ -325,10 +1015,42 @@ class Repository:
         return supportedFormats
 
     @staticmethod
-    def tablesToImport(source):
+    def supportedImportExtensions():
+        """
+        Returns the file extensions that Kart can import directly
+        """
+        ret = kartInstallation().importFormats()
+        extensions = {".gpkg", ".shp"}
+        extensions.update(f".{ext.lower()}" for ext in re.findall(r"PATH\.(\w+)", ret))
+        return extensions
+
+    @staticmethod
+    def tablesToImport(source, maxAge=TABLES_CACHE_TTL):
+        """
+        Returns the names of the tables that can be imported from a database.
+
+        Listings are cached for each connection string, and reused if they
+        are not older than maxAge seconds
+        """
+        tables = Repository.cachedTablesToImport(source, maxAge)
+        if tables is not None:
+            return tables
         ret = executeKart(["import", "--list", source], jsonoutput=True)
-        print(ret)
-        return list(list(ret.values())[0].keys())
+        tables = list(list(ret.values())[0].keys())
+        logging.debug("Tables to import: %s", tables)
+        _tablesCache[source] = (time.monotonic(), tables)
+        return list(tables)
+
+    @staticmethod
+    def cachedTablesToImport(source, maxAge=TABLES_CACHE_TTL):
+        """
+        Returns the cached names of the tables in a database, or None if
+        they have not been listed in the last maxAge seconds
+        """
+        cached = _tablesCache.get(source)
+        if cached is not None and time.monotonic() - cached[0] <= maxAge:
+            return list(cached[1])
+        return None
 
     @staticmethod
     def generate_clone_arguments(
@@ -443,10 +1165,26 @@ class Repository:
         else:
             self.executeKart(["init"])
 
-    def importIntoRepo(self, source, dataset=None):
+    def importIntoRepo(
+        self,
+        source,
+        dataset=None,
+        tables=None,
+        allTables=False,
+        message=None,
+        amend=False,
+    ):
         importArgs = [source]
+        if tables:
+            importArgs.extend(tables)
+        if allTables:
+            importArgs.append("--all-tables")
         if dataset:
             importArgs += ["--dataset", dataset]
+        if message:
+            importArgs += ["--message", message]
+        if amend:
+            importArgs.append("--amend")
         self.executeKart(["import"] + importArgs)
 
     def checkUserConfigured(self):
@@ -476,12 +1214,9 @@ class Repository:
             return False
 
     def reset(self, ref="HEAD"):
-        txn_uuid = send_bus_signal(self, action="before")
-        try:
+        with self._changingWorkingCopy("reset", discards=True):
             self.executeKart(["reset", ref, "-f"])
             self.updateCanvas()
-        finally:
-            send_bus_signal(self, action="after", txn_uuid=txn_uuid)
 
     def log(self, ref="HEAD", dataset=None, featureid=None):
         if dataset is not None:
@@ -493,8 +1228,7 @@ class Repository:
             commands = ["log", "-ojson", ref, "--", filt]
         else:
             commands = ["log", "-ojson", ref]
-        ret = self.executeKart(commands)
-        jsonRet = json.loads(ret)
+        jsonRet = self.executeKartJson(commands)
         log = {c["commit"]: c for c in jsonRet}
         if dataset is not None:
             commands = [
@@ -532,11 +1266,38 @@ class Repository:
             commits.append(log[commitid])
         return commits
 
+    # (HEAD commit, metadata of all datasets) of the last call to _headMeta()
+    _metaCache = None
+
+    def _headMeta(self):
+        """
+        Returns the metadata of all the datasets at HEAD, as returned by
+        'kart meta get'. It only changes with the HEAD commit, so it is cached
+        for it
+        """
+        head = self.headCommit()
+        cached = self._metaCache
+        if head is not None and cached is not None and cached[0] == head:
+            return cached[1]
+        meta = self.executeKart(["meta", "get"], True)
+        if head is not None:
+            self._metaCache = (head, meta)
+        return meta
+
+    def _datasetMeta(self, dataset):
+        meta = self._headMeta().get(dataset)
+        if meta is None:
+            meta = self.executeKart(["meta", "get", dataset], True)[dataset]
+        return meta
+
     def datasets(self):
+        """
+        Returns a (vectorLayers, tables) tuple with the names of the datasets
+        in the repo, from the cached metadata
+        """
         vectorLayers = []
         tables = []
-        meta = self.executeKart(["meta", "get"], True)
-        for name, dataset in meta.items():
+        for name, dataset in self._headMeta().items():
             crsProps = [k for k in dataset.keys() if k.startswith("crs/")]
             if crsProps:
                 vectorLayers.append(name)
@@ -549,20 +1310,20 @@ class Repository:
         return list(b.split("->")[-1].strip() for b in branches.keys())
 
     def currentBranch(self):
+        head = self._headRef()
+        if head is not None and head.startswith(BRANCH_REF_PREFIX):
+            return head[len(BRANCH_REF_PREFIX) :]
         branch = list(self.executeKart(["branch"], True).values())[0]["current"]
         return branch
 
     def checkoutBranch(self, branch, force=False):
-        txn_uuid = send_bus_signal(self, action="before")
-        try:
+        with self._changingWorkingCopy("checkoutBranch"):
             if force:
                 commands = ["checkout", "--force", branch]
             else:
                 commands = ["checkout", branch]
             self.executeKart(commands)
             self.updateCanvas()
-        finally:
-            send_bus_signal(self, action="after", txn_uuid=txn_uuid)
 
     def createBranch(self, branch, commit="HEAD"):
         return self.executeKart(["branch", branch, commit])
@@ -571,8 +1332,7 @@ class Repository:
         return self.executeKart(["branch", "-d", branch])
 
     def mergeBranch(self, branch, msg="", noff=False, ffonly=False):
-        txn_uuid = send_bus_signal(self, action="before")
-        try:
+        with self._changingWorkingCopy("mergeBranch"):
             commands = ["merge", branch, "--no-editor"]
             if msg:
                 commands.extend(["--message", msg])
@@ -583,8 +1343,6 @@ class Repository:
             ret = self.executeKart(commands, True)
             self.updateCanvas()
             return list(ret.values())[0].get("conflicts", [])
-        finally:
-            send_bus_signal(self, action="after", txn_uuid=txn_uuid)
 
     def abortMerge(self):
         return self.executeKart(["merge", "--abort"])
@@ -601,14 +1359,17 @@ class Repository:
     def deleteTag(self, tag):
         return self.executeKart(["tag", "-d", tag])
 
-    def diffHasSchemaChanges(self, refa=None, refb=None, dataset=None):
-        commands = ["diff"]
+    @staticmethod
+    def _diffRefs(refa=None, refb=None):
         if refa and refb:
-            commands.append(f"{refb}...{refa}")
+            return f"{refb}...{refa}"
         elif refa:
-            commands.append(refa)
+            return refa
         else:
-            commands.append("HEAD")
+            return "HEAD"
+
+    def diffHasSchemaChanges(self, refa=None, refb=None, dataset=None):
+        commands = ["diff", self._diffRefs(refa, refb)]
         if dataset is not None:
             commands.append(f"{dataset}:meta")
         else:
@@ -621,24 +1382,39 @@ class Repository:
         )
         return any(s is not None for s in schemaChanges)
 
-    def diff(self, refa=None, refb=None, dataset=None, featureid=None):
+    def diff(
+        self,
+        refa=None,
+        refb=None,
+        dataset=None,
+        featureid=None,
+        extent=None,
+        raiseErrors=False,
+    ):
+        """
+        Returns the changes between two refs (or in the working copy) as a dict
+        with a list of GeoJSON features for each changed dataset.
+
+        If an extent (a QgsReferencedRectangle) is passed, only changes to
+        features whose old or new version intersect it are returned.
+
+        Errors are ignored and the changes read so far are returned, unless
+        raiseErrors is True
+        """
         changes = {}
         try:
-            commands = ["diff", "--output-format=geojson:extracompact"]
-            if refa and refb:
-                commands.append(f"{refb}...{refa}")
-            elif refa:
-                commands.append(refa)
-            else:
-                commands.append("HEAD")
+            commands = [
+                "diff",
+                "--output-format=geojson:extracompact",
+                self._diffRefs(refa, refb),
+            ]
             if dataset is not None:
                 if featureid is not None:
                     commands.append(f"{dataset}:{featureid}")
                 else:
                     commands.append(dataset)
             if dataset is not None and featureid is not None:
-                ret = self.executeKart(commands)
-                changes[dataset] = json.loads(ret)["features"]
+                changes[dataset] = self.executeKartJson(commands)["features"]
             else:
                 tmpdirname = tempfile.TemporaryDirectory()
                 commands.extend(["--output", tmpdirname.name])
@@ -646,35 +1422,302 @@ class Repository:
                 for filename in os.listdir(tmpdirname.name):
                     path = os.path.join(tmpdirname.name, filename)
                     name = os.path.splitext(filename)[0]
-                    with open(path) as f:
-                        changes[name] = json.load(f)["features"]
+                    with open(path, "rb") as f, instrumentation.parsing():
+                        changes[name] = loadJsonFile(f)["features"]
                 tmpdirname.cleanup()
+            if extent is not None:
+                for name, features in changes.items():
+                    datasetExtent = self.datasetExtent(name, extent)
+                    if datasetExtent is not None:
+                        changes[name] = self._filterByExtent(features, datasetExtent)
         except Exception:
-            pass
+            if raiseErrors:
+                raise
         return changes
 
-    def restore(self, ref, dataset=None):
-        txn_uuid = send_bus_signal(self, action="before")
+    def diffStats(self, refa=None, refb=None, dataset=None):
+        """
+        Returns a dict with the number of changed features in each dataset
+        changed between two refs (or in the working copy). The changes
+        themselves are not fetched, so this is fast even for large diffs.
+        """
+        commands = ["diff", "--only-feature-count=exact", self._diffRefs(refa, refb)]
+        if dataset is not None:
+            commands.append(dataset)
+        ret = self.executeKart(commands, True)
+        return {name: count for name, count in ret.items() if count}
+
+    def commitDiffStats(self, oldCommit, newCommit):
+        """
+        Returns a dict with the number of features changed in each dataset
+        from one commit to another, whether the new one descends from the old
+        one or not
+        """
+        ret = self.executeKart(
+            ["diff", "--only-feature-count=exact", f"{oldCommit}..{newCommit}"], True
+        )
+        return {name: count for name, count in ret.items() if count}
+
+    def diffPreview(
+        self, refa=None, refb=None, dataset=None, limit=DIFF_PREVIEW_SIZE, totals=None
+    ):
+        """
+        Returns a preview of the changes between two refs (or in the working
+        copy), in the same format as diff(), with at most `limit` changed
+        features per dataset. Kart is stopped as soon as enough features have
+        been read for each dataset.
+
+        Returns a (changes, totals) tuple, with totals being the number of
+        changed features per dataset, as returned by diffStats(). It can be
+        passed if already known.
+        """
+        if totals is None:
+            totals = self.diffStats(refa, refb, dataset)
+        changes = {}
+        for name in totals:
+            schema = self._diffSchema(name, refa, refb)
+            geomColumn = None
+            pkColumn = None
+            for column in schema:
+                if column["dataType"] == "geometry" and geomColumn is None:
+                    geomColumn = column["name"]
+                if column.get("primaryKeyIndex") == 0:
+                    pkColumn = column["name"]
+            features = []
+            count = 0
+            items = self.diffFeatures(refa, refb, name)
+            try:
+                for _, changetype, values in items:
+                    # The new version of an updated feature always follows
+                    # the old one, and both are needed
+                    if changetype != "U+":
+                        if count == limit:
+                            break
+                        count += 1
+                    features.append(
+                        self._geojsonFeature(
+                            name, changetype, values, geomColumn, pkColumn
+                        )
+                    )
+            finally:
+                items.close()
+            changes[name] = features
+        return changes, totals
+
+    def _diffSchema(self, dataset, refa=None, refb=None):
+        """
+        Returns the schema of a dataset in a diff between two refs: the one at
+        refa (the new one), or the one at refb if the dataset was deleted
+        """
+        try:
+            return self.datasetSchema(dataset, refa or "HEAD")
+        except (KartException, KeyError):
+            if not refb:
+                raise
+        return self.datasetSchema(dataset, refb)
+
+    @staticmethod
+    def _geojsonFeature(dataset, changetype, values, geomColumn, pkColumn):
+        geometry = None
+        if geomColumn is not None and values.get(geomColumn):
+            geometry = json.loads(geometryFromHexWkb(values[geomColumn]).asJson())
+        return {
+            "type": "Feature",
+            "geometry": geometry,
+            "properties": {k: v for k, v in values.items() if k != geomColumn},
+            "id": f"{dataset}:feature:{values.get(pkColumn)}:{changetype}",
+        }
+
+    def datasetExtent(self, dataset, extent):
+        """
+        Returns an extent transformed into the CRS of a dataset, or None if the
+        dataset has no geometries or the extent cannot be transformed
+        """
+        crs = self.workingCopyLayerCrs(dataset)
+        if crs is None:
+            return None
+        transform = QgsCoordinateTransform(
+            extent.crs(), QgsCoordinateReferenceSystem(crs), QgsProject.instance()
+        )
         try:
+            return transform.transformBoundingBox(extent)
+        except QgsCsException:
+            return None
+
+    @staticmethod
+    def _filterByExtent(features, extent):
+        # Both versions of a modified feature are kept if any of them is in
+        # the extent, since the diff viewer needs them together
+        def _fid(feature):
+            fid = feature["id"]
+            if "::" in fid:
+                return fid.split("::")[1]
+            return fid.split(":")[2]
+
+        inExtent = set()
+        for feature in features:
+            bbox = geojsonBoundingBox(feature["geometry"])
+            if bbox is not None and bbox.intersects(extent):
+                inExtent.add(_fid(feature))
+        return [f for f in features if _fid(f) in inExtent]
+
+    def diffFeatures(self, refa=None, refb=None, dataset=None, extent=None):
+        """
+        Streams the features changed between two refs (or in the working
+        copy), without loading the whole diff in memory.
+
+        Yields (dataset, changetype, values) tuples, with changetype being
+        one of "I", "U-", "U+" or "D", and values a dict of column values as
+        returned by Kart (geometries are hex encoded WKB).
+
+        If an extent (a QgsReferencedRectangle) is passed, only changes to
+        features whose old or new version intersect it are yielded.
+        """
+        commands = ["diff", "--output-format=json-lines", self._diffRefs(refa, refb)]
+        if dataset is not None:
+            commands.append(dataset)
+        datasetExtents = {}
+        geomColumns = {}
+        for line in self.executeKartLines(commands):
+            line = line.strip()
+            if not line:
+                continue
+            item = loadJson(line)
+            if item.get("type") != "feature":
+                continue
+            name = item["dataset"]
+            old = item["change"].get("-")
+            new = item["change"].get("+")
+            if extent is not None:
+                if name not in datasetExtents:
+                    datasetExtents[name] = self.datasetExtent(name, extent)
+                    geomColumns[name] = self._geometryColumn(name, refa)
+                datasetExtent = datasetExtents[name]
+                if datasetExtent is not None and not any(
+                    self._valuesIntersect(values, geomColumns[name], datasetExtent)
+                    for values in (old, new)
+                ):
+                    continue
+            if old and new:
+                yield name, "U-", old
+                yield name, "U+", new
+            elif new:
+                yield name, "I", new
+            elif old:
+                yield name, "D", old
+
+    def _geometryColumn(self, dataset, ref=None):
+        for column in self.datasetSchema(dataset, ref or "HEAD"):
+            if column["dataType"] == "geometry":
+                return column["name"]
+
+    @staticmethod
+    def _valuesIntersect(values, geomColumn, extent):
+        if not values or geomColumn is None:
+            return False
+        bbox = hexWkbBoundingBox(values.get(geomColumn))
+        return bbox is not None and bbox.intersects(extent)
+
+    def datasetSchema(self, dataset, ref="HEAD"):
+        """
+        Returns the list of column definitions of a dataset at a given ref
+        """
+        if ref == "HEAD":
+            schema = self._datasetMeta(dataset).get("schema.json")
+            if schema is not None:
+                return schema
+        ret = self.executeKart(
+            ["meta", "get", "--ref", ref, dataset, "schema.json"], True
+        )
+        return ret[dataset]["schema.json"]
+
+    def restore(self, ref, dataset=None):
+        with self._changingWorkingCopy("restore", True, ref, dataset):
             if dataset is not None:
                 self.executeKart(["restore", "-s", ref, dataset])
             else:
                 self.executeKart(["restore", "-s", ref])
             self.updateCanvas()
-        finally:
-            send_bus_signal(self, action="after", txn_uuid=txn_uuid)
+
+    def status(self):
+        return list(self.executeKart(["status"], True).values())[0]
 
     def changes(self):
-        return (
-            list(self.executeKart(["status"], True).values())[0]
-            .get("workingCopy", {})
-            .get("changes")
-            or {}
-        )
+        return self.status().get("workingCopy", {}).get("changes") or {}
+
+    def summary(self):
+        """
+        Returns a dict with the state of the repo shown in the dock, from a
+        single 'kart status' call and the cached list of datasets:
+
+        - title: the title of the repo
+        - branch: the current branch, or None if HEAD is detached
+        - head: the abbreviated id of the HEAD commit
+        - merging: True if there is a merge in progress
+        - changes: the working copy changes, as returned by changes()
+        - datasets: a (vectorLayers, tables) tuple, as returned by datasets()
+        """
+        status = self.status()
+        return {
+            "title": self.title(),
+            "branch": status.get("branch"),
+            "head": status.get("abbrevCommit"),
+            "merging": status.get("state") == "merging" or "merging" in status,
+            "changes": (status.get("workingCopy") or {}).get("changes") or {},
+            "datasets": self.datasets(),
+        }
 
     def isWorkingTreeClean(self):
         return not bool(self.changes())
 
+    def _headRef(self):
+        """
+        Returns the content of the HEAD file of the repo, or None if it
+        cannot be read
+        """
+        try:
+            with open(os.path.join(self.path, ".kart", "HEAD")) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def headCommit(self):
+        """
+        Returns the id of the commit HEAD points to, or None if it cannot be
+        resolved. It is read from the repository files, without running Kart
+        """
+        gitdir = os.path.join(self.path, ".kart")
+        head = self._headRef()
+        if not head:
+            return None
+        try:
+            if not head.startswith("ref:"):
+                return head
+            ref = head[len("ref:") :].strip()
+            refPath = os.path.join(gitdir, *ref.split("/"))
+            if os.path.exists(refPath):
+                with open(refPath) as f:
+                    return f.read().strip() or None
+            with open(os.path.join(gitdir, "packed-refs")) as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2 and parts[1] == ref:
+                        return parts[0]
+        except OSError:
+            pass
+        return None
+
+    @contextmanager
+    def _changingWorkingCopy(self, method, discards=False, ref="HEAD", dataset=None):
+        """
+        Announces in the bus the changes made to the working copy within the
+        context, as part of the current batch of changes if any. discards is
+        True if working copy changes are discarded, restoring the given ref
+        """
+        with coalescedChanges() as batch:
+            batch.begin(self, method, discards, ref, dataset)
+            yield
+
     def isMerging(self):
         return os.path.exists(os.path.join(self.path, ".kart", "MERGE_MSG"))
 
@@ -696,7 +1739,7 @@ class Repository:
 
     def conflicts(self):
         commands = ["conflicts", "--output-format=geojson:extracompact"]
-        features = json.loads(self.executeKart(commands)).get("features", [])
+        features = self.executeKartJson(commands).get("features", [])
         conflicts = {}
         for feature in features:
             dataset, elementtype, fid, version = feature["id"].split(":")
@@ -746,18 +1789,39 @@ class Repository:
         else:
             self.executeKart(["push", remote, branch])
 
-    def pull(self, remote, branch):
-        ret = self.executeKart(["pull", remote, branch, "--no-editor"])
-        self.updateCanvas()
+    def fetch(self, remote=None):
+        """
+        Fetches from the given remote, or from all remotes if none is given
+        """
+        remotes = [remote] if remote else list(self.remotes())
+        for name in remotes:
+            self.executeKart(["fetch", name])
+
+    def pull(self, remote=None, branch=None, refreshLayers=True):
+        """
+        Pulls from the given remote and branch, or from the upstream of the
+        current branch if none is given. Layers of the repo in the current
+        project are repainted unless refreshLayers is False, which is needed
+        when pulling from a background thread
+        """
+        commands = ["pull"]
+        if remote is not None:
+            commands.extend([remote, branch])
+        commands.append("--no-editor")
+        with self._changingWorkingCopy("pull"):
+            ret = self.executeKart(commands)
+        if refreshLayers:
+            self.updateCanvas()
         return "kart conflicts" not in ret
 
     def layerBelongsToRepo(self, layer):
-        location = self.workingCopyLocation()
-        if location.lower().startswith("postgres"):
+        connection = self.postgresWorkingCopy()
+        if connection is not None:
             uri = QgsDataSourceUri(layer.source())
-            parse = urlparse(location)
-            database, schema = parse.path.strip("/").split("/", 1)
-            return uri.database() == database and uri.schema() == schema
+            return (
+                uri.database() == connection["database"]
+                and uri.schema() == connection["schema"]
+            )
         else:
             return f"{os.path.normpath(self.path)}{os.path.sep}" in os.path.normpath(
                 layer.source()
@@ -766,42 +1830,80 @@ class Repository:
     def workingCopyLocation(self):
         return self._config()["kart.workingcopy.location"]
 
+    # (location, connection) of the last call to postgresWorkingCopy()
+    _postgresCache = None
+
+    def postgresWorkingCopy(self):
+        """
+        Returns a dict with the host, port, database, schema, username and
+        password of the working copy, or None if it is not in PostgreSQL.
+
+        It is parsed once for each working copy location. All the layers of
+        the repo are given the same connection, so QGIS shares its pooled
+        connections between them
+        """
+        location = self.workingCopyLocation()
+        if not location.lower().startswith("postgres"):
+            return None
+        cached = self._postgresCache
+        if cached is None or cached[0] != location:
+            parse = urlparse(location)
+            database, schema = parse.path.strip("/").split("/", 1)
+            connection = {
+                "host": parse.hostname or "localhost",
+                "port": str(parse.port) if parse.port else "5432",
+                "database": database,
+                "schema": schema,
+                "username": parse.username,
+                "password": parse.password,
+            }
+            cached = self._postgresCache = (location, connection)
+        return cached[1]
+
     def workingCopyLayer(self, dataset):
         location = self.workingCopyLocation()
         path = os.path.join(self.path, location)
         if os.path.exists(path):
             layer = QgsVectorLayer(f"{path}|layername={dataset}", dataset)
             return layer
-        elif location.lower().startswith("postgres"):
-            parse = urlparse(location)
-            host = parse.hostname or "localhost"
-            port = str(parse.port) if parse.port else "5432"
-            database, schema = parse.path.strip("/").split("/", 1)
-            username = parse.username
-            password = parse.password
+        connection = self.postgresWorkingCopy()
+        if connection is not None:
             uri = QgsDataSourceUri()
-            uri.setConnection(host, port, database, username, password)
-            uri.setDataSource(schema, dataset, "geom")
+            uri.setConnection(
+                connection["host"],
+                connection["port"],
+                connection["database"],
+                connection["username"],
+                connection["password"],
+            )
+            # Columns and CRS are taken from the dataset metadata, so the
+            # provider does not have to query the database to find them
+            uri.setDataSource(
+                connection["schema"], dataset, self._geometryColumn(dataset) or ""
+            )
+            pkColumn = self.workingCopyLayerIdField(dataset)
+            if pkColumn is not None:
+                uri.setKeyColumn(pkColumn)
+            crs = self.workingCopyLayerCrs(dataset)
+            if crs is not None and crs.upper().startswith("EPSG:"):
+                uri.setSrid(crs.split(":")[1])
+            uri.setUseEstimatedMetadata(True)
             layer = QgsVectorLayer(uri.uri(), dataset, "postgres")
             return layer
 
     def workingCopyLayerIdField(self, dataset):
-        schema = self.executeKart(["meta", "get", dataset, "schema.json"], True)[
-            dataset
-        ]["schema.json"]
-        for attr in schema:
+        for attr in self.datasetSchema(dataset):
             if attr.get("primaryKeyIndex") == 0:
                 return attr["name"]
 
     def workingCopyLayerCrs(self, dataset):
-        meta = self.executeKart(["meta", "get", dataset], True)[dataset]
+        meta = self._datasetMeta(dataset)
         for k in meta.keys():
             if k.startswith("crs/"):
                 return k[4:-4]
 
     def datasetNameFromLayer(self, layer):
-        location = self.workingCopyLocation()
-        if location.lower().startswith("postgres"):
+        if self.postgresWorkingCopy() is not None:
             uri = QgsDataSourceUri(layer.source())
             return uri.table()
         else:
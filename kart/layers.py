@@ -25,7 +25,7 @@ from qgis.PyQt.QtWidgets import QAction, QInputDialog
 
 from kart.gui import icons
 from kart.gui.historyviewer import HistoryDialog
-from kart.gui.diffviewer import DiffViewerDialog
+from kart.gui.diffviewer import DiffViewerDialog, loadDiff
 from kart.gui.featurehistorydialog import FeatureHistoryDialog
 from kart.kartapi import executeskart
 from kart.utils import setting, AUTOCOMMIT
@@ -277,10 +277,15 @@ class LayerTracker:
                     level=Qgis.Warning,
                 )
                 return
-            diff = repo.diff(dataset=dataset)
+            diff, totals = loadDiff(repo, dataset=dataset)
             if diff.get(dataset):
                 dialog = DiffViewerDialog(
-                    iface.mainWindow(), diff, repo, showRecoverNewButton=False
+                    iface.mainWindow(),
+                    diff,
+                    repo,
+                    showRecoverNewButton=False,
+                    totals=totals,
+                    loadAll=lambda: repo.diff(dataset=dataset, raiseErrors=True),
                 )
                 dialog.exec()
             else:
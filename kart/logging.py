@@ -1,24 +1,75 @@
 from qgis.core import QgsMessageLog, Qgis
 
-DEBUG = True
+from kart.utils import setting, LOGLEVEL
+
+DEBUG = "Debug"
+INFO = "Info"
+ERROR = "Error"
+LEVELS = [DEBUG, INFO, ERROR]
+
 MAX_LINES = 20
+MAX_LENGTH = 10000
+
+# Read from the settings the first time it is needed, and then updated by
+# setLevel, so checking the level does not access settings on every call
+_level = None
+
+
+def level():
+    global _level
+    if _level is None:
+        _level = setting(LOGLEVEL)
+        if _level not in LEVELS:
+            _level = INFO
+    return _level
+
+
+def setLevel(value):
+    global _level
+    _level = value
+
+
+def isEnabled(value):
+    return LEVELS.index(value) >= LEVELS.index(level())
+
+
+def _truncate(msg):
+    # Only look for the first MAX_LINES line breaks within the first
+    # MAX_LENGTH characters, instead of splitting what can be a very large
+    # string
+    pos = -1
+    for _ in range(MAX_LINES):
+        pos = msg.find("\n", pos + 1, MAX_LENGTH)
+        if pos == -1:
+            if len(msg) <= MAX_LENGTH:
+                return msg
+            return msg[:MAX_LENGTH] + (
+                f"\n[Showing only the first {MAX_LENGTH} characters]"
+            )
+    if pos == len(msg) - 1:
+        return msg[:pos]
+    return msg[:pos] + f"\n[Showing only the first {MAX_LINES} lines]"
 
 
-def _log(msg, level=Qgis.Info):
-    lines = msg.splitlines()
-    if len(lines) > 20:
-        msg = "\n".join(lines[:20]) + f"\n[Showing only the first {MAX_LINES} lines]"
-    QgsMessageLog.logMessage(msg, "Kart", level)
+def _log(level, qgisLevel, msg, args):
+    if not isEnabled(level):
+        return
+    if args:
+        msg = msg % tuple(_truncate(a) if isinstance(a, str) else a for a in args)
+    QgsMessageLog.logMessage(_truncate(msg), "Kart", qgisLevel)
 
 
-def info(msg):
-    _log(msg, Qgis.Info)
+def info(msg, *args):
+    _log(INFO, Qgis.Info, msg, args)
 
 
-def error(msg):
-    _log(msg, Qgis.Critical)
+def error(msg, *args):
+    _log(ERROR, Qgis.Critical, msg, args)
 
 
-def debug(msg):
-    if DEBUG:
-        info(msg)
+def debug(msg, *args):
+    """
+    Logs a debug message. Arguments are only formatted into the message (with
+    the % operator) if debug logging is enabled
+    """
+    _log(DEBUG, Qgis.Info, msg, args)
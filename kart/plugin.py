@@ -9,10 +9,12 @@ from qgis.PyQt.QtWidgets import QAction
 
 from kart.gui.dockwidget import KartDockWidget
 from kart.gui.settingsdialog import SettingsDialog
+from kart.gui.performancedialog import PerformanceDialog
 from kart.kartapi import checkKartInstalled, kartVersionDetails
 from kart.layers import LayerTracker
 from kart.processing import KartProvider
-from kart.plugin_bus import get_bus, check_bus
+from kart.plugin_bus import get_bus, release_bus
+from kart import helper
 
 
 pluginPath = os.path.dirname(__file__)
@@ -42,6 +44,10 @@ class KartPlugin(object):
         self.iface.addPluginToMenu("Kart", self.settingsAction)
         self.settingsAction.triggered.connect(self.openSettings)
 
+        self.performanceAction = QAction("Kart performance...", self.iface.mainWindow())
+        self.iface.addPluginToMenu("Kart", self.performanceAction)
+        self.performanceAction.triggered.connect(self.openPerformance)
+
         self.aboutAction = QAction("About...", self.iface.mainWindow())
         self.iface.addPluginToMenu("Kart", self.aboutAction)
         self.aboutAction.triggered.connect(self.openAbout)
@@ -52,7 +58,8 @@ class KartPlugin(object):
         QgsProject.instance().crsChanged.connect(self.tracker.updateRubberBands)
 
         self.initProcessing()
-        self.bus = get_bus()
+        self.bus = get_bus(user="kart")
+        helper.start()
 
     def showDock(self):
         if checkKartInstalled():
@@ -62,6 +69,10 @@ class KartPlugin(object):
         dlg = SettingsDialog()
         dlg.exec()
 
+    def openPerformance(self):
+        dlg = PerformanceDialog()
+        dlg.exec()
+
     def pluginVersion(add_commit=False):
         config = configparser.ConfigParser()
         path = os.path.join(os.path.dirname(__file__), "metadata.txt")
@@ -74,6 +85,19 @@ class KartPlugin(object):
         pluginVersion = self.pluginVersion()
         kartVersion = kartVersionDetails().replace("\n", "<br>")
         qgisVersion = Qgis.QGIS_VERSION
+        helperStats = helper.stats()
+
+        def _ms(seconds):
+            return "-" if seconds is None else f"{seconds * 1000:.0f} ms"
+
+        helperInfo = (
+            f"Mode: {helperStats['mode']}<br>"
+            f"Cold start latency: {_ms(helperStats['coldLatency'])}<br>"
+            f"Warm latency: {_ms(helperStats['warmAverage'])} average, "
+            f"{_ms(helperStats['warmMax'])} maximum<br>"
+            f"Health checks: {helperStats['checks']}, "
+            f"{helperStats['failures']} failed"
+        )
         html = (
             "<html><style>body {padding:0px; margin:0px; font-family:verdana; font-size: 1.1em;}"
             "</style><body>"
@@ -81,6 +105,7 @@ class KartPlugin(object):
             f"<h4>QGIS version</h4> <p>{qgisVersion}</p>"
             f"<h4>Operating system</h4><p>{osInfo}</p>"
             f"<h4>Kart version</h4> <p>{kartVersion}</p>"
+            f"<h4>Kart helper</h4> <p>{helperInfo}</p>"
             "</body>"
             "</html>"
         )
@@ -94,6 +119,7 @@ class KartPlugin(object):
         self.dock = None
         self.iface.removePluginMenu("Kart", self.explorerAction)
         self.iface.removePluginMenu("Kart", self.settingsAction)
+        self.iface.removePluginMenu("Kart", self.performanceAction)
         self.iface.removePluginMenu("Kart", self.aboutAction)
 
         QgsProject.instance().layerRemoved.disconnect(self.tracker.layerRemoved)
@@ -102,4 +128,5 @@ class KartPlugin(object):
         QgsApplication.processingRegistry().removeProvider(self.provider)
 
         self.bus = None
-        check_bus()
+        release_bus("kart")
+        helper.stop()
@@ -1,12 +1,42 @@
-from qgis.PyQt.QtCore import QObject, pyqtSignal, QVariant
+from qgis.PyQt.QtCore import (
+    QCoreApplication,
+    QEventLoop,
+    QObject,
+    Qt,
+    QThread,
+    QVariant,
+    pyqtSignal,
+    pyqtSlot,
+)
 from qgis.core import QgsApplication
-import uuid, sys
+import queue
+import threading
+import time
+import uuid
+
+from kart import logging
 
 BUS_PROPERTY_KEY = "_qgis_plugin_request/response_bus_v1"
 
+# Time to wait for the responses to an asynchronous request, in seconds
+DEFAULT_DEADLINE = 2.0
+# Responses arriving later than this after the request are not recorded
+LATE_RESPONSE_WINDOW = 60.0
+# Maximum time to wait for the responses when waiting in the GUI thread
+GUI_THREAD_DEADLINE = 0.25
+
+
 class RequestResponseBus(QObject):
     """
-    Synchronous inter-plugin request/response bus **without timeout**
+    Inter-plugin request/response bus.
+
+    Plugins can either register a handler with subscribe(), which is called
+    directly with the payload of each request and returns its response (or
+    None), or connect to the request signal and emit their response through
+    the response signal, with the request id they received.
+
+    Plugins using the bus register themselves with attach(), so the shared
+    bus can be dropped once no plugin uses it.
     """
 
     request = pyqtSignal(str, object)   # request_id, payload
@@ -18,47 +48,347 @@ class RequestResponseBus(QObject):
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            print(f"plugin_bus: new cls._instance")
         return cls._instance
-    
+
     def __init__(self):
+        if self.__id is not None:
+            return
         super().__init__()
-        if self.__id is None:
-            self.__id = str(uuid.uuid4())
-            print(f"plugin_bus: id: {self.__id} - initialized")
+        self.__id = str(uuid.uuid4())
+        self._subscribers = {}
+        self._users = set()
+        # Response handler for each request still waiting for responses
+        # through the response signal
+        self._pending = {}
+        # Direct, so responses emitted from any thread are handled right
+        # away, and not once the request is no longer pending
+        self.response.connect(self._on_response, Qt.DirectConnection)
+        logging.debug("plugin_bus: id: %s - initialized", self.__id)
 
     def get_id(self):
         return self.__id
 
+    def subscribe(self, name, handler):
+        """
+        Registers a handler that is called with the payload of each request,
+        and returns the response to it, or None
+
+        :param name: str, used to identify the subscriber in latency stats
+        :param handler: callable
+        """
+        subscribers = dict(self._subscribers)
+        subscribers[name] = handler
+        # Replaced instead of modified, so requests being dispatched from
+        # other threads can iterate it safely
+        self._subscribers = subscribers
+
+    def unsubscribe(self, name):
+        subscribers = dict(self._subscribers)
+        subscribers.pop(name, None)
+        self._subscribers = subscribers
+
+    def subscriptions(self):
+        """
+        Returns a list of (name, handler) tuples with the registered handlers
+        """
+        return list(self._subscribers.items())
+
+    def attach(self, name):
+        self._users.add(name)
+
+    def detach(self, name):
+        self._users.discard(name)
+
+    def users(self):
+        return set(self._users)
+
+    @pyqtSlot(str, object)
+    def _on_response(self, request_id, result):
+        handler = self._pending.get(request_id)
+        if handler is not None:
+            handler(result)
+
     def call(self, payload, caller=None):
         """
         Send a request and collect responses.
 
+        Registered handlers are called first. The request signal is only
+        emitted if something is connected to it.
+
         :param payload: dict
         :param caller: any
         :return: list of responses
         """
-        request_id = str(uuid.uuid4())
         responses = []
-
-        def _on_response(rid, result):
-            if rid == request_id:
+        for name, handler in self._subscribers.items():
+            result = _run_handler(name, handler, payload)
+            if result is not None:
                 responses.append(result)
 
-        # Connect temporary listener
-        self.response.connect(_on_response)
+        if self.receivers(self.request):
+            request_id = str(uuid.uuid4())
+            start = time.perf_counter()
 
-        # Emit request (synchronous dispatch)
-        self.request.emit(request_id, payload)
+            def _on_response(result):
+                record_latency(_subscriber_name(result), time.perf_counter() - start)
+                responses.append(result)
 
-        # Cleanup (CRITICAL)
-        self.response.disconnect(_on_response)
+            self._pending[request_id] = _on_response
+            try:
+                # Synchronous dispatch
+                self.request.emit(request_id, payload)
+            finally:
+                self._pending.pop(request_id, None)
 
         return responses
 
-def get_bus() -> RequestResponseBus:
+
+_latencies = {}
+_latencies_lock = threading.Lock()
+
+
+def _subscriber_name(result):
+    if isinstance(result, dict):
+        for key in ("sender", "plugin", "name"):
+            if result.get(key):
+                return str(result[key])
+    return "unknown"
+
+
+def _run_handler(name, handler, payload, record=True):
+    start = time.perf_counter()
+    try:
+        return handler(payload)
+    except Exception as e:
+        logging.error("plugin_bus: subscriber %s failed: %s", name, e)
+    finally:
+        if record:
+            record_latency(name, time.perf_counter() - start)
+
+
+def record_latency(subscriber, seconds, late=False):
+    """
+    Records the time a subscriber took to respond to a request
+    """
+    with _latencies_lock:
+        stats = _latencies.get(subscriber)
+        if stats is None:
+            stats = _latencies[subscriber] = {
+                "count": 0,
+                "total": 0.0,
+                "max": 0.0,
+                "late": 0,
+            }
+        stats["count"] += 1
+        stats["total"] += seconds
+        if seconds > stats["max"]:
+            stats["max"] = seconds
+        if late:
+            stats["late"] += 1
+
+
+def subscriber_latencies():
+    """
+    Returns a dict with the number of responses, total and maximum response
+    time (in seconds) and number of responses received after the deadline,
+    for each subscriber that responded to a request.
+
+    Registered subscribers are identified by their name. Those responding
+    through the response signal are identified by the 'sender', 'plugin' or
+    'name' entry in their responses, if any.
+    """
+    with _latencies_lock:
+        return {name: dict(stats) for name, stats in _latencies.items()}
+
+
+def clear_latencies():
+    with _latencies_lock:
+        _latencies.clear()
+
+
+class _ResponseCollector(QObject):
+    """
+    Collects the responses to a request, recording how long each subscriber
+    took to respond
+    """
+
+    def __init__(self, request_id, deadline, expected):
+        super().__init__()
+        self.request_id = request_id
+        self.deadline = deadline
+        self.expected = expected
+        self.responses = []
+        # Responses may be added from several threads at the same time
+        self._lock = threading.Lock()
+        self.done = threading.Event()
+        if expected == 0:
+            self.done.set()
+        self.start = time.perf_counter()
+
+    def add(self, result, subscriber):
+        elapsed = time.perf_counter() - self.start
+        late = elapsed > self.deadline
+        record_latency(subscriber, elapsed, late)
+        if late:
+            return
+        with self._lock:
+            if result is not None:
+                self.responses.append(result)
+            self.expected -= 1
+            if self.expected <= 0:
+                self.done.set()
+
+    def results(self):
+        with self._lock:
+            return list(self.responses)
+
+    def add_response(self, result):
+        self.add(result, _subscriber_name(result))
+
+    @pyqtSlot(str, object)
+    def collect(self, request_id, result):
+        if request_id == self.request_id:
+            self.add_response(result)
+
+
+def _wait(done, deadline):
+    app = QCoreApplication.instance()
+    if app is not None and QThread.currentThread() == app.thread():
+        # Requests are delivered to receivers living in the GUI thread
+        # through its event loop, so it has to keep running while waiting for
+        # their responses. User input is not processed, so no other action
+        # can be started in the middle of the one sending the request, and
+        # the wait is kept short
+        end = time.perf_counter() + min(deadline, GUI_THREAD_DEADLINE)
+        while not done.is_set() and time.perf_counter() < end:
+            QCoreApplication.processEvents(QEventLoop.ExcludeUserInputEvents, 50)
+            done.wait(0.005)
+    else:
+        done.wait(deadline)
+
+
+_dispatch_queue = queue.Queue()
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+# (expiry time, cleanup function) for requests still collecting responses
+_expiring = []
+_expiring_lock = threading.Lock()
+
+
+def _dispatch_loop():
+    while True:
+        task = _dispatch_queue.get()
+        try:
+            task()
+        except Exception as e:
+            logging.error("plugin_bus: dispatch failed: %s", e)
+
+
+def _dispatch(task):
+    """
+    Runs a task in the background thread used to dispatch requests, which is
+    started the first time it is needed
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = threading.Thread(
+                target=_dispatch_loop, name="plugin_bus", daemon=True
+            )
+            _dispatcher.start()
+    _dispatch_queue.put(task)
+
+
+def _expire(cleanup):
+    """
+    Runs the cleanup of the requests that are no longer collecting
+    responses, and adds the given one to be run once its time is over
+    """
+    now = time.perf_counter()
+    with _expiring_lock:
+        expired = []
+        while _expiring and _expiring[0][0] <= now:
+            expired.append(_expiring.pop(0)[1])
+        if cleanup is not None:
+            _expiring.append((now + LATE_RESPONSE_WINDOW, cleanup))
+    for func in expired:
+        func()
+
+
+def call_async(bus, payload, deadline=DEFAULT_DEADLINE, wait=True):
+    """
+    Sends a request through the bus without blocking on its subscribers.
+
+    Registered handlers are called, and the request signal emitted, from a
+    background thread. If wait is True, the responses received within the
+    deadline (in seconds) are returned. Otherwise, the request is
+    fire-and-forget and None is returned. In both cases, responses to the
+    request signal keep being collected for LATE_RESPONSE_WINDOW seconds, so
+    the latency of slow subscribers is recorded.
+
+    :param bus: the shared bus, as returned by get_bus
+    :param payload: dict
+    :return: list of responses, or None
+    """
+    subscriptions = bus.subscriptions() if hasattr(bus, "subscriptions") else []
+    receivers = bus.receivers(bus.request)
+    collector = _ResponseCollector(None, deadline, len(subscriptions) + receivers)
+    cleanup = None
+    if receivers:
+        request_id = collector.request_id = str(uuid.uuid4())
+        if hasattr(bus, "_pending"):
+            bus._pending[request_id] = collector.add_response
+
+            def _remove_pending():
+                bus._pending.pop(request_id, None)
+
+            cleanup = _remove_pending
+
+        else:
+            # Buses created by older versions of this module have no
+            # response routing, so a listener is connected for the request
+            bus.response.connect(collector.collect, Qt.DirectConnection)
+
+            def _disconnect():
+                try:
+                    bus.response.disconnect(collector.collect)
+                except (TypeError, RuntimeError):
+                    pass
+
+            cleanup = _disconnect
+
+    _expire(cleanup)
+
+    def _send():
+        for name, handler in subscriptions:
+            collector.add(_run_handler(name, handler, payload, False), name)
+        if receivers:
+            bus.request.emit(collector.request_id, payload)
+
+    _dispatch(_send)
+
+    if not wait:
+        return None
+    _wait(collector.done, deadline)
+    return collector.results()
+
+
+def has_listeners(bus) -> bool:
+    """
+    Returns True if any plugin would receive a request sent through the bus
+    """
+    if hasattr(bus, "subscriptions") and bus.subscriptions():
+        return True
+    return bus.receivers(bus.request) > 0
+
+
+def get_bus(user=None) -> RequestResponseBus:
     """
     Returns a singleton request/response bus shared across all plugins.
+
+    :param user: name of the plugin using the bus, if it should be
+        registered as a user of it
     """
     app = QgsApplication.instance()
     bus = app.property(BUS_PROPERTY_KEY)
@@ -67,41 +397,45 @@ def get_bus() -> RequestResponseBus:
         bus = RequestResponseBus()
         app.setProperty(BUS_PROPERTY_KEY, bus)
 
+    if user is not None and hasattr(bus, "attach"):
+        bus.attach(user)
+
     return bus
 
-def check_bus() -> int:
+
+def release_bus(user):
     """
-    Returns the number of active object references using the shared bus (which may be higher than expected
-    See: https://medium.com/@2019077_13406/garbage-collection-in-python-40dacb194cba)
-    If the number of references indicates that there are no objects using the bus, then "garbage collection"
-    is performed to drop the singleton QgsApplication bus instance (Property object) altogether.
+    Unregisters a plugin as a user of the shared bus, and drops the bus if no
+    other plugin uses it
     """
-    refcount = 0
-
-    # The way refcount works, any value >= 4 indicates that the singleton bus is in active use... somewhere
-    # Similarly, a refcount < 4 indicates that the singleton bus exists, but is not being used by any objects. Therefore
-    # it can be dereferenced and dropped altogether.
-    #
-    # QgsApplication property = 1       i.e. the singleton object with no plugin references yet created has a refcount of 1
-    # First active plugin -->  +1 = 2   i.e. *at least* one new reference will be created for each plugin using the bus
-    # testbus variable -->     +1 = 3   i.e. accessing the singleton bus for checking within this function adds another count
-    # sys.getrefcount -->      +1 = 4   i.e. the refcount call itself adds another count
-
+    bus = QgsApplication.instance().property(BUS_PROPERTY_KEY)
+    if bus is not None and hasattr(bus, "detach"):
+        bus.detach(user)
+    return check_bus()
 
-    testbus = QgsApplication.instance().property(BUS_PROPERTY_KEY)
-    if testbus is not None:
-        id = testbus.get_id()
-        refcount = sys.getrefcount(testbus)
 
-        if refcount < 4:
-            # Drop the global singleton object altogether
-            print(f"check_bus: id: {id} instance dropped. No active plugins (refcount {refcount})")
-            QgsApplication.instance().setProperty(BUS_PROPERTY_KEY, QVariant())
+def check_bus() -> int:
+    """
+    Returns the number of plugins using the shared bus: registered users and
+    subscribers, and receivers connected to its request signal.
 
-        else:
-            print(f"check_bus: id: {id} instance active. {refcount - 3} object references (refcount {refcount})")
+    If there are none, the singleton QgsApplication bus instance (Property
+    object) is dropped altogether. Buses created by older versions of this
+    module, which do not keep track of their users, are left untouched.
+    """
+    bus = QgsApplication.instance().property(BUS_PROPERTY_KEY)
+    if bus is None:
+        logging.debug("check_bus: No global message bus instance found")
+        return 0
+    if not hasattr(bus, "users"):
+        return 1
 
+    names = bus.users() | {name for name, _ in bus.subscriptions()}
+    count = len(names) + bus.receivers(bus.request)
+    if count == 0:
+        logging.debug("check_bus: id: %s instance dropped. No active plugins", bus.get_id())
+        QgsApplication.instance().setProperty(BUS_PROPERTY_KEY, QVariant())
+        type(bus)._instance = None
     else:
-        print(f"check_bus: No global message bus instance found")
-
-    return refcount
+        logging.debug("check_bus: id: %s instance active. %s users", bus.get_id(), count)
+    return count
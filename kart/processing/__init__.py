@@ -3,7 +3,8 @@ from qgis.core import QgsProcessingProvider
 from kart.gui import icons
 
 from .branches import RepoCreateBranch, RepoDeleteBranch, RepoSwitchBranch
-from .data import RepoImportData
+from .data import RepoImportData, RepoBulkImportData
+from .diff import RepoExportDiff
 from .remotes import RepoPullFromRemote, RepoPushToRemote
 from .repos import RepoClone, RepoInit
 from .tags import RepoCreateTag
@@ -19,6 +20,8 @@ class KartProvider(QgsProcessingProvider):
         self.addAlgorithm(RepoCreateBranch())
         self.addAlgorithm(RepoDeleteBranch())
         self.addAlgorithm(RepoImportData())
+        self.addAlgorithm(RepoBulkImportData())
+        self.addAlgorithm(RepoExportDiff())
         self.addAlgorithm(RepoPullFromRemote())
         self.addAlgorithm(RepoPushToRemote())
 
@@ -1,5 +1,9 @@
 from qgis.core import (
+    QgsProcessing,
+    QgsProcessingException,
+    QgsProcessingParameterBoolean,
     QgsProcessingParameterFile,
+    QgsProcessingParameterMultipleLayers,
     QgsProcessingParameterString,
     QgsProcessingOutputFolder,
 )
@@ -57,6 +61,7 @@ class RepoImportData(KartAlgorithm):
 
     def processAlgorithm(self, parameters, context, feedback):
         from kart.kartapi import Repository
+        from kart.core.layerimport import importFile
 
         repo_path = self.parameterAsFile(parameters, self.REPO_PATH, context)
         data_path = self.parameterAsFile(parameters, self.REPO_DATA_PATH, context)
@@ -65,9 +70,121 @@ class RepoImportData(KartAlgorithm):
         )
 
         repo = Repository(repo_path)
-        repo.importIntoRepo(data_path, dataset_name)
+        importFile(repo, data_path, dataset_name or None, feedback)
 
         return {
             self.REPO_PATH: repo_path,
             self.REPO_DATASET_NAME: dataset_name,
         }
+
+
+class RepoBulkImportData(KartAlgorithm):
+    REPO_PATH = "REPO_PATH"
+    REPO_LAYERS = "REPO_LAYERS"
+    REPO_DB_URL = "REPO_DB_URL"
+    REPO_DB_TABLES = "REPO_DB_TABLES"
+    REPO_COMMIT_MESSAGE = "REPO_COMMIT_MESSAGE"
+    REPO_PARALLEL = "REPO_PARALLEL"
+
+    def displayName(self):
+        return self.tr("Bulk Import Data")
+
+    def shortHelpString(self):
+        return self.tr(
+            "Imports several layers, or several tables from a database, into a "
+            "repository in a single Kart import, creating a single commit.\n"
+            "Use either a list of layers or a database connection URL (e.g. "
+            "postgresql://user@host/dbname/schema). If no tables are given for "
+            "the database connection, all of its tables are imported"
+        )
+
+    def icon(self):
+        return icons.importIcon
+
+    def initAlgorithm(self, config=None):
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.REPO_PATH,
+                self.tr("Repo Path"),
+                behavior=QgsProcessingParameterFile.Folder,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                self.REPO_LAYERS,
+                self.tr("Layers"),
+                QgsProcessing.TypeVector,
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.REPO_DB_URL,
+                self.tr("Database connection URL"),
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.REPO_DB_TABLES,
+                self.tr("Database tables [comma separated]"),
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.REPO_COMMIT_MESSAGE,
+                self.tr("Commit message"),
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.REPO_PARALLEL,
+                self.tr("Convert layers in parallel"),
+                defaultValue=False,
+            )
+        )
+
+        self.addOutput(
+            QgsProcessingOutputFolder(
+                self.REPO_PATH,
+                self.tr("Repo Path"),
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        from kart.kartapi import Repository
+        from kart.core.layerimport import importLayers
+
+        repo_path = self.parameterAsFile(parameters, self.REPO_PATH, context)
+        layers = self.parameterAsLayerList(parameters, self.REPO_LAYERS, context)
+        db_url = self.parameterAsString(parameters, self.REPO_DB_URL, context)
+        db_tables = self.parameterAsString(parameters, self.REPO_DB_TABLES, context)
+        message = self.parameterAsString(parameters, self.REPO_COMMIT_MESSAGE, context)
+        parallel = self.parameterAsBool(parameters, self.REPO_PARALLEL, context)
+
+        if bool(layers) == bool(db_url):
+            raise QgsProcessingException(
+                self.tr("Provide either a list of layers or a database connection")
+            )
+
+        repo = Repository(repo_path)
+        if db_url:
+            tables = [t.strip() for t in db_tables.split(",") if t.strip()]
+            repo.importIntoRepo(
+                db_url, tables=tables, allTables=not tables, message=message or None
+            )
+        else:
+            sources = [layer.source() for layer in layers]
+            importLayers(repo, sources, message or None, parallel, feedback)
+
+        return {
+            self.REPO_PATH: repo_path,
+        }
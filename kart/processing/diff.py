@@ -0,0 +1,107 @@
+from qgis.core import (
+    QgsProcessingException,
+    QgsProcessingParameterFile,
+    QgsProcessingParameterString,
+    QgsProcessingParameterFileDestination,
+)
+from kart.gui import icons
+
+from .base import KartAlgorithm
+
+
+class RepoExportDiff(KartAlgorithm):
+    REPO_PATH = "REPO_PATH"
+    REPO_REF = "REPO_REF"
+    REPO_BASE_REF = "REPO_BASE_REF"
+    REPO_DATASET_NAME = "REPO_DATASET_NAME"
+    OUTPUT = "OUTPUT"
+
+    def displayName(self):
+        return self.tr("Export Changes")
+
+    def shortHelpString(self):
+        return self.tr(
+            "Exports the changes introduced by a commit (or between two commits) "
+            "to a GeoPackage or FlatGeobuf file. If no commit is given, working "
+            "copy changes are exported"
+        )
+
+    def icon(self):
+        return icons.exportIcon
+
+    def initAlgorithm(self, config=None):
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.REPO_PATH,
+                self.tr("Repo Path"),
+                behavior=QgsProcessingParameterFile.Folder,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.REPO_REF,
+                self.tr("Commit"),
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.REPO_BASE_REF,
+                self.tr("Base commit [defaults to the parent of the commit]"),
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.REPO_DATASET_NAME,
+                self.tr("Dataset Name"),
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.OUTPUT,
+                self.tr("Output file"),
+                self.tr("GeoPackage (*.gpkg);;FlatGeobuf (*.fgb)"),
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        from kart.kartapi import Repository
+        from kart.core.diffexport import exportDiff
+
+        repo_path = self.parameterAsFile(parameters, self.REPO_PATH, context)
+        ref = self.parameterAsString(parameters, self.REPO_REF, context)
+        base_ref = self.parameterAsString(parameters, self.REPO_BASE_REF, context)
+        dataset_name = self.parameterAsString(
+            parameters, self.REPO_DATASET_NAME, context
+        )
+        filename = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+
+        if ref and not base_ref:
+            base_ref = f"{ref}~1"
+        elif base_ref and not ref:
+            # working copy changes since the base commit
+            ref, base_ref = base_ref, None
+
+        repo = Repository(repo_path)
+        sources = exportDiff(
+            repo,
+            filename,
+            ref or None,
+            base_ref or None,
+            dataset_name or None,
+            feedback,
+        )
+        # No file is created if there are no changes to write
+        if not sources:
+            raise QgsProcessingException(self.tr("There are no changes to export"))
+
+        return {
+            self.OUTPUT: filename,
+        }
@@ -14,8 +14,9 @@
   <renderer-v2 attr="changetype" symbollevels="0" type="categorizedSymbol">
     <categories>
       <category render="true" symbol="0" value="U" label="Unchanged"/>
-      <category render="true" symbol="1" value="A" label="Added"/>
-      <category render="true" symbol="2" value="R" label="Removed"/>
+      <category render="true" symbol="2" value="A" label="Added"/>
+      <category render="true" symbol="1" value="R" label="Removed"/>
+      <category render="true" symbol="3" value="M" label="Moved"/>
     </categories>
     <symbols>
       <symbol alpha="1" type="marker" name="0">
@@ -81,6 +82,27 @@
           <prop k="vertical_anchor_point" v="1"/>
         </layer>
       </symbol>
+      <symbol alpha="1" type="marker" name="3">
+        <layer pass="0" class="SimpleMarker" locked="0">
+          <prop k="angle" v="0"/>
+          <prop k="color" v="235,160,40,255"/>
+          <prop k="horizontal_anchor_point" v="1"/>
+          <prop k="name" v="circle"/>
+          <prop k="offset" v="0,0"/>
+          <prop k="offset_map_unit_scale" v="0,0"/>
+          <prop k="offset_unit" v="MM"/>
+          <prop k="outline_color" v="0,0,0,255"/>
+          <prop k="outline_style" v="solid"/>
+          <prop k="outline_width" v="0"/>
+          <prop k="outline_width_map_unit_scale" v="0,0"/>
+          <prop k="outline_width_unit" v="MM"/>
+          <prop k="scale_method" v="area"/>
+          <prop k="size" v="2"/>
+          <prop k="size_map_unit_scale" v="0,0"/>
+          <prop k="size_unit" v="MM"/>
+          <prop k="vertical_anchor_point" v="1"/>
+        </layer>
+      </symbol>
     </symbols>
     <source-symbol>
       <symbol alpha="1" type="marker" name="0">
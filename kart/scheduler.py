@@ -0,0 +1,221 @@
+"""
+Coordinates the Kart commands run by the plugin from different threads.
+
+Commands that modify a repository are run one at a time for each repository,
+and never at the same time as any other command on that repository.
+Read-only commands can run in parallel, up to a configurable number of them
+across all repositories.
+
+Commands started by a thread that already holds slots (for instance, while
+reading the streamed output of another command) do not wait for those slots,
+since they would never be released, nor for the limit of read-only commands.
+They still wait for the slots held by other threads.
+
+The main thread, which runs the commands of the user interface, is not
+subject to the limit of read-only commands, so background tasks cannot take
+all the slots. It only waits for the slots of a repo for MAIN_THREAD_WAIT
+seconds, so QGIS does not freeze while a background task modifies it.
+"""
+
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+from kart.utils import setting, MAXCONCURRENTREADS
+
+DEFAULT_MAX_READS = 4
+
+# Seconds the main thread waits for a busy repo before giving up
+MAIN_THREAD_WAIT = 5
+
+# Commands that change the working copy or the repository history
+MUTATING_COMMANDS = {
+    "apply",
+    "checkout",
+    "commit",
+    "data",
+    "import",
+    "merge",
+    "pull",
+    "reset",
+    "resolve",
+    "restore",
+    "switch",
+}
+
+_condition = threading.Condition()
+_local = threading.local()
+
+# Number of read-only commands running, in total and for each repo
+_reads = 0
+_repoReads = {}
+# Number of mutating commands running for each repo, and number of them
+# waiting to run
+_writing = {}
+_pendingWrites = {}
+
+_waiting = 0
+_stats = {"commands": 0, "queued": 0, "totalWait": 0.0, "maxWait": 0.0}
+
+# Read from the settings the first time it is needed, and then updated by
+# setMaxReads
+_maxReads = None
+
+
+def maxReads():
+    global _maxReads
+    if _maxReads is None:
+        try:
+            _maxReads = max(1, int(setting(MAXCONCURRENTREADS)))
+        except (TypeError, ValueError):
+            _maxReads = DEFAULT_MAX_READS
+    return _maxReads
+
+
+def setMaxReads(value):
+    global _maxReads
+    with _condition:
+        _maxReads = max(1, int(value))
+        _condition.notify_all()
+
+
+def isMutating(name):
+    return name in MUTATING_COMMANDS
+
+
+def _repoKey(path):
+    return os.path.normcase(os.path.abspath(path)) if path else None
+
+
+def _heldSlots():
+    """
+    Returns the slots held by the current thread, as a dict with a list with
+    the number of read-only and mutating commands running for each repo
+    """
+    held = getattr(_local, "held", None)
+    if held is None:
+        held = _local.held = {}
+    return held
+
+
+def _canRun(mutating, key, held, isMain):
+    ownReads, ownWrites = held.get(key, (0, 0))
+    if key in _writing and not ownWrites:
+        return False
+    if mutating:
+        return _repoReads.get(key, 0) <= ownReads
+    # Pending mutating commands go first, so they are not delayed for as
+    # long as reads keep coming, unless they wait for this thread
+    return (held or isMain or _reads < maxReads()) and not (
+        _pendingWrites.get(key) and not (ownReads or ownWrites)
+    )
+
+
+def _wait(mutating, key, held):
+    isMain = threading.current_thread() is threading.main_thread()
+    timeout = MAIN_THREAD_WAIT if isMain else None
+    if not _condition.wait_for(lambda: _canRun(mutating, key, held, isMain), timeout):
+        # Imported here, since kartapi uses this module to run commands
+        from kart.kartapi import KartException
+
+        raise KartException(
+            "The repository is busy with another operation running in the "
+            "background. Try again once it is finished"
+        )
+
+
+def _acquire(mutating, key, held):
+    global _reads
+    if mutating:
+        _pendingWrites[key] = _pendingWrites.get(key, 0) + 1
+        try:
+            _wait(True, key, held)
+        finally:
+            _pendingWrites[key] -= 1
+            if not _pendingWrites[key]:
+                del _pendingWrites[key]
+        _writing[key] = _writing.get(key, 0) + 1
+    else:
+        _wait(False, key, held)
+        _reads += 1
+        _repoReads[key] = _repoReads.get(key, 0) + 1
+    held.setdefault(key, [0, 0])[1 if mutating else 0] += 1
+
+
+def _release(mutating, key, held):
+    global _reads
+    if mutating:
+        _writing[key] -= 1
+        if not _writing[key]:
+            del _writing[key]
+    else:
+        _reads -= 1
+        _repoReads[key] -= 1
+        if not _repoReads[key]:
+            del _repoReads[key]
+    slots = held[key]
+    slots[1 if mutating else 0] -= 1
+    if not any(slots):
+        del held[key]
+    _condition.notify_all()
+
+
+@contextmanager
+def command(name, path=None):
+    """
+    Waits until the Kart command with the given name can run on the repo at
+    the given path, and holds its slot within the context.
+
+    Yields the time spent waiting, in seconds. Raises a KartException if
+    the main thread cannot run it within MAIN_THREAD_WAIT seconds
+    """
+    global _waiting
+    mutating = isMutating(name) and path is not None
+    key = _repoKey(path)
+    # The slot is released from the slots of this thread even if the
+    # context is closed from another one (a generator finalized there)
+    held = _heldSlots()
+    start = time.perf_counter()
+    with _condition:
+        _waiting += 1
+        try:
+            _acquire(mutating, key, held)
+        finally:
+            _waiting -= 1
+        wait = time.perf_counter() - start
+        _stats["commands"] += 1
+        if wait > 0.001:
+            _stats["queued"] += 1
+        _stats["totalWait"] += wait
+        _stats["maxWait"] = max(_stats["maxWait"], wait)
+    try:
+        yield wait
+    finally:
+        with _condition:
+            _release(mutating, key, held)
+
+
+def stats():
+    """
+    Returns a dict with the current load and the waiting times of the
+    commands run so far
+    """
+    with _condition:
+        ret = dict(_stats)
+        ret.update(
+            {
+                "waiting": _waiting,
+                "runningReads": _reads,
+                "runningWrites": len(_writing),
+                "maxReads": maxReads(),
+            }
+        )
+    ret["averageWait"] = ret["totalWait"] / ret["commands"] if ret["commands"] else 0
+    return ret
+
+
+def resetStats():
+    with _condition:
+        _stats.update({"commands": 0, "queued": 0, "totalWait": 0.0, "maxWait": 0.0})
@@ -0,0 +1,5 @@
+import sys
+
+from kart.tests.benchmarks.runner import main
+
+sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+Deterministic stand-in for the Kart executable, used by the benchmarks.
+
+It answers the commands used by the plugin with canned output whose size is
+set by the KART_FAKE_SIZE environment variable (number of commits, changed
+features or conflicts), so the plugin's own overhead can be measured without
+a real Kart installation or repository.
+"""
+
+import json
+import os
+import struct
+import sys
+
+VERSION = "Kart v0.15.3, Copyright (c) Kart Contributors (fake)"
+
+DATASET = os.environ.get("KART_FAKE_DATASET", "points")
+SIZE = int(os.environ.get("KART_FAKE_SIZE", "1000"))
+
+CRS = "EPSG:4326"
+CRS_WKT = (
+    'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],'
+    'PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433],AUTHORITY["EPSG","4326"]]'
+)
+
+SCHEMA = [
+    {"name": "fid", "dataType": "integer", "primaryKeyIndex": 0, "size": 64},
+    {
+        "name": "geom",
+        "dataType": "geometry",
+        "geometryType": "POINT",
+        "geometryCRS": CRS,
+    },
+    {"name": "name", "dataType": "text"},
+    {"name": "value", "dataType": "float"},
+]
+
+# Chunk size used when writing large outputs
+CHUNK_SIZE = 10000
+
+
+def _sha(i):
+    return f"{i:040x}"
+
+
+def _coords(i, version=0):
+    return [(i % 1000) * 0.01 + version * 0.001, (i // 1000) * 0.01]
+
+
+def _properties(i, version=0):
+    return {"fid": i, "name": f"feature {i}", "value": i * 0.5 + version}
+
+
+def _geojsonFeature(i, fid, version=0):
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": _coords(i, version)},
+        "properties": _properties(i, version),
+        "id": fid,
+    }
+
+
+def _hexWkb(i, version=0):
+    x, y = _coords(i, version)
+    return struct.pack("<BIdd", 1, 1, x, y).hex()
+
+
+def _values(i, version=0):
+    values = _properties(i, version)
+    values["geom"] = _hexWkb(i, version)
+    return values
+
+
+def _write(chunks):
+    out = sys.stdout
+    for chunk in chunks:
+        out.write(chunk)
+    out.flush()
+
+
+def _featureCollection(features):
+    yield '{"type": "FeatureCollection", "features": ['
+    buffer = []
+    for i, feature in enumerate(features):
+        buffer.append(("," if i else "") + json.dumps(feature))
+        if len(buffer) == CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer = []
+    yield "".join(buffer)
+    yield "]}"
+
+
+def _diffFeatures():
+    for i in range(SIZE):
+        kind = i % 3
+        prefix = f"{DATASET}:feature:{i}"
+        if kind == 0:
+            yield _geojsonFeature(i, f"{prefix}:I", 1)
+        elif kind == 1:
+            yield _geojsonFeature(i, f"{prefix}:U-")
+            yield _geojsonFeature(i, f"{prefix}:U+", 1)
+        else:
+            yield _geojsonFeature(i, f"{prefix}:D")
+
+
+def _diffLines():
+    yield json.dumps({"type": "version", "version": "kart.diff/v2"}) + "\n"
+    for i in range(SIZE):
+        kind = i % 3
+        if kind == 0:
+            change = {"+": _values(i, 1)}
+        elif kind == 1:
+            change = {"-": _values(i), "+": _values(i, 1)}
+        else:
+            change = {"-": _values(i)}
+        item = {"type": "feature", "dataset": DATASET, "change": change}
+        yield json.dumps(item) + "\n"
+
+
+def _conflictFeatures():
+    for i in range(SIZE):
+        prefix = f"{DATASET}:feature:{i}"
+        yield _geojsonFeature(i, f"{prefix}:ancestor")
+        yield _geojsonFeature(i, f"{prefix}:ours", 1)
+        yield _geojsonFeature(i, f"{prefix}:theirs", 2)
+
+
+def log(args):
+    if "-ojson" in args:
+        commits = (
+            {
+                "commit": _sha(i),
+                "abbrevCommit": _sha(i)[-7:],
+                "message": f"Commit number {i}",
+                "refs": ["HEAD -> main"] if i == 0 else [],
+                "authorName": "Benchmark",
+                "authorEmail": "benchmark@example.com",
+                "authorTime": "2023-01-01T00:00:00Z",
+                "authorTimeOffset": "+00:00",
+                "parents": [_sha(i + 1)] if i + 1 < SIZE else [],
+            }
+            for i in range(SIZE)
+        )
+        _write(_jsonList(commits))
+    else:
+        _write(f"* {_sha(i)}\n" for i in range(SIZE))
+
+
+def _jsonList(items):
+    yield "["
+    for i, item in enumerate(items):
+        yield ("," if i else "") + json.dumps(item)
+    yield "]"
+
+
+def diff(args):
+    if "--output-format=json-lines" in args:
+        _write(_diffLines())
+    elif any(a.startswith("--output-format=geojson") for a in args):
+        if "--output" in args:
+            folder = args[args.index("--output") + 1]
+            path = os.path.join(folder, f"{DATASET}.geojson")
+            with open(path, "w") as f:
+                for chunk in _featureCollection(_diffFeatures()):
+                    f.write(chunk)
+        else:
+            _write(_featureCollection(_diffFeatures()))
+    else:
+        _write([json.dumps({"kart.diff/v1+hexwkb": {}})])
+
+
+def conflicts(args):
+    if "-ojson" in args:
+        conflicts = {DATASET: {"feature": {str(i): {} for i in range(SIZE)}}}
+        _write([json.dumps({"kart.conflicts/v1": conflicts})])
+    else:
+        _write(_featureCollection(_conflictFeatures()))
+
+
+def meta(args):
+    meta = {"crs/EPSG:4326.wkt": CRS_WKT, "schema.json": SCHEMA}
+    names = [a for a in args[1:] if not a.startswith("-")]
+    if "--ref" in args:
+        names.remove(args[args.index("--ref") + 1])
+    if len(names) > 1:
+        meta = {k: v for k, v in meta.items() if k in names[1:]}
+    _write([json.dumps({DATASET: meta})])
+
+
+def status(args):
+    ret = {
+        "kart.status/v1": {
+            "commit": _sha(0),
+            "abbrevCommit": _sha(0)[-7:],
+            "branch": "main",
+            "upstream": None,
+            "workingCopy": {"path": "fake.gpkg", "changes": None},
+        }
+    }
+    _write([json.dumps(ret)])
+
+
+COMMANDS = {
+    "log": log,
+    "diff": diff,
+    "conflicts": conflicts,
+    "meta": meta,
+    "status": status,
+}
+
+
+def main(args):
+    if "--version" in args:
+        print(VERSION)
+        return 0
+    command = COMMANDS.get(args[0] if args else None)
+    if command is not None:
+        command(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,188 @@
+"""
+Benchmarks for the plugin's own overhead when handling Kart output.
+
+Kart itself is replaced by the deterministic stand-in in fakekart.py, so the
+timings only measure the work done by the plugin: spawning the process,
+parsing its output and populating the corresponding widgets.
+
+Run with:
+
+    python -m kart.tests.benchmarks [--sizes 1000,100000] [--report FILE]
+        [--baseline FILE] [--tolerance 0.2]
+
+The report is a JSON file with one entry per benchmark and size. If a
+baseline report is given, benchmarks that got slower than the tolerance
+allows are listed and the exit code is non-zero.
+"""
+
+import argparse
+import json
+import os
+import platform
+import stat
+import sys
+import tempfile
+import time
+
+from unittest import mock
+
+from qgis.core import Qgis
+from qgis.testing import start_app
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+DEFAULT_REPORT = "benchmark_report.json"
+DEFAULT_TOLERANCE = 0.2
+
+FAKE_KART = os.path.join(os.path.dirname(__file__), "fakekart.py")
+
+
+def createFakeKartFolder(folder):
+    """
+    Creates an executable 'kart' script in the given folder, that runs the
+    fake Kart with the current Python interpreter
+    """
+    path = os.path.join(folder, "kart")
+    with open(path, "w") as f:
+        f.write(f"#!{sys.executable}\n")
+        f.write("import runpy\n")
+        f.write(f"runpy.run_path({FAKE_KART!r}, run_name='__main__')\n")
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP)
+    return path
+
+
+def benchmarks(repo):
+    """
+    Returns the list of (name, function) benchmarks to run against a repo
+    """
+    from kart.gui import conflictsdialog, historyviewer
+    from kart.gui.diffviewer import DiffViewerWidget
+
+    def diffViewerFillTree():
+        diff = repo.diff("HEAD~1", "HEAD")
+        widget = DiffViewerWidget({}, repo, False)
+        widget.diff = diff
+        start = time.perf_counter()
+        widget.fillTree()
+        return time.perf_counter() - start
+
+    def historyTreePopulate():
+        tree = historyviewer.HistoryTree(repo, None, None)
+        start = time.perf_counter()
+        tree.populate()
+        return time.perf_counter() - start
+
+    def conflictsDialogPopulate():
+        conflicts = repo.conflicts()
+        with mock.patch.object(conflictsdialog, "iface") as iface:
+            iface.mainWindow.return_value = None
+            start = time.perf_counter()
+            dialog = conflictsdialog.ConflictsDialog(conflicts)
+            elapsed = time.perf_counter() - start
+            dialog.deleteLater()
+            return elapsed
+
+    return [
+        ("Repository.log", lambda: repo.log()),
+        ("Repository.diff", lambda: repo.diff("HEAD~1", "HEAD")),
+        ("Repository.conflicts", lambda: repo.conflicts()),
+        ("DiffViewerWidget.fillTree", diffViewerFillTree),
+        ("HistoryTree.populate", historyTreePopulate),
+        ("ConflictsDialog", conflictsDialogPopulate),
+    ]
+
+
+def run(sizes=None, repeat=1, names=None):
+    """
+    Runs the benchmarks at the given sizes and returns the report as a dict
+    """
+    from kart.kartapi import Repository, _kartEnvironment
+    from kart.utils import setting, setSetting, KARTPATH
+
+    start_app()
+    sizes = sizes or DEFAULT_SIZES
+    results = []
+    previousPath = setting(KARTPATH)
+    with tempfile.TemporaryDirectory() as folder:
+        binFolder = os.path.join(folder, "bin")
+        repoFolder = os.path.join(folder, "repo")
+        os.makedirs(binFolder)
+        os.makedirs(repoFolder)
+        createFakeKartFolder(binFolder)
+        setSetting(KARTPATH, binFolder)
+        repo = Repository(repoFolder)
+        env = _kartEnvironment()
+        try:
+            for size in sizes:
+                env["KART_FAKE_SIZE"] = str(size)
+                for name, func in benchmarks(repo):
+                    if names and name not in names:
+                        continue
+                    best = None
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        # GUI benchmarks return their own timing, to leave
+                        # out the Kart calls they need for their input
+                        elapsed = func()
+                        if not isinstance(elapsed, float):
+                            elapsed = time.perf_counter() - start
+                        best = elapsed if best is None else min(best, elapsed)
+                    results.append({"name": name, "size": size, "seconds": best})
+                    print(f"{name} [{size}]: {best:.3f}s")
+        finally:
+            env.pop("KART_FAKE_SIZE", None)
+            setSetting(KARTPATH, previousPath or "")
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "qgis": Qgis.version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Returns the list of (name, size, seconds, baselineSeconds) for benchmarks
+    that are slower than in the baseline report by more than the tolerance
+    """
+    previous = {(r["name"], r["size"]): r["seconds"] for r in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        before = previous.get((result["name"], result["size"]))
+        if before is not None and result["seconds"] > before * (1 + tolerance):
+            regressions.append(
+                (result["name"], result["size"], result["seconds"], before)
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Kart plugin benchmarks")
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(s) for s in DEFAULT_SIZES),
+        help="Comma separated list of sizes (commits/features) to run",
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--only", action="append", help="Benchmark names to run")
+    parser.add_argument("--report", default=DEFAULT_REPORT)
+    parser.add_argument("--baseline", help="Previous report to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    report = run(sizes, args.repeat, args.only)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for name, size, seconds, before in regressions:
+            print(f"REGRESSION {name} [{size}]: {seconds:.3f}s (was {before:.3f}s)")
+        if regressions:
+            return 1
+    return 0
@@ -11,6 +11,7 @@ from qgis.core import (
     QgsFeature,
     QgsGeometry,
     QgsPointXY,
+    QgsVectorLayer,
 )
 from qgis.testing import unittest, start_app
 
@@ -22,8 +23,16 @@ from kart.kartapi import (
     installedVersion,
     KartException,
     executeKart,
+    coalescedChanges,
+    kartInstallation,
+    resetKartInstallation,
 )
+from kart import instrumentation, scheduler, helper
+from kart.plugin_bus import get_bus, call_async, subscriber_latencies
 from kart.core import RepoManager
+from kart.core.diffexport import exportDiff
+from kart.core.multirepo import runOnRepos, statusRepo
+from kart.core.vertexdiff import vertexDiff, datasetVertexDiff
 
 from kart.utils import HELPERMODE, setSetting, KARTPATH
 from kart.tests.utils import patch_iface
@@ -82,6 +91,26 @@ class TestKartapi(unittest.TestCase):
         version = installedVersion()
         assert re.match(r'\d+\.\d+\.\d+', version)
 
+    def testKartInstallation(self):
+        resetKartInstallation()
+        installation = kartInstallation()
+        assert installation.isSupported
+        assert installation.version == installedVersion()
+        assert "GDAL" in installation.components
+        assert kartInstallation() is installation
+        assert kartInstallation(refresh=True) is not installation
+
+    def testKartCapabilities(self):
+        resetKartInstallation()
+        capabilities = kartInstallation().capabilities()
+        assert "diff" in capabilities["commands"]
+        assert "json-lines" in capabilities["diffOutputFormats"]
+        assert capabilities["featureCount"]
+        instrumentation.clear()
+        resetKartInstallation()
+        assert kartInstallation().capabilities() == capabilities
+        assert not any(r.command.endswith("--help") for r in instrumentation.records())
+
     def testStoreReposInSettings(self):
         manager = RepoManager()
         assert not manager.repos()
@@ -175,6 +204,152 @@ class TestKartapi(unittest.TestCase):
         assert len(features) == 2
         assert features[0]["geometry"] == features[1]["geometry"]
 
+    def testDiffStats(self):
+        stats = self.testRepo.diffStats("HEAD", "HEAD~1")
+        assert stats == {"testlayer": 1}
+        stats = self.testRepo.diffStats("HEAD~1", "HEAD~2", "testlayer")
+        assert stats == {"testlayer": 1}
+
+    def testDiffPreview(self):
+        changes, totals = self.testRepo.diffPreview("HEAD~1", "HEAD~2", limit=1)
+        assert totals == {"testlayer": 1}
+        features = changes["testlayer"]
+        assert len(features) == 2
+        assert features[0]["id"].endswith(":U-")
+        assert features[1]["id"].endswith(":U+")
+        diff = self.testRepo.diff("HEAD~1", "HEAD~2")
+        assert features[0]["properties"] == diff["testlayer"][0]["properties"]
+
+        changes, totals = self.testRepo.diffPreview("HEAD~1", "HEAD~2", limit=0)
+        assert changes["testlayer"] == []
+
+    def testDiffInExtent(self):
+        crs = QgsCoordinateReferenceSystem(
+            self.testRepo.workingCopyLayerCrs("testlayer")
+        )
+        diff = self.testRepo.diff("HEAD~1", "HEAD~2")
+        bboxes = [
+            QgsGeometry.fromPointXY(QgsPointXY(*f["geometry"]["coordinates"]))
+            for f in diff["testlayer"]
+            if f["geometry"]["type"] == "Point"
+        ]
+        if bboxes:
+            point = bboxes[0].asPoint()
+            rect = QgsRectangle(
+                point.x() - 1, point.y() - 1, point.x() + 1, point.y() + 1
+            )
+            extent = QgsReferencedRectangle(rect, crs)
+            filtered = self.testRepo.diff("HEAD~1", "HEAD~2", extent=extent)
+            assert len(filtered["testlayer"]) == 2
+
+        farAway = QgsReferencedRectangle(QgsRectangle(1e8, 1e8, 1e8 + 1, 1e8 + 1), crs)
+        filtered = self.testRepo.diff("HEAD~1", "HEAD~2", extent=farAway)
+        assert filtered["testlayer"] == []
+        changes = list(self.testRepo.diffFeatures("HEAD~1", "HEAD~2", extent=farAway))
+        assert changes == []
+
+    def testInstrumentation(self):
+        instrumentation.clear()
+        with instrumentation.action("testAction"):
+            self.testRepo.log()
+        records = instrumentation.records()
+        assert records
+        assert all(r.action == "testAction" for r in records)
+        assert any(r.command.startswith("log -ojson") for r in records)
+        assert all(r.exitCode == 0 and r.stdoutBytes > 0 for r in records)
+        assert sum(c for _, c in instrumentation.histogram()) == len(records)
+        assert instrumentation.actionTotals()[0][:2] == ("testAction", len(records))
+
+    def testScheduler(self):
+        assert scheduler.isMutating("commit")
+        assert not scheduler.isMutating("log")
+        scheduler.resetStats()
+        self.testRepo.log()
+        instrumentation.clear()
+        list(self.testRepo.diffFeatures("HEAD~1", "HEAD~2"))
+        stats = scheduler.stats()
+        assert stats["commands"] >= 2
+        assert stats["runningReads"] == 0
+        assert stats["runningWrites"] == 0
+        assert instrumentation.records()[-1].waitTime >= 0
+
+    def testHelperCheck(self):
+        assert helper.check()
+        assert helper.check()
+        stats = helper.stats()
+        assert stats["mode"] == "helper"
+        assert stats["coldLatency"] is not None
+        assert stats["warmChecks"] >= 1
+
+    def testAsyncBus(self):
+        bus = get_bus()
+
+        def subscriber(request_id, payload):
+            bus.response.emit(request_id, {"sender": "testsubscriber"})
+
+        bus.request.connect(subscriber)
+        try:
+            responses = call_async(bus, {"action": "before"}, deadline=5)
+        finally:
+            bus.request.disconnect(subscriber)
+        assert responses == [{"sender": "testsubscriber"}]
+        assert subscriber_latencies()["testsubscriber"]["count"] >= 1
+        assert call_async(bus, {"action": "after"}, wait=False) is None
+
+    def testBusSubscriptions(self):
+        bus = get_bus()
+        bus.subscribe("testsubscriber", lambda payload: {"action": payload["action"]})
+        try:
+            assert {"action": "before"} in bus.call({"action": "before"})
+        finally:
+            bus.unsubscribe("testsubscriber")
+        assert "testsubscriber" not in dict(bus.subscriptions())
+
+    def testDiffFeatures(self):
+        changes = list(self.testRepo.diffFeatures("HEAD", "HEAD~1"))
+        assert len(changes) == 1
+        dataset, changetype, values = changes[0]
+        assert dataset == "testlayer"
+        assert changetype == "D"
+
+        changes = list(self.testRepo.diffFeatures("HEAD~1", "HEAD~2"))
+        assert [c[1] for c in changes] == ["U-", "U+"]
+
+    def testExportDiff(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "diff.gpkg")
+            sources = exportDiff(self.testRepo, filename, "HEAD~1", "HEAD~2")
+            assert list(sources.keys()) == ["testlayer"]
+            layer = QgsVectorLayer(sources["testlayer"], "diff", "ogr")
+            assert layer.isValid()
+            assert layer.featureCount() == 2
+            changes = sorted(f["kart_change"] for f in layer.getFeatures())
+            assert changes == ["update_new", "update_old"]
+
+    def testVertexDiff(self):
+        old = {"type": "LineString", "coordinates": [[0, 0], [1, 0], [2, 0], [3, 0]]}
+        new = {"type": "LineString", "coordinates": [[0, 0], [1, 1], [3, 0], [4, 0]]}
+        changes = sorted(vertexDiff(old, new), key=lambda c: (c[2], c[0]))
+        assert changes == [
+            (4, 0, "A"),
+            (1, 1, "M"),
+            (2, 0, "R"),
+            (0, 0, "U"),
+            (3, 0, "U"),
+        ]
+        cache = {}
+        changes = datasetVertexDiff([("a", None, new), ("b", old, None)], cache)
+        assert len(changes) == 8
+        assert cache["a"] == [(x, y, "A") for x, y in new["coordinates"]]
+
+    def testRunOnRepos(self):
+        missingRepo = Repository(os.path.join(self.tempFolder.name, "missing"))
+        results = runOnRepos([self.testRepo, missingRepo], statusRepo)
+        assert [r.repo for r in results] == [self.testRepo, missingRepo]
+        assert results[0].error is None
+        assert results[0].status["branch"] == self.testRepo.currentBranch()
+        assert results[1].error is not None
+
     def testCreateAndDeleteBranch(self):
         self.testRepo.createBranch("mynewbranch")
         branches = self.testRepo.branches()
@@ -194,6 +369,26 @@ class TestKartapi(unittest.TestCase):
         current = self.testRepo.currentBranch()
         assert current == "anotherbranch"
 
+    def testRepoMetadataCache(self):
+        folder, repo = createRepoCopy()
+        datasets = repo.datasets()
+        instrumentation.clear()
+        assert repo.datasets() == datasets
+        assert repo.currentBranch() == "main"
+        assert repo.workingCopyLayerCrs("testlayer") == "EPSG:4326"
+        assert repo.workingCopyLayerIdField("testlayer") == "fid"
+        assert not instrumentation.records()
+        repo.deleteDataset("testlayer")
+        assert "testlayer" not in repo.datasets()[0]
+        folder.cleanup()
+
+    def testSummary(self):
+        summary = self.testRepo.summary()
+        assert summary["branch"] == self.testRepo.currentBranch()
+        assert not summary["merging"]
+        assert summary["changes"] == self.testRepo.changes()
+        assert summary["datasets"] == self.testRepo.datasets()
+
     def testModifyLayerAndRestore(self):
         folder, repo = createRepoCopy()
         layer = repo.workingCopyLayer("testlayer")
@@ -207,6 +402,31 @@ class TestKartapi(unittest.TestCase):
         assert not bool(diff.get("testlayer", []))
         folder.cleanup()
 
+    def testChangeSummary(self):
+        folder, repo = createRepoCopy()
+        layer = repo.workingCopyLayer("testlayer")
+        feature = list(layer.getFeatures())[0]
+        with edit(layer):
+            layer.deleteFeatures([feature.id()])
+        payloads = []
+        bus = get_bus()
+        bus.subscribe("testsubscriber", payloads.append)
+        try:
+            with coalescedChanges():
+                repo.restore("HEAD", "testlayer")
+                repo.reset("HEAD~1")
+        finally:
+            bus.unsubscribe("testsubscriber")
+        after = [p for p in payloads if p["action"] == "after"]
+        assert len(after) == 1
+        changes = after[0]["changes"]
+        assert changes["methods"] == ["restore", "reset"]
+        summary = changes["repos"][0]
+        assert summary["newHead"] == repo.headCommit()
+        assert summary["oldHead"] != summary["newHead"]
+        assert summary["featureCounts"]["testlayer"] >= 1
+        folder.cleanup()
+
     def testCommit(self):
         folder, repo = createRepoCopy()
         layer = repo.workingCopyLayer("testlayer")
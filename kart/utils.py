@@ -2,7 +2,7 @@ import os
 
 from qgis.PyQt.QtCore import Qt, QCoreApplication, QSettings
 from qgis.PyQt.QtWidgets import QProgressBar, QLabel, QMessageBox, QApplication
-from qgis.core import QgsProject, Qgis
+from qgis.core import QgsProject, QgsReferencedRectangle, Qgis
 from qgis.utils import iface as qgisiface
 
 from contextlib import contextmanager
@@ -71,6 +71,13 @@ def confirm(msg):
     return ret == QMessageBox.Yes
 
 
+def currentMapExtent():
+    canvas = iface.mapCanvas()
+    return QgsReferencedRectangle(
+        canvas.extent(), canvas.mapSettings().destinationCrs()
+    )
+
+
 def layerFromSource(path):
     path = os.path.abspath(path)
     for layer in QgsProject.instance().mapLayers().values():
@@ -84,8 +91,11 @@ HELPERMODE = "HelperMode"
 AUTOCOMMIT = "AutoCommit"
 DIFFSTYLES = "DiffStyles"
 LASTREPO = "LastRepo"
+LOGLEVEL = "LogLevel"
+MAXCONCURRENTREADS = "MaxConcurrentReads"
+ASYNCBUS = "AsyncBus"
 
-setting_types = {HELPERMODE: bool, AUTOCOMMIT: bool}
+setting_types = {HELPERMODE: bool, AUTOCOMMIT: bool, ASYNCBUS: bool}
 
 
 def setSetting(name, value):